@@ -4,7 +4,7 @@ import { useEffect, useState } from 'react';
 import { useRouter } from 'next/navigation';
 import Link from 'next/link';
 import { useAuth } from '@/lib/auth';
-import { attemptAPI } from '@/lib/api';
+import api from '@/lib/api';
 import Navbar from '@/components/Navbar';
 import Footer from '@/components/Footer';
 
@@ -21,10 +21,20 @@ interface Attempt {
   overall_grade: string;
 }
 
+interface AttemptAggregates {
+  total_count: number;
+  completed_count: number;
+  in_progress_count: number;
+  average_score: number | null;
+  best_grade: string | null;
+  latest: Attempt | null;
+}
+
 export default function DashboardPage() {
   const router = useRouter();
   const { user, loading: authLoading } = useAuth();
   const [attempts, setAttempts] = useState<Attempt[]>([]);
+  const [aggregates, setAggregates] = useState<AttemptAggregates | null>(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -41,19 +51,16 @@ export default function DashboardPage() {
 
   const loadAttempts = async () => {
     try {
-      const data = await attemptAPI.getMyAttempts();
-      // Make sure data is an array
-      if (Array.isArray(data)) {
-        setAttempts(data);
-      } else if (data && Array.isArray(data.results)) {
-        // If API returns paginated data
-        setAttempts(data.results);
-      } else {
-        setAttempts([]);
-      }
+      // Flat summary: the three latest completed attempts plus totals over all of them
+      const response = await api.get('/attempts/summary/', {
+        params: { status: 'completed', page_size: 3 },
+      });
+      setAttempts(Array.isArray(response.data?.results) ? response.data.results : []);
+      setAggregates(response.data?.aggregates ?? null);
     } catch (error) {
       console.error('Failed to load attempts:', error);
       setAttempts([]);
+      setAggregates(null);
     } finally {
       setLoading(false);
     }
@@ -71,11 +78,9 @@ export default function DashboardPage() {
     return null;
   }
 
-  const completedAttempts = attempts.filter(a => a.is_completed);
-  const averageScore = completedAttempts.length > 0
-    ? Math.round(completedAttempts.reduce((sum, a) => sum + a.total_score, 0) / completedAttempts.length)
-    : 0;
-  const latestAttempt = completedAttempts[0];
+  const completedAttempts = attempts;
+  const averageScore = aggregates?.average_score != null ? Math.round(aggregates.average_score) : 0;
+  const latestAttempt = aggregates?.latest ?? undefined;
 
   const getGradeColor = (grade: string) => {
     if (grade?.startsWith('A')) return 'text-success';
@@ -116,7 +121,7 @@ export default function DashboardPage() {
               <div className="flex items-center justify-between">
                 <div>
                   <p className="text-gray-600 text-sm font-medium">Total Assessments</p>
-                  <p className="text-3xl font-bold text-primary mt-1">{completedAttempts.length}</p>
+                  <p className="text-3xl font-bold text-primary mt-1">{aggregates?.completed_count ?? 0}</p>
                 </div>
                 <div className="w-12 h-12 bg-primary/10 rounded-full flex items-center justify-center">
                   <i className="fas fa-clipboard-list text-primary text-xl"></i>
@@ -157,7 +162,7 @@ export default function DashboardPage() {
                 <div>
                   <p className="text-gray-600 text-sm font-medium">In Progress</p>
                   <p className="text-3xl font-bold text-accent mt-1">
-                    {attempts.filter(a => !a.is_completed).length}
+                    {aggregates?.in_progress_count ?? 0}
                   </p>
                 </div>
                 <div className="w-12 h-12 bg-accent/10 rounded-full flex items-center justify-center">
@@ -226,7 +231,7 @@ export default function DashboardPage() {
                 </div>
               ) : (
                 <div className="space-y-4">
-                  {completedAttempts.slice(0, 3).map((attempt) => (
+                  {completedAttempts.map((attempt) => (
                     <Link
                       key={attempt.id}
                       href={`/results/${attempt.id}`}
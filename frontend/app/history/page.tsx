@@ -4,7 +4,7 @@ import { useEffect, useState } from 'react';
 import { useRouter } from 'next/navigation';
 import Link from 'next/link';
 import { useAuth } from '@/lib/auth';
-import { attemptAPI } from '@/lib/api';
+import api from '@/lib/api';
 import Navbar from '@/components/Navbar';
 import Footer from '@/components/Footer';
 
@@ -21,11 +21,27 @@ interface Attempt {
   overall_grade: string;
 }
 
+interface AttemptAggregates {
+  total_count: number;
+  completed_count: number;
+  in_progress_count: number;
+  average_score: number | null;
+}
+
+const STATUS_PARAMS = {
+  all: {},
+  completed: { status: 'completed' },
+  'in-progress': { status: 'in_progress' },
+};
+
 export default function HistoryPage() {
   const router = useRouter();
   const { user, loading: authLoading } = useAuth();
   const [attempts, setAttempts] = useState<Attempt[]>([]);
+  const [aggregates, setAggregates] = useState<AttemptAggregates | null>(null);
+  const [nextPage, setNextPage] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [filter, setFilter] = useState<'all' | 'completed' | 'in-progress'>('all');
 
   useEffect(() => {
@@ -38,28 +54,38 @@ export default function HistoryPage() {
     if (user) {
       loadAttempts();
     }
-  }, [user]);
+  }, [user, filter]);
 
   const loadAttempts = async () => {
     try {
-      const data = await attemptAPI.getMyAttempts();
-      // Make sure data is an array
-      if (Array.isArray(data)) {
-        setAttempts(data);
-      } else if (data && Array.isArray(data.results)) {
-        // If API returns paginated data
-        setAttempts(data.results);
-      } else {
-        setAttempts([]);
-      }
+      // Flat, cursor-paginated summary; the counts cover all attempts
+      const response = await api.get('/attempts/summary/', { params: STATUS_PARAMS[filter] });
+      setAttempts(Array.isArray(response.data?.results) ? response.data.results : []);
+      setAggregates(response.data?.aggregates ?? null);
+      setNextPage(response.data?.next ?? null);
     } catch (error) {
       console.error('Failed to load attempts:', error);
       setAttempts([]);
+      setNextPage(null);
     } finally {
       setLoading(false);
     }
   };
 
+  const loadMore = async () => {
+    if (!nextPage) return;
+    setLoadingMore(true);
+    try {
+      const response = await api.get(nextPage);
+      setAttempts(prev => [...prev, ...(response.data?.results ?? [])]);
+      setNextPage(response.data?.next ?? null);
+    } catch (error) {
+      console.error('Failed to load more attempts:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   if (authLoading || loading) {
     return (
       <div className="min-h-screen flex items-center justify-center">
@@ -72,11 +98,10 @@ export default function HistoryPage() {
     return null;
   }
 
-  const filteredAttempts = attempts.filter(a => {
-    if (filter === 'completed') return a.is_completed;
-    if (filter === 'in-progress') return !a.is_completed;
-    return true;
-  });
+  const filteredAttempts = attempts;
+  const totalCount = aggregates?.total_count ?? 0;
+  const completedCount = aggregates?.completed_count ?? 0;
+  const inProgressCount = aggregates?.in_progress_count ?? 0;
 
   const getGradeColor = (grade: string) => {
     if (grade?.startsWith('A')) return 'text-success';
@@ -115,30 +140,25 @@ export default function HistoryPage() {
           <div className="grid md:grid-cols-4 gap-6 mb-8">
             <div className="bg-white rounded-xl shadow p-6">
               <p className="text-gray-600 text-sm">Total</p>
-              <p className="text-3xl font-bold text-primary">{attempts.length}</p>
+              <p className="text-3xl font-bold text-primary">{totalCount}</p>
             </div>
             <div className="bg-white rounded-xl shadow p-6">
               <p className="text-gray-600 text-sm">Completed</p>
               <p className="text-3xl font-bold text-success">
-                {attempts.filter(a => a.is_completed).length}
+                {completedCount}
               </p>
             </div>
             <div className="bg-white rounded-xl shadow p-6">
               <p className="text-gray-600 text-sm">In Progress</p>
               <p className="text-3xl font-bold text-warning">
-                {attempts.filter(a => !a.is_completed).length}
+                {inProgressCount}
               </p>
             </div>
             <div className="bg-white rounded-xl shadow p-6">
               <p className="text-gray-600 text-sm">Average Score</p>
               <p className="text-3xl font-bold text-accent">
-                {attempts.filter(a => a.is_completed).length > 0
-                  ? Math.round(
-                      attempts
-                        .filter(a => a.is_completed)
-                        .reduce((sum, a) => sum + a.total_score, 0) /
-                        attempts.filter(a => a.is_completed).length
-                    )
+                {aggregates?.average_score != null
+                  ? Math.round(aggregates.average_score)
                   : '-'}
               </p>
             </div>
@@ -155,7 +175,7 @@ export default function HistoryPage() {
                     : 'bg-gray-100 text-gray-600 hover:bg-gray-200'
                 }`}
               >
-                All ({attempts.length})
+                All ({totalCount})
               </button>
               <button
                 onClick={() => setFilter('completed')}
@@ -165,7 +185,7 @@ export default function HistoryPage() {
                     : 'bg-gray-100 text-gray-600 hover:bg-gray-200'
                 }`}
               >
-                Completed ({attempts.filter(a => a.is_completed).length})
+                Completed ({completedCount})
               </button>
               <button
                 onClick={() => setFilter('in-progress')}
@@ -175,7 +195,7 @@ export default function HistoryPage() {
                     : 'bg-gray-100 text-gray-600 hover:bg-gray-200'
                 }`}
               >
-                In Progress ({attempts.filter(a => !a.is_completed).length})
+                In Progress ({inProgressCount})
               </button>
             </div>
           </div>
@@ -313,6 +333,17 @@ export default function HistoryPage() {
                   )}
                 </div>
               ))}
+              {nextPage && (
+                <div className="text-center pt-4">
+                  <button
+                    onClick={loadMore}
+                    disabled={loadingMore}
+                    className="px-6 py-3 bg-white text-primary rounded-lg font-semibold shadow hover:shadow-lg transition-all disabled:opacity-50"
+                  >
+                    {loadingMore ? 'Loading...' : 'Load more'}
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
@@ -27,6 +27,24 @@ interface Answer {
   choices_ids?: number[];
 }
 
+interface SavedAnswer {
+  question: number;
+  choice: number | null;
+  choices_ids: number[];
+}
+
+const toAnswerMap = (saved: SavedAnswer[]) => {
+  const map = new Map<number, Answer>();
+  for (const item of saved) {
+    if (item.choices_ids.length > 0) {
+      map.set(item.question, { question: item.question, choices_ids: item.choices_ids });
+    } else if (item.choice) {
+      map.set(item.question, { question: item.question, choice: item.choice });
+    }
+  }
+  return map;
+};
+
 export default function QuestionnairePage() {
   const router = useRouter();
   const params = useParams();
@@ -37,6 +55,8 @@ export default function QuestionnairePage() {
   const [currentIndex, setCurrentIndex] = useState(0);
   const [answers, setAnswers] = useState<Map<number, Answer>>(new Map());
   const [attemptId, setAttemptId] = useState<number | null>(null);
+  const [revision, setRevision] = useState(0);
+  const [dirty, setDirty] = useState<Set<number>>(new Set());
   const [loading, setLoading] = useState(true);
   const [submitting, setSubmitting] = useState(false);
   const [uploadedFiles, setUploadedFiles] = useState<Map<number, File[]>>(new Map());
@@ -58,6 +78,7 @@ export default function QuestionnairePage() {
       // Create attempt
       const attempt = await attemptAPI.createAttempt(surveyId);
       setAttemptId(attempt.id);
+      setRevision(attempt.revision ?? 0);
 
       // Load questions
       const response = await api.get(`/surveys/${surveyId}/questions/`);
@@ -98,6 +119,7 @@ export default function QuestionnairePage() {
     }
     
     setAnswers(newAnswers);
+    setDirty(new Set(dirty).add(questionId));
   };
 
   const handleFileUpload = (questionId: number, files: FileList | null) => {
@@ -125,23 +147,26 @@ export default function QuestionnairePage() {
     setUploadedFiles(newFiles);
   };
 
-  const saveAnswer = async (questionId: number) => {
-    const answer = answers.get(questionId);
-    if (!answer || !attemptId) return;
+  const saveAnswers = async () => {
+    if (!attemptId || answers.size === 0) return;
 
     try {
-      // Save answer
-      const response = await api.post('/answers/', {
-        attempt: attemptId,
-        ...answer
+      // Save every answer in one request
+      const response = await api.post(`/attempts/${attemptId}/answers:batch/`, {
+        answers: Array.from(answers.values()),
       });
 
       // Upload files if any
-      const files = uploadedFiles.get(questionId);
-      if (files && files.length > 0 && response.data.id) {
+      const answerIds = new Map<number, number>(
+        response.data.answers.map((saved: { id: number; question: number }) => [saved.question, saved.id])
+      );
+      for (const [questionId, files] of Array.from(uploadedFiles.entries())) {
+        const answerId = answerIds.get(questionId);
+        if (!answerId) continue;
+
         for (const file of files) {
           const formData = new FormData();
-          formData.append('answer', response.data.id.toString());
+          formData.append('answer', answerId.toString());
           formData.append('title', file.name);
           formData.append('file', file);
 
@@ -153,17 +178,41 @@ export default function QuestionnairePage() {
         }
       }
     } catch (error) {
-      console.error('Failed to save answer:', error);
+      console.error('Failed to save answers:', error);
+      throw error;
+    }
+  };
+
+  const autosave = async () => {
+    if (!attemptId || dirty.size === 0) return;
+
+    // Send only the questions changed since the last save
+    const changed = Array.from(dirty);
+    try {
+      const response = await api.post(`/attempts/${attemptId}/autosave/`, {
+        base_revision: revision,
+        answers: changed.filter(id => answers.has(id)).map(id => answers.get(id)),
+        cleared: changed.filter(id => !answers.has(id)),
+      });
+      setRevision(response.data.revision);
+      setDirty(new Set());
+    } catch (error: any) {
+      if (error.response?.status === 409) {
+        // Answers were saved from another tab: continue from the server state
+        setAnswers(toAnswerMap(error.response.data.answers));
+        setRevision(error.response.data.revision);
+        setDirty(new Set());
+        alert('Your answers were changed in another window. The latest saved answers have been loaded.');
+        return;
+      }
       throw error;
     }
   };
 
   const handleNext = async () => {
-    const currentQuestion = questions[currentIndex];
-    
     try {
-      await saveAnswer(currentQuestion.id);
-      
+      await autosave();
+
       if (currentIndex < questions.length - 1) {
         setCurrentIndex(currentIndex + 1);
       }
@@ -192,8 +241,8 @@ export default function QuestionnairePage() {
     
     setSubmitting(true);
     try {
-      // Save last answer
-      await saveAnswer(currentQuestion.id);
+      // Save all answers
+      await saveAnswers();
 
       // Complete attempt
       await attemptAPI.completeAttempt(attemptId);
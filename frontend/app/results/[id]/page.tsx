@@ -4,7 +4,7 @@ import { useEffect, useState } from 'react';
 import { useRouter, useParams } from 'next/navigation';
 import Link from 'next/link';
 import { useAuth } from '@/lib/auth';
-import { attemptAPI } from '@/lib/api';
+import api, { attemptAPI } from '@/lib/api';
 import Navbar from '@/components/Navbar';
 import Footer from '@/components/Footer';
 
@@ -53,6 +53,7 @@ export default function ResultsPage() {
   
   const [attempt, setAttempt] = useState<Attempt | null>(null);
   const [loading, setLoading] = useState(true);
+  const [finalizing, setFinalizing] = useState(false);
 
   useEffect(() => {
     if (!authLoading && !user) {
@@ -66,8 +67,22 @@ export default function ResultsPage() {
     }
   }, [user, attemptId]);
 
+  const waitForFinalize = async () => {
+    // Scores and the report are built in the background after completion
+    for (let poll = 0; poll < 60; poll++) {
+      const response = await api.get(`/attempts/${attemptId}/status/`);
+      if (response.data.state !== 'finalizing') {
+        return;
+      }
+      setFinalizing(true);
+      await new Promise((resolve) => setTimeout(resolve, Math.min(500 * (poll + 1), 3000)));
+    }
+  };
+
   const loadResults = async () => {
     try {
+      await waitForFinalize();
+      setFinalizing(false);
       const data = await attemptAPI.getAttempt(attemptId);
       setAttempt(data);
     } catch (error) {
@@ -100,7 +115,9 @@ export default function ResultsPage() {
   if (authLoading || loading) {
     return (
       <div className="min-h-screen flex items-center justify-center">
-        <div className="text-2xl text-primary">Loading results...</div>
+        <div className="text-2xl text-primary">
+          {finalizing ? 'Calculating your results...' : 'Loading results...'}
+        </div>
       </div>
     );
   }
@@ -3,6 +3,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth import get_user_model
+from sustindex.sparse_fields import SparseFieldsViewMixin
 from .models import CompanyProfile, MembershipHistory
 from .serializers import (
     UserSerializer, UserRegistrationSerializer,
@@ -12,15 +13,17 @@ from .serializers import (
 User = get_user_model()
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return User.objects.all()
-        return User.objects.filter(id=self.request.user.id)
+            queryset = User.objects.all()
+        else:
+            queryset = User.objects.filter(id=self.request.user.id)
+        return self.sparse_queryset(queryset)
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def me(self, request):
@@ -39,26 +42,30 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CompanyProfileViewSet(viewsets.ModelViewSet):
+class CompanyProfileViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = CompanyProfile.objects.all()
     serializer_class = CompanyProfileSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return CompanyProfile.objects.all()
-        return CompanyProfile.objects.filter(user=self.request.user)
+            queryset = CompanyProfile.objects.all()
+        else:
+            queryset = CompanyProfile.objects.filter(user=self.request.user)
+        return self.sparse_queryset(queryset)
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class MembershipHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+class MembershipHistoryViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     queryset = MembershipHistory.objects.all()
     serializer_class = MembershipHistorySerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return MembershipHistory.objects.all()
-        return MembershipHistory.objects.filter(user=self.request.user)
+            queryset = MembershipHistory.objects.all()
+        else:
+            queryset = MembershipHistory.objects.filter(user=self.request.user)
+        return self.sparse_queryset(queryset)
@@ -1,11 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from sustindex.sparse_fields import SparseFieldsMixin
 from .models import CompanyProfile, MembershipHistory
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 
@@ -33,7 +34,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
-class CompanyProfileSerializer(serializers.ModelSerializer):
+class CompanyProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     
     class Meta:
@@ -41,7 +42,7 @@ class CompanyProfileSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class MembershipHistorySerializer(serializers.ModelSerializer):
+class MembershipHistorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = MembershipHistory
         fields = '__all__'
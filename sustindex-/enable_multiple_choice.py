@@ -13,6 +13,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sustindex.settings')
 django.setup()
 
 from questionnaire.models import Question
+from questionnaire.services import structure_changed
+from questionnaire.jobs import enqueue_for_questions
 
 def enable_multiple_choice():
     """Enable allow_multiple for all questions"""
@@ -25,7 +27,10 @@ def enable_multiple_choice():
     print("Enabling multiple choice for all questions...")
     
     # Update all questions
+    question_ids = list(questions.values_list('id', flat=True))
     updated = questions.update(allow_multiple=True)
+    structure_changed()
+    enqueue_for_questions(question_ids, 'allow_multiple enabled for all questions')
     
     print(f"✅ Successfully updated {updated} questions")
     print("All questions now support multiple choice selection!")
@@ -13,6 +13,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sustindex.settings')
 django.setup()
 
 from questionnaire.models import Question, Category
+from questionnaire.services import structure_changed
+from questionnaire.jobs import enqueue_for_questions
 
 def show_questions():
     """Show all questions with their multiple choice status"""
@@ -34,19 +36,29 @@ def show_questions():
 
 def enable_all():
     """Enable multiple choice for ALL questions"""
+    question_ids = list(Question.objects.values_list('id', flat=True))
     count = Question.objects.update(allow_multiple=True)
+    structure_changed()
+    enqueue_for_questions(question_ids, 'allow_multiple enabled')
     print(f"\n✅ Enabled multiple choice for {count} questions")
 
 def disable_all():
     """Disable multiple choice for ALL questions"""
+    question_ids = list(Question.objects.values_list('id', flat=True))
     count = Question.objects.update(allow_multiple=False)
+    structure_changed()
+    enqueue_for_questions(question_ids, 'allow_multiple disabled')
     print(f"\n❌ Disabled multiple choice for {count} questions")
 
 def enable_by_category(category_name):
     """Enable multiple choice for questions in a specific category"""
     try:
         category = Category.objects.get(name__icontains=category_name)
-        count = Question.objects.filter(category=category).update(allow_multiple=True)
+        questions = Question.objects.filter(category=category)
+        question_ids = list(questions.values_list('id', flat=True))
+        count = questions.update(allow_multiple=True)
+        structure_changed()
+        enqueue_for_questions(question_ids, 'allow_multiple enabled')
         print(f"\n✅ Enabled multiple choice for {count} questions in '{category.name}'")
     except Category.DoesNotExist:
         print(f"\n❌ Category '{category_name}' not found")
@@ -54,11 +66,15 @@ def enable_by_category(category_name):
 def enable_by_ids(question_ids):
     """Enable multiple choice for specific question IDs"""
     count = Question.objects.filter(id__in=question_ids).update(allow_multiple=True)
+    structure_changed()
+    enqueue_for_questions(question_ids, 'allow_multiple enabled')
     print(f"\n✅ Enabled multiple choice for {count} questions")
 
 def disable_by_ids(question_ids):
     """Disable multiple choice for specific question IDs"""
     count = Question.objects.filter(id__in=question_ids).update(allow_multiple=False)
+    structure_changed()
+    enqueue_for_questions(question_ids, 'allow_multiple disabled')
     print(f"\n❌ Disabled multiple choice for {count} questions")
 
 def interactive_menu():
@@ -1,10 +1,15 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import FilteredSelectMultiple
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html, strip_tags
-from django.db import transaction
+from django.db.models import Count, Q, F, Func, IntegerField, OuterRef, Subquery
 from django.utils import timezone
-from django.urls import reverse
+from django.urls import reverse, path
 from django.utils.safestring import mark_safe
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+import json
 
 try:
     from dal import autocomplete
@@ -15,6 +20,8 @@ except ImportError:
 from import_export.admin import ImportExportModelAdmin
 from simple_history.admin import SimpleHistoryAdmin
 
+from sustindex.conditional import bump_table_versions
+
 try:
     from django_admin_listfilter_dropdown.filters import RelatedDropdownFilter
     DROPDOWN_FILTER_AVAILABLE = True
@@ -22,8 +29,25 @@ except ImportError:
     DROPDOWN_FILTER_AVAILABLE = False
     RelatedDropdownFilter = None
 
-from .models import Survey, SurveySession, Category, Question, Choice, QuestionnaireAttempt, Answer, UserDocument
-from .services import recalc_attempt_score, attempt_stats, get_category_performance
+from .models import Survey, SurveySession, Category, Question, Choice, QuestionnaireAttempt, Answer, UserDocument, BackgroundJob
+from .services import (
+    recalc_attempt_score, attempt_stats, get_category_performance, refresh_category_scores,
+    structure_changed, annotate_attempt_stats,
+)
+from .bulk_scoring import rescore_attempts
+from .cloning import clone_survey, clone_questions
+from .exports import export_response
+from .simulator import simulate, SimulationError
+from .jobs import enqueue_rescore, enqueue_for_questions, retry_jobs, queue_stats
+from .summaries import invalidate_attempt_summaries
+
+
+def count_subquery(queryset):
+    """Number of rows of a queryset correlated with OuterRef(), as an annotation"""
+    return Subquery(
+        queryset.order_by().annotate(count=Func(F('pk'), function='COUNT')).values('count'),
+        output_field=IntegerField(),
+    )
 
 
 # ========== Survey Admin ==========
@@ -46,27 +70,99 @@ class SurveyAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
         }),
     )
     
-    actions = ['duplicate_survey', 'activate_surveys', 'deactivate_surveys']
+    actions = ['duplicate_survey', 'activate_surveys', 'deactivate_surveys', 'open_weight_simulator']
+    
+    def get_queryset(self, request):
+        # One correlated count per relation: joining questions, sessions and
+        # attempts together would multiply their rows for every survey
+        questions = Question.objects.filter(survey=OuterRef('pk'), is_active=True)
+        sessions = SurveySession.objects.filter(survey=OuterRef('pk'))
+        attempts = QuestionnaireAttempt.objects.filter(survey=OuterRef('pk'))
+        return super().get_queryset(request).annotate(
+            active_question_count=count_subquery(questions),
+            session_count=count_subquery(sessions),
+            active_session_count=count_subquery(sessions.filter(is_active=True)),
+            attempt_count=count_subquery(attempts),
+            completed_attempt_count=count_subquery(attempts.filter(is_completed=True)),
+        )
     
-    @admin.display(description=_('Questions'))
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:survey_id>/weight-simulator/',
+                self.admin_site.admin_view(self.weight_simulator_view),
+                name='questionnaire_survey_weight_simulator',
+            ),
+        ]
+        return urls + super().get_urls()
+    
+    def weight_simulator_view(self, request, survey_id):
+        """Compare current category weights with a candidate set on all completed attempts"""
+        survey = get_object_or_404(Survey, pk=survey_id)
+        categories = list(Category.objects.all())
+        thresholds_text = ''
+        result = None
+        error = None
+        
+        if request.method == 'POST':
+            weights = {}
+            for category in categories:
+                weights[category.id] = {
+                    component: request.POST.get(f'{component}_{category.id}', '')
+                    for component in ('environmental', 'social', 'governance')
+                }
+                weights[category.id] = {k: v for k, v in weights[category.id].items() if v != ''}
+            thresholds_text = request.POST.get('thresholds', '').strip()
+            try:
+                thresholds = json.loads(thresholds_text) if thresholds_text else None
+                result = simulate(survey.id, [{'name': _('Candidate'), 'weights': weights, 'thresholds': thresholds}])
+            except (SimulationError, ValueError) as e:
+                error = str(e)
+            except RuntimeError as e:
+                error = str(e)
+        
+        rows = []
+        for category in categories:
+            rows.append({
+                'category': category,
+                'candidate': {
+                    component: request.POST.get(f'{component}_{category.id}', getattr(category, f'{component}_weight'))
+                    for component in ('environmental', 'social', 'governance')
+                },
+            })
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': _('Weight simulator: %(survey)s') % {'survey': survey.name},
+            'survey': survey,
+            'rows': rows,
+            'thresholds_text': thresholds_text,
+            'result': result,
+            'candidate': result['candidates'][0] if result else None,
+            'error': error,
+        }
+        return TemplateResponse(request, 'admin/questionnaire/survey/weight_simulator.html', context)
+    
+    @admin.display(description=_('Questions'), ordering='active_question_count')
     def questions_count(self, obj):
-        count = obj.get_total_questions()
+        count = obj.active_question_count
         return format_html('<strong>{}</strong> questions', count)
     
-    @admin.display(description=_('Sessions'))
+    @admin.display(description=_('Sessions'), ordering='session_count')
     def sessions_count(self, obj):
-        total = obj.sessions.count()
-        active = obj.get_active_sessions().count()
+        total = obj.session_count
+        active = obj.active_session_count
         return format_html(
             '<strong>{}</strong> total<br>'
             '<small style="color: #28A745;">{} active</small>',
             total, active
         )
     
-    @admin.display(description=_('Attempts'))
+    @admin.display(description=_('Attempts'), ordering='attempt_count')
     def attempts_count(self, obj):
-        total = obj.attempts.count()
-        completed = obj.attempts.filter(is_completed=True).count()
+        total = obj.attempt_count
+        completed = obj.completed_attempt_count
         return format_html(
             '<strong>{}</strong> total<br>'
             '<small style="color: #28A745;">{} completed</small>',
@@ -76,35 +172,25 @@ class SurveyAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
     @admin.action(description=_('Duplicate selected surveys'))
     def duplicate_survey(self, request, queryset):
         for survey in queryset:
-            new_survey = Survey.objects.create(
-                name=f"{survey.name} (Copy)",
-                description=survey.description,
-                is_active=False,
-                allow_multiple_attempts=survey.allow_multiple_attempts,
-                show_results_immediately=survey.show_results_immediately
-            )
-            
-            for question in survey.questions.all():
-                old_choices = list(question.choices.all())
-                question.pk = None
-                question.survey = new_survey
-                question.save()
-                
-                for choice in old_choices:
-                    choice.pk = None
-                    choice.question = question
-                    choice.save()
+            clone_survey(survey)
         
         self.message_user(request, _('Surveys duplicated successfully.'))
     
+    @admin.action(description=_('Open weight simulator'))
+    def open_weight_simulator(self, request, queryset):
+        survey = queryset.first()
+        return redirect('admin:questionnaire_survey_weight_simulator', survey_id=survey.pk)
+    
     @admin.action(description=_('Activate selected surveys'))
     def activate_surveys(self, request, queryset):
         updated = queryset.update(is_active=True)
+        bump_table_versions([Survey])
         self.message_user(request, _(f'{updated} surveys activated.'))
     
     @admin.action(description=_('Deactivate selected surveys'))
     def deactivate_surveys(self, request, queryset):
         updated = queryset.update(is_active=False)
+        bump_table_versions([Survey])
         self.message_user(request, _(f'{updated} surveys deactivated.'))
 
 
@@ -116,6 +202,7 @@ class SurveySessionAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
     list_filter = ['survey' if not DROPDOWN_FILTER_AVAILABLE else ('survey', RelatedDropdownFilter), 'is_active', 'start_date', 'end_date']
     search_fields = ['name', 'description', 'survey__name']
     date_hierarchy = 'start_date'
+    list_select_related = ['survey']
     list_per_page = 50
     
     fieldsets = (
@@ -129,6 +216,12 @@ class SurveySessionAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
     
     actions = ['activate_sessions', 'deactivate_sessions']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            attempt_count=Count('attempts'),
+            completed_attempt_count=Count('attempts', filter=Q(attempts__is_completed=True)),
+        )
+    
     @admin.display(description=_('Status'))
     def status_badge(self, obj):
         status = obj.get_status()
@@ -154,10 +247,10 @@ class SurveySessionAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
             color, icon, obj.get_status_display()
         )
     
-    @admin.display(description=_('Attempts'))
+    @admin.display(description=_('Attempts'), ordering='attempt_count')
     def attempts_count(self, obj):
-        count = obj.attempts.count()
-        completed = obj.attempts.filter(is_completed=True).count()
+        count = obj.attempt_count
+        completed = obj.completed_attempt_count
         return format_html(
             '<strong>{}</strong> total<br>'
             '<small style="color: #28A745;">{} completed</small>',
@@ -167,11 +260,13 @@ class SurveySessionAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
     @admin.action(description=_('Activate selected sessions'))
     def activate_sessions(self, request, queryset):
         updated = queryset.update(is_active=True)
+        bump_table_versions([SurveySession])
         self.message_user(request, _(f'{updated} sessions activated.'))
     
     @admin.action(description=_('Deactivate selected sessions'))
     def deactivate_sessions(self, request, queryset):
         updated = queryset.update(is_active=False)
+        bump_table_versions([SurveySession])
         self.message_user(request, _(f'{updated} sessions deactivated.'))
 
 
@@ -242,6 +337,11 @@ class CategoryAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            active_question_count=Count('questions', filter=Q(questions__is_active=True)),
+        )
+    
     @admin.display(description=_('Weights'))
     def score_weights(self, obj):
         return format_html(
@@ -253,9 +353,9 @@ class CategoryAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
             obj.governance_weight
         )
     
-    @admin.display(description=_('Questions'))
+    @admin.display(description=_('Questions'), ordering='active_question_count')
     def question_count(self, obj):
-        count = obj.questions.filter(is_active=True).count()
+        count = obj.active_question_count
         return format_html('<strong>{}</strong> questions', count)
 
 
@@ -269,6 +369,7 @@ class QuestionAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
     search_fields = ['text']
     ordering = ['survey', 'category', 'order']
     inlines = [ChoiceInline]
+    list_select_related = ['survey', 'category']
     list_per_page = 50
     
     fieldsets = (
@@ -290,46 +391,43 @@ class QuestionAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
     
     actions = ['activate_questions', 'deactivate_questions', 'duplicate_questions']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(choice_total=Count('choices'))
+    
     @admin.display(description=_('Question Text'))
     def text_preview(self, obj):
         plain = strip_tags(obj.text or "").strip()
         preview = (plain[:80] + '...') if len(plain) > 80 else plain
         return format_html('<span title="{}">{}</span>', plain, preview)
     
-    @admin.display(description=_('Choices'))
+    @admin.display(description=_('Choices'), ordering='choice_total')
     def choice_count(self, obj):
-        count = obj.choices.count()
+        count = obj.choice_total
         if count > 0:
             return format_html('<span style="color: green;">✓ {}</span>', count)
         return format_html('<span style="color: red;">⚠ 0</span>')
     
     @admin.action(description=_('Activate selected questions'))
     def activate_questions(self, request, queryset):
+        survey_ids = set(queryset.values_list('survey_id', flat=True))
+        question_ids = list(queryset.values_list('pk', flat=True))
         updated = queryset.update(is_active=True)
+        structure_changed(survey_ids)
+        enqueue_for_questions(question_ids, 'Activated from admin')
         self.message_user(request, _(f'{updated} questions activated successfully.'))
     
     @admin.action(description=_('Deactivate selected questions'))
     def deactivate_questions(self, request, queryset):
+        survey_ids = set(queryset.values_list('survey_id', flat=True))
+        question_ids = list(queryset.values_list('pk', flat=True))
         updated = queryset.update(is_active=False)
+        structure_changed(survey_ids)
+        enqueue_for_questions(question_ids, 'Deactivated from admin')
         self.message_user(request, _(f'{updated} questions deactivated successfully.'))
     
     @admin.action(description=_('Duplicate selected questions (with choices)'))
     def duplicate_questions(self, request, queryset):
-        duplicated = 0
-        with transaction.atomic():
-            for question in queryset.prefetch_related('choices'):
-                old_choices = list(question.choices.all())
-                question.pk = None
-                question.text = f"{question.text} (Copy)"
-                question.is_active = False
-                question.save()
-                
-                for choice in old_choices:
-                    choice.pk = None
-                    choice.question = question
-                    choice.save()
-                
-                duplicated += 1
+        duplicated = len(clone_questions(queryset.order_by('pk'))['questions'])
         
         self.message_user(request, _(f'{duplicated} questions duplicated successfully.'))
 
@@ -386,7 +484,11 @@ class QuestionnaireAttemptAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
         }),
     )
     
-    actions = ['recalculate_scores', 'mark_as_completed', 'export_results']
+    actions = ['recalculate_scores', 'recalculate_scores_bulk', 'mark_as_completed', 'export_results', 'export_results_xlsx']
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).select_related('user', 'survey', 'session')
+        return annotate_attempt_stats(queryset)
     
     @admin.display(description=_('User'))
     def user_info(self, obj):
@@ -491,25 +593,59 @@ class QuestionnaireAttemptAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
             count += 1
         self.message_user(request, _(f'{count} attempts recalculated successfully.'))
     
+    @admin.action(description=_('Recalculate scores (bulk mode)'))
+    def recalculate_scores_bulk(self, request, queryset):
+        count = rescore_attempts(queryset)
+        self.message_user(request, _(f'{count} attempts recalculated successfully.'))
+    
     @admin.action(description=_('Mark as completed'))
     def mark_as_completed(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         updated = queryset.update(is_completed=True, completed_at=timezone.now())
+        invalidate_attempt_summaries(user_ids)
         self.message_user(request, _(f'{updated} attempts marked as completed.'))
     
     @admin.action(description=_('Export results to CSV'))
     def export_results(self, request, queryset):
-        self.message_user(request, _('Export functionality coming soon!'))
+        return export_response(queryset, 'csv')
+    
+    @admin.action(description=_('Export results to Excel'))
+    def export_results_xlsx(self, request, queryset):
+        return export_response(queryset, 'xlsx')
 
 
 # ========== Answer Admin ==========
 
+class AnswerAdminForm(forms.ModelForm):
+    """Edits Answer.choice_ids through the familiar two-pane choice picker"""
+    selected_choices = forms.ModelMultipleChoiceField(
+        queryset=Choice.objects.select_related('question'),
+        required=False,
+        widget=FilteredSelectMultiple(_('Choices'), is_stacked=False),
+        label=_('Selected Choices (Multiple)'),
+    )
+    
+    class Meta:
+        model = Answer
+        exclude = ['choice_ids']
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['selected_choices'].initial = self.instance.choice_ids
+    
+    def save(self, commit=True):
+        self.instance.choice_ids = [choice.pk for choice in self.cleaned_data['selected_choices']]
+        return super().save(commit)
+
+
 @admin.register(Answer)
 class AnswerAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
+    form = AnswerAdminForm
     list_display = ['id', 'attempt', 'question', 'selected_choices_display', 'is_cannot_display', 'answered_at']
     list_filter = ['answered_at']
     search_fields = ['attempt__user__username', 'question__text']
     readonly_fields = ['answered_at', 'selected_choices_display', 'is_cannot_display']
-    filter_horizontal = ['choices']
     inlines = [UserDocumentInline]
     date_hierarchy = 'answered_at'
     list_per_page = 50
@@ -523,7 +659,7 @@ class AnswerAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
             'description': _('For single-choice questions')
         }),
         (_('Multiple Choices'), {
-            'fields': ('choices',),
+            'fields': ('selected_choices',),
             'description': _('For multiple-choice questions')
         }),
         (_('Selected Choices'), {
@@ -532,6 +668,25 @@ class AnswerAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
         }),
     )
     
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        self.answers_changed([form.instance.attempt])
+    
+    def delete_model(self, request, obj):
+        attempt = obj.attempt
+        super().delete_model(request, obj)
+        self.answers_changed([attempt])
+    
+    def delete_queryset(self, request, queryset):
+        attempts = list(QuestionnaireAttempt.objects.filter(answers__in=queryset).distinct())
+        super().delete_queryset(request, queryset)
+        self.answers_changed(attempts)
+    
+    def answers_changed(self, attempts):
+        for attempt in attempts:
+            refresh_category_scores(attempt)
+        enqueue_rescore([attempt.pk for attempt in attempts if attempt.is_completed], 'Answers changed in admin')
+    
     @admin.display(description=_('Selected Choices'))
     def selected_choices_display(self, obj):
         return obj.get_selected_choices_display()
@@ -560,3 +715,50 @@ class UserDocumentAdmin(ImportExportModelAdmin, SimpleHistoryAdmin):
             return format_html('<a href="{}" target="_blank">📄 Download</a>', obj.file.url)
         return '-'
 
+
+
+# ========== BackgroundJob Admin ==========
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'attempt_link', 'status_badge', 'retries', 'reason', 'created_at', 'run_after', 'finished_at']
+    list_filter = ['status', 'kind']
+    search_fields = ['reason', 'attempt__user__username', 'claimed_by']
+    readonly_fields = [field.name for field in BackgroundJob._meta.fields]
+    list_select_related = ['attempt']
+    list_per_page = 100
+    actions = ['retry_selected']
+    change_list_template = 'admin/questionnaire/backgroundjob/change_list.html'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['queue_stats'] = queue_stats()
+        return super().changelist_view(request, extra_context=extra_context)
+    
+    @admin.display(description=_('Attempt'))
+    def attempt_link(self, obj):
+        if not obj.attempt_id:
+            return '-'
+        url = reverse('admin:questionnaire_questionnaireattempt_change', args=[obj.attempt_id])
+        return format_html('<a href="{}">#{}</a>', url, obj.attempt_id)
+    
+    @admin.display(description=_('Status'))
+    def status_badge(self, obj):
+        colors = {
+            BackgroundJob.STATUS_PENDING: '#6C757D',
+            BackgroundJob.STATUS_RUNNING: '#007BFF',
+            BackgroundJob.STATUS_DONE: '#28A745',
+            BackgroundJob.STATUS_FAILED: '#DC3545',
+        }
+        return format_html(
+            '<span style="color: {}; font-weight: bold;">{}</span>',
+            colors.get(obj.status, '#000'), obj.get_status_display()
+        )
+    
+    @admin.action(description=_('Retry selected jobs'))
+    def retry_selected(self, request, queryset):
+        updated = retry_jobs(queryset)
+        self.message_user(request, _(f'{updated} jobs queued again.'))
@@ -0,0 +1,332 @@
+"""
+Write-behind buffer for answers of in-progress attempts.
+
+Most answers are overwritten again before an attempt is completed, so
+autosaves can be collected in the cache (locmem, file or Redis backend)
+instead of the Answer table. Buffered deltas are coalesced per question
+and flushed to the database:
+
+- on completion and before any write that needs real Answer rows
+  (batch saves, AnswerViewSet, document uploads),
+- when the buffer of an attempt holds MAX_ITEMS questions or is older
+  than MAX_AGE seconds,
+- by the flush_answer_buffers management command.
+
+Reads merge the buffer over the database. Buffering is off unless
+ANSWER_BUFFER['ENABLED'] is set; WRITE_THROUGH (or any cache failure)
+sends every write straight to the database, so a crash cannot lose answers.
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import QuestionnaireAttempt, Question, Choice
+from .services import CategoryScoreTracker
+from .answers import (
+    RevisionConflict, validate_delta, write_answers, delete_answers, apply_answer_delta, answer_state,
+)
+
+logger = logging.getLogger(__name__)
+
+
+BUFFER_DEFAULTS = {
+    'ENABLED': False,
+    'WRITE_THROUGH': False,
+    'CACHE': 'default',
+    'MAX_AGE': 60,
+    'MAX_ITEMS': 50,
+    'LOCK_TIMEOUT': 5,
+}
+
+INDEX_KEY = 'answer-buffer:index'
+
+
+class BufferUnavailable(Exception):
+    """The cache could not be used; callers write through instead"""
+
+
+def buffer_settings():
+    return {**BUFFER_DEFAULTS, **getattr(settings, 'ANSWER_BUFFER', {})}
+
+
+def buffering_enabled():
+    config = buffer_settings()
+    return config['ENABLED'] and not config['WRITE_THROUGH']
+
+
+def _cache():
+    return caches[buffer_settings()['CACHE']]
+
+
+def _key(attempt_id):
+    return f'answer-buffer:{attempt_id}'
+
+
+@contextmanager
+def _locked(key):
+    """Best-effort mutual exclusion through cache.add"""
+    cache = _cache()
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + buffer_settings()['LOCK_TIMEOUT']
+    try:
+        while not cache.add(lock_key, token, timeout=30):
+            if time.monotonic() > deadline:
+                raise BufferUnavailable(f'Timed out waiting for {lock_key}')
+            time.sleep(0.01)
+    except BufferUnavailable:
+        raise
+    except Exception as e:
+        raise BufferUnavailable(str(e)) from e
+    try:
+        yield cache
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def get_buffer(attempt_id):
+    """Buffered state of an attempt, or None"""
+    if not buffer_settings()['ENABLED']:
+        return None
+    try:
+        return _cache().get(_key(attempt_id))
+    except Exception:
+        logger.exception('Answer buffer unavailable for attempt %s', attempt_id)
+        return None
+
+
+def _register(cache, attempt_id, since):
+    with _locked(INDEX_KEY):
+        index = cache.get(INDEX_KEY) or {}
+        index[attempt_id] = since
+        cache.set(INDEX_KEY, index, timeout=None)
+
+
+def _unregister(cache, attempt_id):
+    with _locked(INDEX_KEY):
+        index = cache.get(INDEX_KEY) or {}
+        if index.pop(attempt_id, None) is not None:
+            cache.set(INDEX_KEY, index, timeout=None)
+
+
+def _write(attempt, buffer):
+    """Apply a buffer to the Answer table and store its revision"""
+    rows = [
+        (int(question_id), choice_id, choice_ids, notes)
+        for question_id, (choice_id, choice_ids, notes) in buffer['answers'].items()
+    ]
+    with transaction.atomic():
+        tracker = CategoryScoreTracker(attempt)
+        write_answers(attempt, rows, tracker)
+        if buffer['cleared']:
+            delete_answers(attempt, buffer['cleared'], tracker)
+        tracker.flush()
+        QuestionnaireAttempt.objects.filter(pk=attempt.pk).update(revision=buffer['revision'])
+    attempt.revision = buffer['revision']
+
+
+def buffer_delta(attempt, base_revision, rows, cleared=()):
+    """
+    Coalesce validated answer rows into the attempt's buffer.
+
+    The buffer carries the attempt's revision so the compare-and-set of
+    autosaves works without touching the database.
+
+    Returns:
+        int: the new revision
+    """
+    key = _key(attempt.pk)
+    config = buffer_settings()
+    with _locked(key) as cache:
+        try:
+            buffer = cache.get(key)
+        except Exception as e:
+            raise BufferUnavailable(str(e)) from e
+        created = buffer is None
+        if created:
+            revision = QuestionnaireAttempt.objects.filter(pk=attempt.pk).values_list('revision', flat=True).first()
+            buffer = {'revision': revision, 'since': time.time(), 'answers': {}, 'cleared': []}
+        if base_revision is not None and base_revision != buffer['revision']:
+            raise RevisionConflict(buffer['revision'])
+
+        cleared = set(cleared)
+        for question_id, choice_id, choice_ids, notes in rows:
+            previous = buffer['answers'].get(str(question_id))
+            if notes is None and previous:
+                notes = previous[2]
+            buffer['answers'][str(question_id)] = [choice_id, choice_ids, notes]
+        for question_id in cleared:
+            buffer['answers'].pop(str(question_id), None)
+        buffer['cleared'] = sorted(
+            (set(buffer['cleared']) - {row[0] for row in rows}) | cleared
+        )
+        buffer['revision'] += 1
+
+        if len(buffer['answers']) + len(buffer['cleared']) >= config['MAX_ITEMS'] \
+                or time.time() - buffer['since'] >= config['MAX_AGE']:
+            _write(attempt, buffer)
+            cache.delete(key)
+            if not created:
+                _unregister(cache, attempt.pk)
+        else:
+            try:
+                cache.set(key, buffer, timeout=None)
+            except Exception as e:
+                raise BufferUnavailable(str(e)) from e
+            if created:
+                _register(cache, attempt.pk, buffer['since'])
+
+    attempt.revision = buffer['revision']
+    return buffer['revision']
+
+
+def flush_buffer(attempt):
+    """
+    Write an attempt's buffered answers to the database.
+
+    Returns:
+        bool: whether anything was buffered
+    """
+    if not buffer_settings()['ENABLED']:
+        return False
+    key = _key(attempt.pk)
+    with _locked(key) as cache:
+        buffer = cache.get(key)
+        if buffer is None:
+            return False
+        _write(attempt, buffer)
+        cache.delete(key)
+        _unregister(cache, attempt.pk)
+    return True
+
+
+def flush_buffers(max_age=None):
+    """
+    Flush the buffers of all attempts, or only those older than max_age
+    seconds. Returns the number of attempts flushed.
+    """
+    if not buffer_settings()['ENABLED']:
+        return 0
+    index = _cache().get(INDEX_KEY) or {}
+    now = time.time()
+    due = [
+        attempt_id for attempt_id, since in index.items()
+        if max_age is None or now - since >= max_age
+    ]
+    flushed = 0
+    for attempt in QuestionnaireAttempt.objects.filter(pk__in=due):
+        flushed += flush_buffer(attempt)
+    # Attempts deleted while buffered
+    missing = set(due) - set(QuestionnaireAttempt.objects.filter(pk__in=due).values_list('pk', flat=True))
+    for attempt_id in missing:
+        _cache().delete(_key(attempt_id))
+        _unregister(_cache(), attempt_id)
+    return flushed
+
+
+def autosave(attempt, base_revision, items, cleared=()):
+    """
+    Apply an autosave delta: buffered when enabled, otherwise (or when the
+    cache fails) written through with apply_answer_delta.
+    """
+    if buffering_enabled() and not attempt.is_completed:
+        rows = validate_delta(attempt, items, cleared)
+        try:
+            return buffer_delta(attempt, base_revision, rows, cleared)
+        except BufferUnavailable:
+            logger.warning('Answer buffer unavailable, writing attempt %s through', attempt.pk)
+            flush_quietly(attempt)
+    return apply_answer_delta(attempt, base_revision, items, cleared)
+
+
+def flush_quietly(attempt):
+    """flush_buffer for write-through paths; a broken cache is logged, not raised"""
+    try:
+        return flush_buffer(attempt)
+    except BufferUnavailable:
+        logger.exception('Could not flush answer buffer of attempt %s', attempt.pk)
+        return False
+
+
+# Reads
+
+def current_revision(attempt):
+    buffer = get_buffer(attempt.pk)
+    return buffer['revision'] if buffer else attempt.revision
+
+
+def merged_answer_state(attempt):
+    """answer_state() with the buffer applied"""
+    state = {item['question']: item for item in answer_state(attempt)}
+    buffer = get_buffer(attempt.pk)
+    if buffer:
+        for question_id in buffer['cleared']:
+            state.pop(question_id, None)
+        for question_id, (choice_id, choice_ids, notes) in buffer['answers'].items():
+            state[int(question_id)] = {
+                'question': int(question_id),
+                'choice': choice_id,
+                'choices_ids': sorted(choice_ids),
+                'notes': notes,
+            }
+    return [state[question_id] for question_id in sorted(state)]
+
+
+def merge_answer_data(attempt, answers):
+    """
+    Overlay buffered answers on serialized AnswerSerializer data.
+
+    Buffered entries are flagged with pending=True; new ones have no id yet.
+    """
+    buffer = get_buffer(attempt.pk)
+    if not buffer:
+        return answers
+
+    cleared = set(buffer['cleared'])
+    pending = {int(question_id): values for question_id, values in buffer['answers'].items()}
+    questions = {
+        pk: (text, allow_multiple)
+        for pk, text, allow_multiple in Question.objects.filter(pk__in=pending).values_list('pk', 'text', 'allow_multiple')
+    }
+    choices = {
+        pk: (text, score)
+        for pk, text, score in Choice.objects.filter(question_id__in=pending).values_list('pk', 'text', 'score')
+    }
+
+    merged = []
+    by_question = {}
+    for item in answers:
+        if item['question'] in cleared and item['question'] not in pending:
+            continue
+        by_question[item['question']] = item = dict(item)
+        merged.append(item)
+    for question_id, (choice_id, choice_ids, notes) in pending.items():
+        item = by_question.get(question_id)
+        if item is None:
+            item = {'id': None, 'question': question_id, 'answered_at': None, 'documents': []}
+            merged.append(item)
+        text, allow_multiple = questions.get(question_id, ('', False))
+        if not choice_id and not choice_ids:
+            display = 'Cannot answer'
+        elif allow_multiple:
+            display = ', '.join(choices[pk][0] for pk in choice_ids if pk in choices)
+        else:
+            display = choices[choice_id][0] if choice_id in choices else '-'
+        selected = choice_ids if allow_multiple else [choice_id]
+        item.update({
+            'question_text': text,
+            'choice': choice_id,
+            'choice_text': choices[choice_id][0] if choice_id in choices else None,
+            'choices': list(choice_ids),
+            'choices_display': display,
+            'notes': notes if notes is not None else item.get('notes'),
+            'total_score': sum(choices[pk][1] for pk in selected if pk in choices),
+            'pending': True,
+        })
+    return merged
@@ -0,0 +1,289 @@
+"""
+Bulk answer writes.
+
+Saves many answers of one attempt in a single transaction: questions and
+choices are validated in memory against one prefetch and answers, including
+their multiple-choice selections (Answer.choice_ids), are upserted on the
+(attempt, question) unique constraint with a single
+bulk_create(update_conflicts=True). Stored category totals are kept in step
+through CategoryScoreTracker.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from .models import Answer, Question, Choice, QuestionnaireAttempt
+from .services import CategoryScoreTracker
+
+
+class AnswerBatchError(ValueError):
+    """Invalid answers in a batch; errors maps item index to messages"""
+
+    def __init__(self, errors):
+        super().__init__('Invalid answers')
+        self.errors = errors
+
+
+class RevisionConflict(Exception):
+    """An autosave was based on an outdated revision of the attempt's answers"""
+
+    def __init__(self, revision):
+        super().__init__(f'Answers were changed elsewhere, current revision is {revision}')
+        self.revision = revision
+
+
+def bump_revision(attempt, base_revision=None):
+    """
+    Increment the attempt's answer revision inside the caller's transaction.
+
+    With base_revision the increment is a compare-and-set: it only succeeds
+    when nobody wrote since the client read that revision, otherwise
+    RevisionConflict is raised. The row stays locked until commit, which
+    serializes concurrent writers of the same attempt.
+    """
+    attempts = QuestionnaireAttempt.objects.filter(pk=attempt.pk)
+    if base_revision is not None:
+        attempts = attempts.filter(revision=base_revision)
+    if not attempts.update(revision=F('revision') + 1):
+        raise RevisionConflict(
+            QuestionnaireAttempt.objects.filter(pk=attempt.pk).values_list('revision', flat=True).first()
+        )
+    attempt.revision = QuestionnaireAttempt.objects.filter(pk=attempt.pk).values_list('revision', flat=True).first()
+    return attempt.revision
+
+
+def answer_state(attempt):
+    """Current answers of an attempt as autosave items"""
+    return [
+        {
+            'question': question_id,
+            'choice': choice_id,
+            'choices_ids': choice_ids,
+            'notes': notes,
+        }
+        for question_id, choice_id, choice_ids, notes in Answer.objects.filter(attempt=attempt)
+        .order_by('question_id').values_list('question_id', 'choice_id', 'choice_ids', 'notes')
+    ]
+
+
+def _load_survey_structure(attempt, question_ids):
+    questions = {
+        pk: allow_multiple
+        for pk, allow_multiple in Question.objects.filter(
+            pk__in=question_ids, survey_id=attempt.survey_id,
+        ).values_list('pk', 'allow_multiple')
+    }
+    choice_questions = dict(
+        Choice.objects.filter(question_id__in=questions).values_list('pk', 'question_id')
+    )
+    return questions, choice_questions
+
+
+def validate_answer_items(attempt, items):
+    """
+    Check that every item answers a question of the attempt's survey, at most
+    once, with choices belonging to that question.
+
+    items are dicts with question, choice, choices_ids and notes keys.
+
+    Returns:
+        list: (question_id, choice_id, choice_ids, notes) tuples
+    """
+    question_ids = {item['question'] for item in items}
+    questions, choice_questions = _load_survey_structure(attempt, question_ids)
+
+    errors = {}
+    rows = []
+    seen = set()
+    for index, item in enumerate(items):
+        question_id = item['question']
+        choice_id = item.get('choice')
+        choice_ids = list(dict.fromkeys(item.get('choices_ids') or ()))
+
+        if question_id not in questions:
+            errors[index] = [f'Question {question_id} is not part of this survey']
+            continue
+        if question_id in seen:
+            errors[index] = [f'Question {question_id} is answered more than once']
+            continue
+        seen.add(question_id)
+
+        wrong = [pk for pk in [choice_id, *choice_ids] if pk is not None and choice_questions.get(pk) != question_id]
+        if wrong:
+            errors[index] = [f'Choices {wrong} do not belong to question {question_id}']
+            continue
+        if choice_ids and not questions[question_id]:
+            errors[index] = [f'Question {question_id} does not allow multiple choices']
+            continue
+
+        rows.append((question_id, choice_id, choice_ids, item.get('notes')))
+
+    if errors:
+        raise AnswerBatchError(errors)
+    return rows
+
+
+def write_answers(attempt, rows, tracker):
+    """
+    Upsert validated answer rows of an attempt.
+
+    rows are (question_id, choice_id, choice_ids, notes) tuples; notes of
+    None keeps the stored notes. Must run inside a transaction; the caller
+    flushes the tracker.
+
+    Returns:
+        dict: question id -> saved Answer
+    """
+    if not rows:
+        return {}
+
+    existing = {
+        answer.question_id: answer
+        for answer in Answer.objects.select_for_update().filter(
+            attempt=attempt, question_id__in=[row[0] for row in rows],
+        )
+    }
+    upserts = []
+    saved = {}
+    for question_id, choice_id, choice_ids, notes in rows:
+        answer = existing.get(question_id)
+        if answer is None:
+            answer = Answer(
+                attempt=attempt, question_id=question_id, choice_id=choice_id,
+                choice_ids=sorted(choice_ids), notes=notes,
+            )
+            upserts.append(answer)
+        else:
+            tracker.remove(question_id, answer.choice_ids, answer.choice_id)
+            if answer.choice_id != choice_id or answer.choice_ids != sorted(choice_ids) \
+                    or (notes is not None and answer.notes != notes):
+                answer.choice_id = choice_id
+                answer.choice_ids = sorted(choice_ids)
+                if notes is not None:
+                    answer.notes = notes
+                upserts.append(answer)
+        tracker.add(question_id, choice_ids, choice_id)
+        saved[question_id] = answer
+
+    # One INSERT ... ON CONFLICT (attempt, question) DO UPDATE for new and
+    # changed answers; a row inserted concurrently is updated, not a duplicate
+    Answer.objects.bulk_create(
+        upserts,
+        update_conflicts=True,
+        unique_fields=['attempt', 'question'],
+        update_fields=['choice', 'choice_ids', 'notes'],
+    )
+    if any(answer.pk is None for answer in upserts):
+        # Backends that cannot return ids from upserts
+        ids = dict(Answer.objects.filter(
+            attempt=attempt, question_id__in=[answer.question_id for answer in upserts],
+        ).values_list('question_id', 'pk'))
+        for answer in upserts:
+            answer.pk = ids[answer.question_id]
+
+    return saved
+
+
+def upsert_answer(attempt, question_id, choice_id=None, choice_ids=(), notes=None, tracker=None):
+    """
+    Create or replace the answer to one question of an attempt.
+
+    Re-answering a question updates the stored answer instead of failing on
+    the unique constraint. Without a tracker the category totals are flushed
+    here, otherwise the caller flushes.
+
+    Returns:
+        Answer: the saved answer
+    """
+    with transaction.atomic():
+        own_tracker = tracker is None
+        if own_tracker:
+            tracker = CategoryScoreTracker(attempt)
+        row = (question_id, choice_id, list(dict.fromkeys(choice_ids)), notes)
+        answer = write_answers(attempt, [row], tracker)[question_id]
+        if own_tracker:
+            tracker.flush()
+    return answer
+
+
+def save_answers(attempt, items):
+    """
+    Create or update the answers of an attempt in one transaction.
+
+    Returns:
+        dict: question id -> saved Answer
+    """
+    if attempt.is_completed:
+        raise AnswerBatchError({'attempt': ['Cannot modify completed attempt']})
+
+    rows = validate_answer_items(attempt, items)
+    if not rows:
+        return {}
+
+    with transaction.atomic():
+        bump_revision(attempt)
+        tracker = CategoryScoreTracker(attempt)
+        saved = write_answers(attempt, rows, tracker)
+        tracker.flush()
+
+    return saved
+
+
+def delete_answers(attempt, question_ids, tracker):
+    """Remove the answers to the given questions; runs inside the caller's transaction"""
+    answers = list(Answer.objects.filter(attempt=attempt, question_id__in=question_ids))
+    for answer in answers:
+        tracker.remove(answer.question_id, answer.choice_ids, answer.choice_id)
+    Answer.objects.filter(pk__in=[answer.pk for answer in answers]).delete()
+    return len(answers)
+
+
+def discard_choice(question_id, choice_id):
+    """
+    Drop a deleted choice from the selections of its question's answers;
+    choice_ids has no foreign key to cascade. Returns the number of answers
+    changed.
+    """
+    answers = [
+        answer for answer in Answer.objects.filter(question_id=question_id).only('pk', 'choice_ids')
+        if choice_id in answer.choice_ids
+    ]
+    for answer in answers:
+        answer.choice_ids = [pk for pk in answer.choice_ids if pk != choice_id]
+    Answer.objects.bulk_update(answers, ['choice_ids'], batch_size=1000)
+    return len(answers)
+
+
+def validate_delta(attempt, items, cleared):
+    """validate_answer_items() for autosaves, which may also clear questions"""
+    rows = validate_answer_items(attempt, items)
+    both = {row[0] for row in rows} & set(cleared)
+    if both:
+        raise AnswerBatchError({'cleared': [f'Questions {sorted(both)} are both answered and cleared']})
+    return rows
+
+
+def apply_answer_delta(attempt, base_revision, items, cleared=()):
+    """
+    Autosave: apply only the changed answers of an attempt.
+
+    items are the created or changed answers, cleared the ids of questions
+    whose answers were removed. The write is rejected with RevisionConflict
+    when the attempt's answers changed since base_revision.
+
+    Returns:
+        int: the new revision
+    """
+    if attempt.is_completed:
+        raise AnswerBatchError({'attempt': ['Cannot modify completed attempt']})
+
+    rows = validate_delta(attempt, items, cleared)
+
+    with transaction.atomic():
+        revision = bump_revision(attempt, base_revision)
+        tracker = CategoryScoreTracker(attempt)
+        write_answers(attempt, rows, tracker)
+        if cleared:
+            delete_answers(attempt, cleared, tracker)
+        tracker.flush()
+
+    return revision
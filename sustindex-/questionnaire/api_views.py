@@ -1,31 +1,136 @@
+import bisect
+import time
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser
+from rest_framework.reverse import reverse
+from rest_framework.exceptions import NotFound
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import Count, Q
 from .models import (
     Survey, SurveySession, Category, Question, Choice,
     QuestionnaireAttempt, Answer, UserDocument
 )
 from .serializers import (
-    SurveySerializer, SurveySessionSerializer, CategorySerializer,
+    SurveySerializer, SurveySummarySerializer, SurveySessionSerializer, CategorySerializer,
     QuestionSerializer, ChoiceSerializer, QuestionnaireAttemptSerializer,
-    QuestionnaireAttemptCreateSerializer, AnswerSerializer,
-    AnswerCreateSerializer, UserDocumentSerializer
+    QuestionnaireAttemptCreateSerializer, AttemptSummarySerializer, AnswerSerializer,
+    AnswerCreateSerializer, UserDocumentSerializer, AnswerBatchSerializer, AnswerAutosaveSerializer
 )
+from .services import CategoryScoreTracker, request_completion, get_score_snapshot, annotate_attempt_stats
+from .jobs import finalize_status
+from .definitions import get_survey_definition
+from .summaries import STATUS_FILTERS, SUMMARY_FIELDS, attempt_summaries, summary_aggregates, get_cached_summary, cache_summary
+from .pagination import AttemptCursorPagination, AnswerCursorPagination, AttemptSummaryPagination
+from .simulator import simulate, SimulationError
+from .answers import save_answers, bump_revision, AnswerBatchError, RevisionConflict
+from .answer_buffer import autosave, flush_quietly, merged_answer_state
+from reports.services import get_or_build_report
+from sustindex.compiled_serializers import CompiledReadViewMixin
+from sustindex.conditional import ConditionalViewMixin, VERSION_TIMEOUT, table_versions
+from sustindex.sparse_fields import SparseFieldsViewMixin, requested_fields
+
+
+def session_phase():
+    """
+    The status of the active sessions changes only when one starts or
+    ends. Returns (number of these times passed, the last one or None);
+    the sorted times are cached per version of the sessions table.
+    """
+    token, _ = table_versions([SurveySession])[SurveySession]
+    key = f'session-boundaries:{token}'
+    boundaries = cache.get(key)
+    if boundaries is None:
+        boundaries = sorted(
+            moment.timestamp()
+            for dates in SurveySession.objects.filter(is_active=True).values_list('start_date', 'end_date')
+            for moment in dates
+        )
+        cache.set(key, boundaries, VERSION_TIMEOUT)
+    passed = bisect.bisect_right(boundaries, time.time())
+    return passed, boundaries[passed - 1] if passed else None
 
 
-class SurveyViewSet(viewsets.ReadOnlyModelViewSet):
+class SurveyViewSet(ConditionalViewMixin, SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    The list returns flat summaries; retrieve nests questions and sessions.
+    Both accept ?expand=questions,sessions to choose the nested fields;
+    ?fields= / ?omit= leave out the nested fields they exclude.
+    """
     queryset = Survey.objects.filter(is_active=True)
     serializer_class = SurveySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    conditional_models = (Survey, SurveySession, Question, Choice, Category)
+    conditional_actions = ('list', 'retrieve', 'sessions')
+    
+    def conditional_state(self):
+        return session_phase()
+    
+    def get_expand(self):
+        """Nested fields requested with ?expand=, or None when not given"""
+        expand = self.request.query_params.get('expand')
+        if expand is None:
+            return None
+        return {name.strip() for name in expand.split(',')} & set(SurveySerializer.EXPANDABLE_FIELDS)
+    
+    def get_nested_fields(self):
+        nested = self.get_expand()
+        if nested is None:
+            nested = set(SurveySerializer.EXPANDABLE_FIELDS) if self.action == 'retrieve' else set()
+        keep = requested_fields(self.request, SurveySerializer.EXPANDABLE_FIELDS)
+        if keep is not None:
+            nested &= set(keep)
+        return nested
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        
+        return queryset.annotate(
+            active_question_count=Count('questions', filter=Q(questions__is_active=True), distinct=True),
+            session_count=Count('sessions', distinct=True),
+        ).order_by(*Survey._meta.ordering)
+    
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve') and not self.get_nested_fields():
+            return SurveySummarySerializer
+        return SurveySerializer
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_nested_fields()
+        return context
     
     @action(detail=True, methods=['get'])
     def questions(self, request, pk=None):
-        survey = self.get_object()
-        questions = survey.questions.filter(is_active=True).order_by('category', 'order')
-        serializer = QuestionSerializer(questions, many=True)
-        return Response(serializer.data)
+        """
+        Active questions with their choices, served from the pre-serialized
+        survey definition with a strong ETag; If-None-Match gets a 304.
+        """
+        try:
+            structure_version = self.get_queryset().filter(pk=pk).values_list(
+                'structure_version', flat=True
+            ).first()
+        except (TypeError, ValueError):
+            structure_version = None
+        if structure_version is None:
+            raise NotFound()
+        
+        definition = get_survey_definition(pk, structure_version)
+        response = get_conditional_response(request, etag=definition.etag)
+        if response is None:
+            response = HttpResponse(definition.content, content_type='application/json')
+        response['ETag'] = definition.etag
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+        return response
     
     @action(detail=True, methods=['get'])
     def sessions(self, request, pk=None):
@@ -33,12 +138,45 @@ class SurveyViewSet(viewsets.ReadOnlyModelViewSet):
         sessions = survey.sessions.filter(is_active=True)
         serializer = SurveySessionSerializer(sessions, many=True)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
+    def simulate_weights(self, request, pk=None):
+        """
+        Evaluate candidate category weights and grade thresholds against all
+        completed attempts of the survey without changing stored scores.
+        
+        Body: {"candidates": [{"name": "...", "weights": {"<category_id>":
+        {"environmental": 0.5, "social": 0.3, "governance": 0.2}},
+        "thresholds": [[80, "A+"], [70, "A"], ...]}], "top": 10}
+        """
+        survey = get_object_or_404(Survey, pk=pk)
+        candidates = request.data.get('candidates')
+        if not isinstance(candidates, list) or not candidates or not all(isinstance(c, dict) for c in candidates):
+            return Response(
+                {'error': 'candidates must be a non-empty list of objects'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            result = simulate(survey.id, candidates, top=int(request.data.get('top', 10)))
+        except (SimulationError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except RuntimeError as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        return Response(result)
 
 
-class SurveySessionViewSet(viewsets.ReadOnlyModelViewSet):
+class SurveySessionViewSet(ConditionalViewMixin, SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     queryset = SurveySession.objects.filter(is_active=True)
     serializer_class = SurveySessionSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    sparse_actions = ('list', 'retrieve', 'open_sessions')
+    conditional_models = (SurveySession,)
+    conditional_actions = ('list', 'retrieve', 'open_sessions')
+    
+    def conditional_state(self):
+        return session_phase()
     
     @action(detail=False, methods=['get'])
     def open_sessions(self, request):
@@ -48,20 +186,22 @@ class SurveySessionViewSet(viewsets.ReadOnlyModelViewSet):
             start_date__lte=now,
             end_date__gte=now
         )
-        serializer = self.get_serializer(sessions, many=True)
+        serializer = self.get_serializer(self.sparse_queryset(sessions), many=True)
         return Response(serializer.data)
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(ConditionalViewMixin, CompiledReadViewMixin, SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all().order_by('order')
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    conditional_models = (Category, Question, Choice)
 
 
-class QuestionViewSet(viewsets.ReadOnlyModelViewSet):
+class QuestionViewSet(ConditionalViewMixin, CompiledReadViewMixin, SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Question.objects.filter(is_active=True)
     serializer_class = QuestionSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    conditional_models = (Question, Choice, Category)
     
     def get_queryset(self):
         queryset = Question.objects.filter(is_active=True)
@@ -73,18 +213,26 @@ class QuestionViewSet(viewsets.ReadOnlyModelViewSet):
         if category_id:
             queryset = queryset.filter(category_id=category_id)
         
-        return queryset.order_by('category', 'order')
+        return self.sparse_queryset(queryset.order_by('category', 'order'))
 
 
-class QuestionnaireAttemptViewSet(viewsets.ModelViewSet):
+class QuestionnaireAttemptViewSet(CompiledReadViewMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = QuestionnaireAttempt.objects.all()
     serializer_class = QuestionnaireAttemptSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = AttemptCursorPagination
+    # Not write actions: they change answers after get_object()
+    sparse_actions = ('list', 'retrieve', 'my_attempts', 'results')
+    compiled_actions = ('list', 'retrieve', 'my_attempts')
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return QuestionnaireAttempt.objects.all()
-        return QuestionnaireAttempt.objects.filter(user=self.request.user)
+            queryset = QuestionnaireAttempt.objects.all()
+        else:
+            queryset = QuestionnaireAttempt.objects.filter(user=self.request.user)
+        if requested_fields(self.request, ['progress']) != []:
+            queryset = annotate_attempt_stats(queryset)
+        return self.sparse_queryset(queryset.order_by('-started_at', '-id'))
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -104,9 +252,15 @@ class QuestionnaireAttemptViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        attempt.is_completed = True
-        attempt.completed_at = timezone.now()
-        scores = attempt.calculate_scores()
+        scores, job = request_completion(attempt)
+        
+        if job is not None:
+            # Scoring, report and PDF are built by the finalize job
+            return Response({
+                'attempt': attempt.id,
+                'status': 'finalizing',
+                'status_url': reverse('attempt-status', args=[attempt.id], request=request),
+            }, status=status.HTTP_202_ACCEPTED)
         
         serializer = self.get_serializer(attempt)
         return Response({
@@ -114,6 +268,112 @@ class QuestionnaireAttemptViewSet(viewsets.ModelViewSet):
             'scores': scores
         })
     
+    @action(detail=True, methods=['get'], url_path='status', url_name='status')
+    def completion_status(self, request, pk=None):
+        """
+        Completion progress for polling after POST complete/.
+        
+        state is in_progress, finalizing, failed or finalized; scores and the
+        report are included once finalized.
+        """
+        attempt = self.get_object()
+        state, job = finalize_status(attempt)
+        
+        data = {
+            'attempt': attempt.id,
+            'state': state,
+            'is_completed': attempt.is_completed,
+            'completed_at': attempt.completed_at,
+            'job': None,
+            'scores': None,
+            'report': None,
+        }
+        if job is not None:
+            data['job'] = {
+                'id': job.id,
+                'status': job.status,
+                'retries': job.retries,
+                'created_at': job.created_at,
+                'finished_at': job.finished_at,
+            }
+        if state == 'finalized':
+            data['scores'] = get_score_snapshot(attempt)
+            report = get_or_build_report(attempt, data['scores'])
+            if report is not None:
+                data['report'] = {
+                    'id': report.id,
+                    'generated_at': report.generated_at,
+                    'pdf_ready': bool(report.pdf_file),
+                }
+        return Response(data)
+    
+    @action(detail=True, methods=['post'], url_path='answers:batch', url_name='answers-batch')
+    def answers_batch(self, request, pk=None):
+        """
+        Create or update many answers of this attempt in one request.
+
+        Body: {"answers": [{"question": 1, "choice": 3}, {"question": 2, "choices_ids": [5, 6]}, ...]}
+        Existing answers to the same questions are replaced.
+        """
+        attempt = self.get_object()
+        
+        if attempt.user_id != request.user.pk:
+            return Response(
+                {'error': "Cannot answer for another user's attempt"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = AnswerBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        flush_quietly(attempt)
+        try:
+            saved = save_answers(attempt, serializer.validated_data['answers'])
+        except AnswerBatchError as e:
+            return Response({'errors': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'answers': [
+                {'id': answer.pk, 'question': question_id}
+                for question_id, answer in saved.items()
+            ],
+            'revision': attempt.revision,
+        })
+    
+    @action(detail=True, methods=['post'])
+    def autosave(self, request, pk=None):
+        """
+        Save only the answers changed since base_revision.
+
+        Body: {"base_revision": 4, "answers": [...changed answers...], "cleared": [question ids]}
+        Answers written elsewhere since base_revision make this fail with 409
+        and the current revision and answers, so the client can merge.
+        """
+        attempt = self.get_object()
+        
+        if attempt.user_id != request.user.pk:
+            return Response(
+                {'error': "Cannot answer for another user's attempt"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = AnswerAutosaveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        try:
+            revision = autosave(attempt, data['base_revision'], data['answers'], data['cleared'])
+        except AnswerBatchError as e:
+            return Response({'errors': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        except RevisionConflict as e:
+            return Response({
+                'error': str(e),
+                'revision': e.revision,
+                'answers': merged_answer_state(attempt),
+            }, status=status.HTTP_409_CONFLICT)
+        
+        return Response({'revision': revision})
+    
     @action(detail=True, methods=['get'])
     def results(self, request, pk=None):
         attempt = self.get_object()
@@ -125,24 +385,70 @@ class QuestionnaireAttemptViewSet(viewsets.ModelViewSet):
             )
         
         serializer = self.get_serializer(attempt)
-        return Response(serializer.data)
+        data = serializer.data
+        data['scores'] = get_score_snapshot(attempt)
+        return Response(data)
     
     @action(detail=False, methods=['get'])
     def my_attempts(self, request):
         attempts = self.get_queryset().filter(user=request.user)
+        compiled = self.get_compiled_serializer()
+        if compiled is not None:
+            return Response(compiled.data(attempts))
         serializer = self.get_serializer(attempts, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        Flat, cursor-paginated list of the user's attempts (scores, grade and
+        dates only) with aggregates over all of them, cached per user.
+        
+        Query: ?status=completed|in_progress, ?page_size=, ?cursor=,
+        ?fields= / ?omit= for the attempt rows
+        """
+        params = {
+            name: request.query_params[name]
+            for name in ('status', 'cursor', 'page_size', 'fields', 'omit') if name in request.query_params
+        }
+        if params.get('status', 'completed') not in STATUS_FILTERS:
+            return Response(
+                {'error': f"status must be one of {', '.join(STATUS_FILTERS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        key, data = get_cached_summary(request.user.pk, params)
+        if data is None:
+            serializer = AttemptSummarySerializer(context={'request': request})
+            # Only the returned columns, plus the cursor position
+            sources = {field.source for field in serializer.fields.values()} | {'started_at'}
+            fields = [name for name in SUMMARY_FIELDS if name in sources]
+            paginator = AttemptSummaryPagination()
+            page = paginator.paginate_queryset(
+                attempt_summaries(request.user, params.get('status'), fields), request, view=self
+            )
+            rows = AttemptSummarySerializer(page, many=True, context={'request': request}).data
+            data = paginator.get_paginated_response(rows).data
+            aggregates = summary_aggregates(request.user)
+            if aggregates['latest'] is not None:
+                aggregates['latest'] = AttemptSummarySerializer(aggregates['latest']).data
+            data['aggregates'] = aggregates
+            cache_summary(key, data)
+        return Response(data)
 
 
-class AnswerViewSet(viewsets.ModelViewSet):
+class AnswerViewSet(CompiledReadViewMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Answer.objects.all()
     serializer_class = AnswerSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = AnswerCursorPagination
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Answer.objects.all()
-        return Answer.objects.filter(attempt__user=self.request.user)
+            queryset = Answer.objects.all()
+        else:
+            queryset = Answer.objects.filter(attempt__user=self.request.user)
+        return self.sparse_queryset(queryset)
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -159,18 +465,44 @@ class AnswerViewSet(viewsets.ModelViewSet):
         if attempt.is_completed:
             raise ValueError("Cannot modify completed attempt")
         
-        serializer.save(attempt=attempt)
+        flush_quietly(attempt)
+        with transaction.atomic():
+            bump_revision(attempt)
+            serializer.save(attempt=attempt)
+    
+    def perform_update(self, serializer):
+        attempt = serializer.instance.attempt
+        flush_quietly(attempt)
+        with transaction.atomic():
+            bump_revision(attempt)
+            tracker = CategoryScoreTracker(attempt)
+            tracker.remove_answer(serializer.instance)
+            answer = serializer.save()
+            tracker.add_answer(answer)
+            tracker.flush()
+    
+    def perform_destroy(self, instance):
+        attempt = instance.attempt
+        flush_quietly(attempt)
+        with transaction.atomic():
+            bump_revision(attempt)
+            tracker = CategoryScoreTracker(attempt)
+            tracker.remove_answer(instance)
+            instance.delete()
+            tracker.flush()
 
 
-class UserDocumentViewSet(viewsets.ModelViewSet):
+class UserDocumentViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = UserDocument.objects.all()
     serializer_class = UserDocumentSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return UserDocument.objects.all()
-        return UserDocument.objects.filter(answer__attempt__user=self.request.user)
+            queryset = UserDocument.objects.all()
+        else:
+            queryset = UserDocument.objects.filter(answer__attempt__user=self.request.user)
+        return self.sparse_queryset(queryset)
     
     def perform_create(self, serializer):
         file = self.request.FILES.get('file')
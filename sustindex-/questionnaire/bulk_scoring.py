@@ -0,0 +1,306 @@
+"""
+Bulk (re)scoring of many questionnaire attempts at once.
+
+Answers for a batch of attempts are loaded in two queries and scored against
+the survey's ScoringPlan. When NumPy is installed the batch is turned into an
+attempt x choice selection matrix and category points are computed with
+matrix products against the plan's choice -> category points; otherwise the
+same plan is applied attempt by attempt in pure Python. Both paths return
+exactly the numbers of QuestionnaireAttempt.calculate_scores().
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import QuestionnaireAttempt, Answer, AttemptCategoryScore
+from .services import get_scoring_plan, score_answers, category_totals, grade_for_score, snapshot_from_result
+from .summaries import invalidate_attempt_summaries
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+SCORE_FIELDS = [
+    'environmental_score', 'social_score', 'governance_score', 'total_score', 'overall_grade',
+    'score_snapshot', 'scored_at', 'scores_stale',
+]
+
+
+def load_answers(attempt_ids):
+    """
+    Load the answers of a batch of attempts.
+
+    Returns:
+        tuple: ([(attempt_id, answer_id, question_id, choice_id), ...],
+                {answer_id: [choice_id, ...]} for multiple-choice selections)
+    """
+    answers = []
+    selections = {}
+    for attempt_id, answer_id, question_id, choice_id, choice_ids in Answer.objects.filter(
+        attempt_id__in=attempt_ids
+    ).values_list('attempt_id', 'id', 'question_id', 'choice_id', 'choice_ids'):
+        answers.append((attempt_id, answer_id, question_id, choice_id))
+        if choice_ids:
+            selections[answer_id] = choice_ids
+    return answers, selections
+
+
+def _complete_plan(plan, answers, selections):
+    """Extend the plan for answers pointing outside the survey structure"""
+    missing_questions = {q for _, _, q, _ in answers if not plan.covers_question(q)}
+    missing_choices = {c for _, _, _, c in answers if c is not None and c not in plan.choice_scores}
+    missing_choices.update(c for ids in selections.values() for c in ids if c not in plan.choice_scores)
+    if missing_questions or missing_choices:
+        return plan.extend(question_ids=missing_questions, choice_ids=missing_choices)
+    return plan
+
+
+def _selected_choices(plan, question_id, choice_id, answer_id, selections):
+    if question_id in plan.multiple_questions:
+        return selections.get(answer_id, ())
+    return () if choice_id is None else (choice_id,)
+
+
+def score_batch_python(plan, attempt_ids, answers, selections):
+    """Score a batch attempt by attempt; yields (attempt_id, result)"""
+    rows = {attempt_id: [] for attempt_id in attempt_ids}
+    for attempt_id, answer_id, question_id, choice_id in answers:
+        rows[attempt_id].append((question_id, selections.get(answer_id, ()), choice_id))
+    for attempt_id in attempt_ids:
+        result = score_answers(plan, rows[attempt_id])
+        yield attempt_id, result
+
+
+def category_points_matrix(plan, attempt_ids, answers, selections):
+    """
+    Earned and possible points per attempt and category as two
+    (attempts x categories) arrays.
+
+    earned   = selected (attempt x choice) @ choice_points (choice x category)
+    possible = answered (attempt x question) @ question_points (question x category)
+
+    Choice columns are keyed by (question, choice) so a selection always
+    counts towards the category of the question it answers.
+    """
+    row_of = {attempt_id: row for row, attempt_id in enumerate(attempt_ids)}
+    choice_columns = {}
+    question_columns = {}
+    selected_cells = ([], [])
+    answered_cells = ([], [])
+    
+    for attempt_id, answer_id, question_id, choice_id in answers:
+        if question_id not in plan.question_category:
+            continue
+        row = row_of[attempt_id]
+        answered_cells[0].append(row)
+        answered_cells[1].append(question_columns.setdefault(question_id, len(question_columns)))
+        for selected_id in _selected_choices(plan, question_id, choice_id, answer_id, selections):
+            selected_cells[0].append(row)
+            selected_cells[1].append(choice_columns.setdefault((question_id, selected_id), len(choice_columns)))
+    
+    n_categories = len(plan.categories)
+    
+    selected = np.zeros((len(attempt_ids), len(choice_columns)))
+    np.add.at(selected, selected_cells, 1)
+    choice_points = np.zeros((len(choice_columns), n_categories))
+    for (question_id, choice_id), column in choice_columns.items():
+        choice_points[column, plan.question_category[question_id]] = plan.choice_scores[choice_id]
+    
+    answered = np.zeros((len(attempt_ids), len(question_columns)))
+    answered[answered_cells] = 1
+    question_points = np.zeros((len(question_columns), n_categories))
+    for question_id, column in question_columns.items():
+        question_points[column, plan.question_category[question_id]] = plan.question_max[question_id]
+    
+    return selected @ choice_points, answered @ question_points
+
+
+def category_percentages(plan, earned, possible):
+    """Vectorized category_percentage() over an (attempts x categories) batch"""
+    max_scores = np.array([category.max_score for category in plan.categories], dtype=float)
+    has_points = possible > 0
+    percentages = np.where(has_points, earned / np.where(has_points, possible, 1) * 100, 0.0)
+    return np.minimum(percentages, max_scores)
+
+
+def esg_scores(plan, percentages):
+    """
+    Weighted E/S/G sums for every attempt.
+
+    Accumulates category by category (vectorized over attempts) in display
+    order, which keeps the floating point results identical to the
+    single-attempt engine.
+    """
+    totals = np.zeros((percentages.shape[0], 3))
+    for index, weights in enumerate(plan.weights):
+        totals = totals + percentages[:, index:index + 1] * np.array(weights)
+    return totals
+
+
+def _category_score(category, earned, possible):
+    """Same value and type category_percentage() returns for these points"""
+    if possible == 0:
+        return 0
+    percentage = float(earned / possible * 100)
+    return min(percentage, category.max_score)
+
+
+def score_batch_numpy(plan, attempt_ids, answers, selections):
+    """Score a batch with matrix products; yields (attempt_id, result)"""
+    earned, possible = category_points_matrix(plan, attempt_ids, answers, selections)
+    percentages = category_percentages(plan, earned, possible)
+    totals = esg_scores(plan, percentages)
+    
+    for row, attempt_id in enumerate(attempt_ids):
+        environmental = round(float(totals[row, 0]), 2)
+        social = round(float(totals[row, 1]), 2)
+        governance = round(float(totals[row, 2]), 2)
+        total = round((environmental + social + governance) / 3, 2)
+        yield attempt_id, {
+            'categories': [
+                {
+                    'category': category,
+                    'earned': int(earned[row, index]),
+                    'possible': int(possible[row, index]),
+                    'score': _category_score(category, earned[row, index], possible[row, index]),
+                }
+                for index, category in enumerate(plan.categories)
+            ],
+            'environmental': environmental,
+            'social': social,
+            'governance': governance,
+            'total': total,
+            'grade': grade_for_score(total),
+        }
+
+
+def score_batch(survey_id, attempt_ids, use_numpy=None):
+    """Score a batch of attempts of one survey; yields (attempt_id, result)"""
+    if use_numpy is None:
+        use_numpy = NUMPY_AVAILABLE
+    answers, selections = load_answers(attempt_ids)
+    plan = _complete_plan(get_scoring_plan(survey_id), answers, selections)
+    scorer = score_batch_numpy if use_numpy else score_batch_python
+    return scorer(plan, attempt_ids, answers, selections)
+
+
+def rescore_attempts(queryset, batch_size=1000, use_numpy=None, progress=None):
+    """
+    Recalculate and store the scores of every attempt in a queryset.
+
+    Attempts are processed in primary key order, batch by batch and grouped
+    by survey, and written back with one bulk_update per batch.
+    progress(done, total) is called after each batch.
+
+    Returns:
+        int: number of attempts rescored
+    """
+    attempts = list(queryset.order_by('pk').values_list('pk', 'survey_id', 'user_id'))
+    total = len(attempts)
+    done = 0
+    
+    for start in range(0, total, batch_size):
+        batch = attempts[start:start + batch_size]
+        by_survey = {}
+        for attempt_id, survey_id, _ in batch:
+            by_survey.setdefault(survey_id, []).append(attempt_id)
+        
+        updated = []
+        scored_at = timezone.now()
+        for survey_id, attempt_ids in by_survey.items():
+            for attempt_id, result in score_batch(survey_id, attempt_ids, use_numpy=use_numpy):
+                updated.append(QuestionnaireAttempt(
+                    pk=attempt_id,
+                    environmental_score=result['environmental'],
+                    social_score=result['social'],
+                    governance_score=result['governance'],
+                    total_score=result['total'],
+                    overall_grade=result['grade'],
+                    score_snapshot=snapshot_from_result(result),
+                    scored_at=scored_at,
+                    scores_stale=False,
+                ))
+        
+        with transaction.atomic():
+            QuestionnaireAttempt.objects.bulk_update(updated, SCORE_FIELDS)
+        invalidate_attempt_summaries(user_id for _, _, user_id in batch)
+        
+        done += len(batch)
+        if progress:
+            progress(done, total)
+    
+    return done
+
+
+def reconcile_category_scores(queryset, repair=True, batch_size=1000, progress=None):
+    """
+    Verify stored AttemptCategoryScore rows against a full recompute from
+    the answers and, when repair is set, rewrite the rows of drifted attempts.
+
+    Returns:
+        list: ids of attempts whose stored totals had drifted
+    """
+    attempts = list(queryset.order_by('pk').values_list('pk', 'survey_id'))
+    total = len(attempts)
+    drifted = []
+    
+    for start in range(0, total, batch_size):
+        batch = attempts[start:start + batch_size]
+        attempt_ids = [attempt_id for attempt_id, _ in batch]
+        
+        stored = {}
+        for attempt_id, category_id, earned, possible, answered, version in AttemptCategoryScore.objects.filter(
+            attempt_id__in=attempt_ids
+        ).values_list('attempt_id', 'category_id', 'earned_points', 'possible_points', 'answered_count', 'structure_version'):
+            stored.setdefault(attempt_id, {})[category_id] = (earned, possible, answered, version)
+        
+        answers, selections = load_answers(attempt_ids)
+        rows = {attempt_id: [] for attempt_id in attempt_ids}
+        for attempt_id, answer_id, question_id, choice_id in answers:
+            rows[attempt_id].append((question_id, selections.get(answer_id, ()), choice_id))
+        
+        by_survey = {}
+        for attempt_id, survey_id in batch:
+            by_survey.setdefault(survey_id, []).append(attempt_id)
+        
+        replacements = []
+        batch_drifted = []
+        for survey_id, survey_attempt_ids in by_survey.items():
+            members = set(survey_attempt_ids)
+            survey_answers = [row for row in answers if row[0] in members]
+            plan = _complete_plan(get_scoring_plan(survey_id), survey_answers, selections)
+            version = plan.version or ''
+            for attempt_id in survey_attempt_ids:
+                earned, possible, answered = category_totals(plan, rows[attempt_id])
+                expected = {
+                    category_id: (earned[category_id], possible[category_id], answered[category_id], version)
+                    for category_id in answered
+                }
+                if stored.get(attempt_id, {}) == expected:
+                    continue
+                batch_drifted.append(attempt_id)
+                replacements.extend(
+                    AttemptCategoryScore(
+                        attempt_id=attempt_id,
+                        category_id=category_id,
+                        earned_points=values[0],
+                        possible_points=values[1],
+                        answered_count=values[2],
+                        structure_version=version,
+                    )
+                    for category_id, values in expected.items()
+                )
+        
+        if repair and batch_drifted:
+            with transaction.atomic():
+                AttemptCategoryScore.objects.filter(attempt_id__in=batch_drifted).delete()
+                AttemptCategoryScore.objects.bulk_create(replacements)
+        
+        drifted.extend(batch_drifted)
+        if progress:
+            progress(start + len(batch), total, len(drifted))
+    
+    return drifted
@@ -0,0 +1,107 @@
+"""
+Bulk copies of surveys and questions.
+
+Each level (survey, sessions, questions, choices) is read in one query and
+written with one bulk_create; the primary keys bulk_create returns are
+zipped with the originals into old -> new id maps that give the next level
+its foreign keys. Copying a survey therefore takes the same handful of
+statements whatever its size. Attachments are copied by reference: the
+copies point at the same stored files.
+
+bulk_create sends no model signals, so the cached survey structure and
+table versions are invalidated here.
+"""
+import copy
+
+from django.db import transaction
+
+from sustindex.conditional import bump_table_versions
+from .models import Survey, SurveySession, Question, Choice
+from .services import structure_changed
+
+
+def _copy(model, objects, **changes):
+    """
+    Insert copies of objects with the given field values replaced; a
+    callable value is called with the copy. The objects are left as they are.
+    
+    Returns:
+        dict: {old pk: new pk}
+    """
+    old_pks = []
+    copies = []
+    for original in objects:
+        old_pks.append(original.pk)
+        obj = copy.copy(original)
+        obj.pk = None
+        obj._state.adding = True
+        for name, value in changes.items():
+            setattr(obj, name, value(obj) if callable(value) else value)
+        copies.append(obj)
+    model.objects.bulk_create(copies)
+    return {old_pk: clone.pk for old_pk, clone in zip(old_pks, copies)}
+
+
+def _copy_questions(questions, **changes):
+    """Copy questions with their choices; returns the question and choice id maps"""
+    question_ids = _copy(Question, questions, **changes)
+    choices = Choice.objects.filter(question_id__in=question_ids).order_by('pk')
+    choice_ids = _copy(Choice, choices, question_id=lambda choice: question_ids[choice.question_id])
+    return question_ids, choice_ids
+
+
+def clone_survey(survey, *, include_sessions=False, name=None):
+    """
+    Copy a survey with its questions and choices (and sessions with
+    include_sessions) in one transaction. The copy and its sessions are
+    inactive; name defaults to "<name> (Copy)".
+    
+    Returns:
+        dict: {'survey': {old: new}, 'sessions': {...}, 'questions': {...},
+        'choices': {...}} id maps
+    """
+    with transaction.atomic():
+        new_survey = Survey.objects.create(
+            name=name or f"{survey.name} (Copy)",
+            description=survey.description,
+            is_active=False,
+            allow_multiple_attempts=survey.allow_multiple_attempts,
+            show_results_immediately=survey.show_results_immediately
+        )
+        
+        session_ids = {}
+        if include_sessions:
+            session_ids = _copy(
+                SurveySession, SurveySession.objects.filter(survey=survey).order_by('pk'),
+                survey_id=new_survey.pk, is_active=False,
+            )
+            bump_table_versions([SurveySession])
+        
+        question_ids, choice_ids = _copy_questions(
+            Question.objects.filter(survey=survey).order_by('pk'), survey_id=new_survey.pk
+        )
+        structure_changed([new_survey.pk])
+    
+    return {
+        'survey': {survey.pk: new_survey.pk},
+        'sessions': session_ids,
+        'questions': question_ids,
+        'choices': choice_ids,
+    }
+
+
+def clone_questions(questions):
+    """
+    Copy questions with their choices into their own surveys as inactive
+    "<text> (Copy)" questions, in one transaction.
+    
+    Returns:
+        dict: {'questions': {old: new}, 'choices': {...}} id maps
+    """
+    questions = list(questions)
+    with transaction.atomic():
+        question_ids, choice_ids = _copy_questions(
+            questions, text=lambda question: f"{question.text} (Copy)", is_active=False
+        )
+        structure_changed({question.survey_id for question in questions})
+    return {'questions': question_ids, 'choices': choice_ids}
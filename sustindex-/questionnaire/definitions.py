@@ -0,0 +1,79 @@
+"""
+Pre-serialized survey definitions.
+
+The questions endpoint returns the same document for every respondent
+until an admin edits the survey. It is rendered once per
+Survey.structure_version (replaced by the Question/Choice/Category
+signals), stored in SurveyDefinition and kept in the cache, so serving it
+costs one read of the survey row plus a cache hit or a single-row read;
+the question, choice and category tables are only read to rebuild it.
+"""
+import logging
+
+from django.core.cache import cache
+
+from sustindex.compiled_serializers import CompiledSerializer
+from sustindex.renderers import render_json
+
+from .models import Question, SurveyDefinition
+
+logger = logging.getLogger(__name__)
+
+
+# Part of the version: bump when QuestionSerializer's output changes
+DEFINITION_FORMAT = 1
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class Definition:
+    """Rendered survey definition with the version it was built from"""
+    
+    def __init__(self, version, content):
+        self.version = version
+        self.content = content
+    
+    @property
+    def etag(self):
+        return f'"{self.version}"'
+
+
+def definition_version(structure_version):
+    return f'{structure_version}-{DEFINITION_FORMAT}'
+
+
+def _cache_key(survey_id, version):
+    return f'survey-definition:{survey_id}:{version}'
+
+
+def render_definition(survey_id):
+    """JSON of the survey's active questions, as the questions endpoint returned it"""
+    from .serializers import QuestionSerializer
+    
+    questions = Question.objects.filter(survey_id=survey_id, is_active=True).order_by('category', 'order')
+    return render_json(CompiledSerializer(QuestionSerializer()).data(questions)).decode()
+
+
+def get_survey_definition(survey_id, structure_version):
+    """
+    Definition of a survey for its current structure_version, from the
+    cache, then the database, building and storing it when neither has it.
+    """
+    version = definition_version(structure_version)
+    key = _cache_key(survey_id, version)
+    content = cache.get(key)
+    if content is not None:
+        return Definition(version, content)
+    
+    content = SurveyDefinition.objects.filter(survey_id=survey_id, version=version).values_list(
+        'content', flat=True
+    ).first()
+    if content is None:
+        # Rendered after structure_version was read, so never older than version
+        content = render_definition(survey_id)
+        SurveyDefinition.objects.update_or_create(
+            survey_id=survey_id, defaults={'version': version, 'content': content}
+        )
+        logger.info('Built definition %s of survey %s', version, survey_id)
+    
+    cache.set(key, content, CACHE_TIMEOUT)
+    return Definition(version, content)
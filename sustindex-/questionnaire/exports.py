@@ -0,0 +1,295 @@
+"""
+Streaming exports of attempt results.
+
+Every attempt becomes one row: its user, survey, session and scores, then
+the selected choices, score and notes of each active question of its survey.
+Attempts and their answers are read through two iterators (server-side
+cursors on PostgreSQL) ordered by attempt, merged as they are read, and
+each row is written out as soon as its attempt is complete. Memory use
+depends on the number of questions, not on the number of attempts or
+answers.
+
+The rows are written as CSV or as an XLSX workbook. XLSX files are zip
+archives; the worksheet is compressed into the archive while it is being
+written, with zipfile on an unseekable stream, so no dependency is needed
+and nothing is buffered beyond a chunk.
+"""
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import QuestionnaireAttempt, Question, Choice, Answer
+from .answer_buffer import flush_buffers
+
+
+EXPORT_CHUNK_SIZE = 2000
+# Bytes collected before a chunk is handed to the response or file
+STREAM_CHUNK_BYTES = 64 * 1024
+
+ATTEMPT_COLUMNS = (
+    ('pk', 'Attempt ID'),
+    ('user__username', 'Username'),
+    ('user__company_name', 'Company'),
+    ('survey__name', 'Survey'),
+    ('session__name', 'Session'),
+    ('started_at', 'Started At'),
+    ('completed_at', 'Completed At'),
+    ('is_completed', 'Completed'),
+    ('environmental_score', 'Environmental Score'),
+    ('social_score', 'Social Score'),
+    ('governance_score', 'Governance Score'),
+    ('total_score', 'Total Score'),
+    ('overall_grade', 'Overall Grade'),
+)
+ANSWER_COLUMNS = ('Choices', 'Score', 'Notes')
+CANNOT_ANSWER = 'Cannot answer'
+
+
+def _question_label(position, question):
+    text = ' '.join(strip_tags(question.text or '').split())
+    return f'Q{position} {text[:60]}'.rstrip()
+
+
+def _answer_cells(question, choice_id, choice_ids, notes, choices):
+    """Choices, score and notes of an answer, as Answer displays and scores them"""
+    if not choice_id and not choice_ids:
+        return [CANNOT_ANSWER, 0, notes]
+    if question.allow_multiple:
+        selected = sorted(
+            (choices[pk] for pk in set(choice_ids or ()) if pk in choices and choices[pk][0] == question.pk),
+            key=lambda choice: choice[3],
+        )
+        return [', '.join(choice[1] for choice in selected), sum(choice[2] for choice in selected), notes]
+    choice = choices.get(choice_id)
+    return [choice[1], choice[2], notes] if choice else ['-', 0, notes]
+
+
+def result_rows(attempts, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Header and one row per attempt of the queryset, ordered by id.
+    Buffered autosaves are flushed first so in-progress attempts are
+    exported with their latest answers.
+    """
+    flush_buffers()
+    attempt_ids = attempts.order_by().values('pk')
+    survey_ids = (
+        QuestionnaireAttempt.objects.filter(pk__in=attempt_ids)
+        .order_by().values_list('survey_id', flat=True).distinct()
+    )
+    questions = list(
+        Question.objects.filter(survey_id__in=list(survey_ids), is_active=True)
+        .order_by('survey_id', 'category__order', 'category__name', 'order', 'pk')
+    )
+    index = {question.pk: i for i, question in enumerate(questions)}
+    # {choice id: (question id, text, score, display position)}
+    choices = {
+        pk: (question_id, text, score, position)
+        for position, (pk, question_id, text, score) in enumerate(
+            Choice.objects.filter(question_id__in=index).order_by('order', 'pk')
+            .values_list('pk', 'question_id', 'text', 'score')
+        )
+    }
+    
+    yield [title for _, title in ATTEMPT_COLUMNS] + [
+        f'{_question_label(position, question)} - {column}'
+        for position, question in enumerate(questions, 1) for column in ANSWER_COLUMNS
+    ]
+    
+    answers = (
+        Answer.objects.filter(attempt_id__in=attempt_ids, question_id__in=index)
+        .order_by('attempt_id')
+        .values_list('attempt_id', 'question_id', 'choice_id', 'choice_ids', 'notes')
+        .iterator(chunk_size=chunk_size)
+    )
+    rows = (
+        QuestionnaireAttempt.objects.filter(pk__in=attempt_ids).order_by('pk')
+        .values_list(*(field for field, _ in ATTEMPT_COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+    answer = next(answers, None)
+    for row in rows:
+        cells = [None] * (len(questions) * len(ANSWER_COLUMNS))
+        while answer is not None and answer[0] <= row[0]:
+            if answer[0] == row[0]:
+                attempt_id, question_id, choice_id, choice_ids, notes = answer
+                start = index[question_id] * len(ANSWER_COLUMNS)
+                cells[start:start + len(ANSWER_COLUMNS)] = _answer_cells(
+                    questions[index[question_id]], choice_id, choice_ids, notes, choices
+                )
+            answer = next(answers, None)
+        yield [_cell_value(value) for value in row] + cells
+
+
+def _cell_value(value):
+    if hasattr(value, 'tzinfo'):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+class _Sink:
+    """Write-only file collecting what is written until it is drained"""
+    
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+class _TextSink:
+    """Text file encoding what is written into a _Sink"""
+    
+    def __init__(self, sink):
+        self.sink = sink
+    
+    def write(self, text):
+        return self.sink.write(text.encode())
+
+
+# Spreadsheet applications evaluate text cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and value != '-':
+        return "'" + value
+    return value
+
+
+def csv_chunks(rows):
+    """UTF-8 CSV (with a byte order mark for Excel) of rows, in chunks of bytes"""
+    sink = _Sink()
+    writer = csv.writer(_TextSink(sink))
+    sink.write('\ufeff'.encode())
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if sink.size >= STREAM_CHUNK_BYTES:
+            yield sink.drain()
+    yield sink.drain()
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_END = '</sheetData></worksheet>'
+# Excel's limit for the text of a cell
+XLSX_MAX_TEXT = 32767
+XML_ILLEGAL_CHARACTERS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _column_name(index):
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+
+def _xlsx_row(number, row, columns):
+    cells = []
+    for value, column in zip(row, columns):
+        if value is None or value == '':
+            continue
+        reference = f'{column}{number}'
+        if isinstance(value, bool):
+            cells.append(f'<c r="{reference}" t="b"><v>{int(value)}</v></c>')
+        elif isinstance(value, (int, float)):
+            cells.append(f'<c r="{reference}"><v>{value}</v></c>')
+        else:
+            text = escape(XML_ILLEGAL_CHARACTERS.sub('', str(value))[:XLSX_MAX_TEXT])
+            cells.append(f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+
+def xlsx_chunks(rows, sheet_name='Results'):
+    """XLSX workbook with rows in its only worksheet, in chunks of bytes"""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(name=escape(sheet_name[:31], {'"': '&quot;'})))
+        archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(XLSX_SHEET_START.encode())
+            columns = []
+            for number, row in enumerate(rows, 1):
+                if len(columns) < len(row):
+                    columns = [_column_name(i) for i in range(len(row))]
+                sheet.write(_xlsx_row(number, row, columns).encode())
+                if sink.size >= STREAM_CHUNK_BYTES:
+                    yield sink.drain()
+            sheet.write(XLSX_SHEET_END.encode())
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', csv_chunks),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', xlsx_chunks),
+}
+
+
+def export_results(attempts, file_format='csv', chunk_size=EXPORT_CHUNK_SIZE):
+    """Chunks of bytes of the results of the attempts in a queryset as 'csv' or 'xlsx'"""
+    return EXPORT_FORMATS[file_format][1](result_rows(attempts, chunk_size))
+
+
+def export_response(attempts, file_format='csv', filename=None):
+    """StreamingHttpResponse downloading export_results()"""
+    content_type = EXPORT_FORMATS[file_format][0]
+    filename = filename or f'results-{timezone.localtime():%Y%m%d-%H%M%S}'
+    response = StreamingHttpResponse(export_results(attempts, file_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
@@ -0,0 +1,71 @@
+"""
+Custom model fields
+"""
+import json
+
+from django.core import exceptions
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class ChoiceIdsField(models.Field):
+    """
+    Sorted, duplicate-free list of Choice ids kept in the row itself.
+
+    Stored as integer[] on PostgreSQL and as a compact JSON array in a text
+    column on other backends, so reading the selections of an answer never
+    needs a join or an extra query. Ids are not foreign keys: deleting a
+    choice has to remove its id explicitly.
+    """
+    description = _('List of choice ids')
+    empty_strings_allowed = False
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('default', list)
+        kwargs.setdefault('blank', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('default') is list:
+            del kwargs['default']
+        if kwargs.get('blank'):
+            del kwargs['blank']
+        return name, path, args, kwargs
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'integer[]'
+        return 'text'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return json.loads(value)
+        return list(value)
+
+    def to_python(self, value):
+        if value is None:
+            return []
+        try:
+            if isinstance(value, str):
+                value = json.loads(value) if value.strip() else []
+            return sorted({int(pk) for pk in value})
+        except (TypeError, ValueError) as e:
+            raise exceptions.ValidationError(_('Enter a list of choice ids.'), code='invalid') from e
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return self.to_python(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None or connection.vendor == 'postgresql':
+            return value
+        return json.dumps(value, separators=(',', ':'))
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj))
@@ -0,0 +1,267 @@
+"""
+Database-backed background job queue.
+
+Scoring-input changes (category weights, choice scores, question flags)
+enqueue only the attempts they affect, and completing an attempt enqueues
+its finalize job (scores, report, PDF). The run_score_worker command drains
+the queue in batches so admin edits and completions stay fast while the
+expensive work happens in the background.
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Min, Count, Q
+from django.utils import timezone
+
+from .models import BackgroundJob, QuestionnaireAttempt, Answer
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 30
+LEASE_SECONDS = 600
+
+
+# Enqueueing
+
+def enqueue_rescore(attempt_ids, reason=''):
+    """
+    Flag the score snapshots of the attempts as stale and queue a rescore
+    job for each attempt that does not already have one waiting. The job
+    clears the flag again, so only queued attempts are ever stale.
+    Returns the number of jobs created.
+    """
+    from .services import mark_scores_stale
+
+    attempt_ids = set(attempt_ids)
+    if not attempt_ids:
+        return 0
+
+    mark_scores_stale(QuestionnaireAttempt.objects.filter(pk__in=attempt_ids))
+    waiting = set(
+        BackgroundJob.objects.filter(
+            kind=BackgroundJob.KIND_RESCORE,
+            status=BackgroundJob.STATUS_PENDING,
+            attempt_id__in=attempt_ids,
+        ).values_list('attempt_id', flat=True)
+    )
+    jobs = [
+        BackgroundJob(kind=BackgroundJob.KIND_RESCORE, attempt_id=attempt_id, reason=reason[:200])
+        for attempt_id in sorted(attempt_ids - waiting)
+    ]
+    BackgroundJob.objects.bulk_create(jobs, batch_size=1000)
+    return len(jobs)
+
+
+def enqueue_finalize(attempt, reason='Attempt completed'):
+    """Queue the finalize job of a completed attempt unless one is waiting or running"""
+    job = BackgroundJob.objects.filter(
+        kind=BackgroundJob.KIND_FINALIZE,
+        status__in=[BackgroundJob.STATUS_PENDING, BackgroundJob.STATUS_RUNNING],
+        attempt=attempt,
+    ).first()
+    if job is None:
+        job = BackgroundJob.objects.create(kind=BackgroundJob.KIND_FINALIZE, attempt=attempt, reason=reason[:200])
+    return job
+
+
+def finalize_status(attempt):
+    """
+    Progress of an attempt's completion for polling clients.
+
+    Returns:
+        tuple: (state, latest finalize job or None) where state is one of
+        in_progress, finalizing, failed or finalized
+    """
+    if not attempt.is_completed:
+        return 'in_progress', None
+    job = attempt.jobs.filter(kind=BackgroundJob.KIND_FINALIZE).order_by('-created_at', '-pk').first()
+    if job is None or job.status == BackgroundJob.STATUS_DONE:
+        # Finalized in the request, or before completion jobs existed
+        return 'finalized', job
+    if job.status == BackgroundJob.STATUS_FAILED:
+        return 'failed', job
+    return 'finalizing', job
+
+
+def attempts_for_questions(question_ids):
+    """Ids of completed attempts that answered any of the questions"""
+    return set(
+        Answer.objects.filter(question_id__in=question_ids, attempt__is_completed=True)
+        .values_list('attempt_id', flat=True)
+        .distinct()
+    )
+
+
+def attempts_for_categories(category_ids):
+    """Ids of completed attempts that answered any question of the categories"""
+    return set(
+        Answer.objects.filter(question__category_id__in=category_ids, attempt__is_completed=True)
+        .values_list('attempt_id', flat=True)
+        .distinct()
+    )
+
+
+def enqueue_for_questions(question_ids, reason=''):
+    return enqueue_rescore(attempts_for_questions(question_ids), reason)
+
+
+def enqueue_for_categories(category_ids, reason=''):
+    return enqueue_rescore(attempts_for_categories(category_ids), reason)
+
+
+# Claiming and running
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def release_expired(lease_seconds=LEASE_SECONDS):
+    """Put jobs of crashed workers back in the queue"""
+    cutoff = timezone.now() - timedelta(seconds=lease_seconds)
+    return BackgroundJob.objects.filter(
+        status=BackgroundJob.STATUS_RUNNING, started_at__lt=cutoff,
+    ).update(status=BackgroundJob.STATUS_PENDING, claimed_by='')
+
+
+def claim_jobs(kind, limit, worker=None):
+    """
+    Atomically claim up to limit due jobs of a kind for this worker.
+
+    Rows are locked with SKIP LOCKED where the database supports it so
+    concurrent workers never pick the same job; elsewhere the conditional
+    status update guarantees a job is claimed at most once.
+    """
+    worker = worker or worker_name()
+    now = timezone.now()
+
+    with transaction.atomic():
+        due = BackgroundJob.objects.filter(
+            kind=kind, status=BackgroundJob.STATUS_PENDING, run_after__lte=now,
+        ).order_by('run_after', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        BackgroundJob.objects.filter(pk__in=ids, status=BackgroundJob.STATUS_PENDING).update(
+            status=BackgroundJob.STATUS_RUNNING, claimed_by=worker[:100], started_at=now,
+        )
+
+    return list(BackgroundJob.objects.filter(
+        pk__in=ids, status=BackgroundJob.STATUS_RUNNING, claimed_by=worker[:100],
+    ))
+
+
+def finish_jobs(jobs):
+    BackgroundJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+        status=BackgroundJob.STATUS_DONE, finished_at=timezone.now(), last_error='',
+    )
+
+
+def fail_job(job, error, max_retries=DEFAULT_MAX_RETRIES):
+    """Schedule a retry with exponential backoff, or give up after max_retries"""
+    retries = job.retries + 1
+    if retries > max_retries:
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status=BackgroundJob.STATUS_FAILED, retries=retries,
+            last_error=error, finished_at=timezone.now(),
+        )
+    else:
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status=BackgroundJob.STATUS_PENDING, retries=retries, last_error=error, claimed_by='',
+            run_after=timezone.now() + timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** (retries - 1)),
+        )
+
+
+def run_rescore_jobs(jobs):
+    """Bring stored category totals and scores of the jobs' attempts up to date"""
+    from .bulk_scoring import rescore_attempts, reconcile_category_scores
+
+    attempts = QuestionnaireAttempt.objects.filter(pk__in={job.attempt_id for job in jobs if job.attempt_id})
+    reconcile_category_scores(attempts, repair=True)
+    rescore_attempts(attempts.filter(is_completed=True))
+
+
+def run_finalize_jobs(jobs):
+    """Score completed attempts and build their reports"""
+    from .services import finalize_attempt
+
+    attempts = QuestionnaireAttempt.objects.filter(
+        pk__in={job.attempt_id for job in jobs if job.attempt_id}, is_completed=True,
+    ).select_related('user', 'survey')
+    for attempt in attempts:
+        finalize_attempt(attempt)
+
+
+JOB_HANDLERS = {
+    BackgroundJob.KIND_RESCORE: run_rescore_jobs,
+    BackgroundJob.KIND_FINALIZE: run_finalize_jobs,
+}
+
+# Finalize jobs first: a user is waiting for them
+JOB_KINDS = [BackgroundJob.KIND_FINALIZE, BackgroundJob.KIND_RESCORE]
+
+
+def process_batch(kind, batch_size=100, max_retries=DEFAULT_MAX_RETRIES, worker=None):
+    """
+    Claim and run one batch of jobs. A failing batch is retried job by job
+    so one bad attempt does not hold back the others.
+
+    Returns:
+        int: number of jobs claimed
+    """
+    jobs = claim_jobs(kind, batch_size, worker)
+    if not jobs:
+        return 0
+
+    handler = JOB_HANDLERS[kind]
+    try:
+        handler(jobs)
+    except Exception:
+        logger.exception('Batch of %d %s jobs failed, retrying one by one', len(jobs), kind)
+        for job in jobs:
+            try:
+                handler([job])
+            except Exception:
+                fail_job(job, traceback.format_exc(limit=5), max_retries)
+            else:
+                finish_jobs([job])
+    else:
+        finish_jobs(jobs)
+    return len(jobs)
+
+
+def retry_jobs(queryset):
+    """Send failed or stuck jobs back to the queue"""
+    return queryset.exclude(status=BackgroundJob.STATUS_DONE).update(
+        status=BackgroundJob.STATUS_PENDING, retries=0, claimed_by='', run_after=timezone.now(),
+    )
+
+
+def queue_stats():
+    """
+    Queue depth and lag for monitoring.
+
+    Lag is the age of the oldest job that is due but not yet picked up.
+    """
+    now = timezone.now()
+    stats = BackgroundJob.objects.aggregate(
+        pending=Count('pk', filter=Q(status=BackgroundJob.STATUS_PENDING)),
+        due=Count('pk', filter=Q(status=BackgroundJob.STATUS_PENDING, run_after__lte=now)),
+        running=Count('pk', filter=Q(status=BackgroundJob.STATUS_RUNNING)),
+        failed=Count('pk', filter=Q(status=BackgroundJob.STATUS_FAILED)),
+        done_last_hour=Count('pk', filter=Q(
+            status=BackgroundJob.STATUS_DONE, finished_at__gte=now - timedelta(hours=1),
+        )),
+        oldest_due=Min('created_at', filter=Q(status=BackgroundJob.STATUS_PENDING, run_after__lte=now)),
+    )
+    oldest = stats.pop('oldest_due')
+    stats['lag_seconds'] = int((now - oldest).total_seconds()) if oldest else 0
+    return stats
@@ -0,0 +1,134 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from questionnaire.models import Survey, Question, QuestionnaireAttempt, Answer
+from questionnaire.serializers import AnswerSerializer
+from questionnaire.bulk_scoring import load_answers
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure rows and queries of the inline Answer.choice_ids storage on a synthetic '
+        'dataset; everything is rolled back unless --keep is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--attempts',
+            type=int,
+            default=100000,
+            help='Synthetic attempts to create (default: 100000)',
+        )
+        parser.add_argument(
+            '--survey',
+            type=int,
+            help='Survey ID to answer (default: the survey with the most questions)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Attempts created and read per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for the generated answers (default: 0)',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the generated attempts instead of rolling back',
+        )
+
+    def handle(self, *args, **options):
+        survey = self.get_survey(options['survey'])
+        questions = list(
+            Question.objects.filter(survey=survey, is_active=True).prefetch_related('choices')
+        )
+        questions = [question for question in questions if question.choices.all()]
+        if not questions:
+            raise CommandError(f'Survey {survey.pk} has no active questions with choices')
+
+        rng = random.Random(options['seed'])
+        batch_size = max(1, options['batch_size'])
+        self.stdout.write(
+            f"Creating {options['attempts']} attempts of '{survey.name}' "
+            f"({len(questions)} questions, {sum(q.allow_multiple for q in questions)} multiple choice)"
+        )
+
+        with transaction.atomic():
+            user, _ = get_user_model().objects.get_or_create(username='benchmark-answer-storage')
+            attempt_ids = []
+            answer_rows = 0
+            selections = 0
+            started = time.perf_counter()
+            for start in range(0, options['attempts'], batch_size):
+                attempts = QuestionnaireAttempt.objects.bulk_create([
+                    QuestionnaireAttempt(user=user, survey=survey)
+                    for _ in range(min(batch_size, options['attempts'] - start))
+                ])
+                answers = []
+                for attempt in attempts:
+                    for question in questions:
+                        choice_ids = [choice.pk for choice in question.choices.all()]
+                        if question.allow_multiple:
+                            selected = rng.sample(choice_ids, rng.randint(0, len(choice_ids)))
+                            answers.append(Answer(attempt=attempt, question=question, choice_ids=selected))
+                            selections += len(selected)
+                        else:
+                            answers.append(Answer(attempt=attempt, question=question, choice_id=rng.choice(choice_ids)))
+                Answer.objects.bulk_create(answers, batch_size=5000)
+                answer_rows += len(answers)
+                attempt_ids.extend(attempt.pk for attempt in attempts)
+            write_seconds = time.perf_counter() - started
+
+            self.stdout.write(f'  Answer rows written:          {answer_rows}')
+            self.stdout.write(f'  Selections stored inline:     {selections}')
+            self.stdout.write(f'  Through-table rows avoided:   {selections} (one per selected choice with the M2M)')
+            self.stdout.write(f'  Write time:                   {write_seconds:.1f}s')
+
+            # Scoring read path: one query per batch of attempts
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                for start in range(0, len(attempt_ids), batch_size):
+                    load_answers(attempt_ids[start:start + batch_size])
+            self.stdout.write(
+                f'  Scoring reads:                {len(queries)} queries for {len(attempt_ids)} attempts '
+                f'({time.perf_counter() - started:.1f}s)'
+            )
+
+            # API read path: serializing the answers of one attempt
+            sample = Answer.objects.filter(attempt_id=attempt_ids[0]).select_related(
+                'question', 'choice'
+            ).prefetch_related('question__choices', 'documents')
+            with CaptureQueriesContext(connection) as queries:
+                data = AnswerSerializer(sample, many=True).data
+            self.stdout.write(
+                f'  Serializing one attempt:      {len(queries)} queries for {len(data)} answers'
+            )
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Done' + ('' if options['keep'] else ' (rolled back)')
+        ))
+
+    def get_survey(self, survey_id):
+        if survey_id:
+            try:
+                return Survey.objects.get(pk=survey_id)
+            except Survey.DoesNotExist:
+                raise CommandError(f'Survey {survey_id} does not exist')
+        survey = Survey.objects.annotate(question_count=Count('questions')).order_by('-question_count').first()
+        if survey is None:
+            raise CommandError('No surveys found')
+        return survey
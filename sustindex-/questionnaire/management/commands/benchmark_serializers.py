@@ -0,0 +1,170 @@
+import random
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from questionnaire.models import Survey, Category, Question, Choice, QuestionnaireAttempt, Answer
+from questionnaire.serializers import CategorySerializer, QuestionSerializer, QuestionnaireAttemptSerializer
+from questionnaire.services import annotate_attempt_stats
+from sustindex.compiled_serializers import CompiledSerializer
+from sustindex.renderers import FastJSONRenderer, orjson
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the DRF serializers and JSON renderer with the compiled serializers and the '
+        'orjson renderer on a synthetic survey; everything is rolled back unless --keep is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--questions',
+            type=int,
+            default=500,
+            help='Questions of the synthetic survey (default: 500)',
+        )
+        parser.add_argument(
+            '--choices',
+            type=int,
+            default=4,
+            help='Choices per question (default: 4)',
+        )
+        parser.add_argument(
+            '--categories',
+            type=int,
+            default=5,
+            help='Categories the questions are spread over (default: 5)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Timed runs per case (default: 20)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for the generated answers (default: 0)',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the generated survey instead of rolling back',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            survey, categories, attempt = self.create_survey(options)
+            questions = Question.objects.filter(survey=survey, is_active=True).order_by('category', 'order')
+            categories = Category.objects.filter(pk__in=[category.pk for category in categories])
+            attempts = annotate_attempt_stats(QuestionnaireAttempt.objects.filter(pk=attempt.pk))
+
+            cases = [
+                (
+                    'Survey questions',
+                    lambda: QuestionSerializer(
+                        questions.select_related('category').prefetch_related('choices'), many=True
+                    ).data,
+                    lambda: CompiledSerializer(QuestionSerializer()).data(questions),
+                ),
+                (
+                    'Categories',
+                    lambda: CategorySerializer(CategorySerializer.sparse_queryset(categories), many=True).data,
+                    lambda: CompiledSerializer(CategorySerializer()).data(categories),
+                ),
+                (
+                    'Attempt retrieval',
+                    lambda: QuestionnaireAttemptSerializer(
+                        QuestionnaireAttemptSerializer.sparse_queryset(attempts).get()
+                    ).data,
+                    lambda: CompiledSerializer(QuestionnaireAttemptSerializer()).data(attempts)[0],
+                ),
+            ]
+            self.stdout.write(
+                f"JSON renderer: {'orjson ' + orjson.__version__ if orjson else 'stdlib (orjson not installed)'}"
+            )
+            for name, serialize, compile_ in cases:
+                self.compare(name, serialize, compile_, options['repeat'])
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Done' + ('' if options['keep'] else ' (rolled back)')
+        ))
+
+    def create_survey(self, options):
+        rng = random.Random(options['seed'])
+        survey = Survey.objects.create(name='Serializer benchmark')
+        categories = [
+            Category.objects.create(name=f'Benchmark category {i}', order=i, environmental_weight=1.0)
+            for i in range(max(1, options['categories']))
+        ]
+        questions = Question.objects.bulk_create([
+            Question(
+                survey=survey, category=categories[i % len(categories)], text=f'Benchmark question {i}',
+                order=i, allow_multiple=i % 4 == 0,
+            )
+            for i in range(options['questions'])
+        ])
+        choices = Choice.objects.bulk_create([
+            Choice(question=question, text=f'Choice {j}', score=j * 10, order=j)
+            for question in questions for j in range(max(1, options['choices']))
+        ])
+        by_question = {}
+        for choice in choices:
+            by_question.setdefault(choice.question_id, []).append(choice.pk)
+
+        user, _ = get_user_model().objects.get_or_create(username='benchmark-serializers')
+        attempt = QuestionnaireAttempt.objects.create(user=user, survey=survey)
+        Answer.objects.bulk_create([
+            Answer(
+                attempt=attempt, question=question,
+                choice_ids=rng.sample(by_question[question.pk], rng.randint(1, len(by_question[question.pk]))),
+            )
+            if question.allow_multiple
+            else Answer(attempt=attempt, question=question, choice_id=rng.choice(by_question[question.pk]))
+            for question in questions
+        ])
+        self.stdout.write(
+            f'Synthetic survey: {len(questions)} questions, {len(choices)} choices, '
+            f'{len(categories)} categories, one attempt answering every question'
+        )
+        return survey, categories, attempt
+
+    def compare(self, name, serialize, compile_, repeat):
+        drf = self.measure(lambda: JSONRenderer().render(serialize()), repeat)
+        compiled = self.measure(lambda: FastJSONRenderer().render(compile_()), repeat)
+        self.stdout.write(f'\n{name} ({len(drf["output"]) // 1024} KB of JSON)')
+        for label, result in (('DRF + stdlib json', drf), ('compiled + orjson', compiled)):
+            self.stdout.write(
+                f'  {label:<20} {result["seconds"] * 1000:8.1f} ms  {1 / result["seconds"]:7.1f}/s  '
+                f'{result["queries"]:3} queries  {result["peak"] / 1024:9.0f} KB peak allocated'
+            )
+        self.stdout.write(
+            f'  Speedup: {drf["seconds"] / compiled["seconds"]:.1f}x, '
+            f'allocations: {drf["peak"] / max(compiled["peak"], 1):.1f}x lower, '
+            f'identical output: {"yes" if drf["output"] == compiled["output"] else "NO"}'
+        )
+
+    def measure(self, render, repeat):
+        """Mean time, queries and peak traced allocations of render()"""
+        with CaptureQueriesContext(connection) as queries:
+            output = render()
+
+        tracemalloc.start()
+        render()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        for _ in range(max(1, repeat)):
+            render()
+        seconds = (time.perf_counter() - started) / max(1, repeat)
+        return {'output': output, 'queries': len(queries), 'peak': peak, 'seconds': seconds}
@@ -0,0 +1,77 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from questionnaire.models import QuestionnaireAttempt
+from questionnaire.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_results
+
+
+class Command(BaseCommand):
+    help = (
+        'Export attempt results with one row per attempt and the choices, score and notes of '
+        'every question, streamed as CSV or XLSX'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--session',
+            type=int,
+            help='Only attempts of this session ID',
+        )
+        parser.add_argument(
+            '--survey',
+            type=int,
+            help='Only attempts of this survey ID',
+        )
+        parser.add_argument(
+            '--completed',
+            action='store_true',
+            help='Only completed attempts',
+        )
+        parser.add_argument(
+            '--format',
+            choices=sorted(EXPORT_FORMATS),
+            help='File format (default: from the --output extension, otherwise csv)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='File to write (default: standard output)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help=f'Rows fetched from the database at a time (default: {EXPORT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        queryset = QuestionnaireAttempt.objects.all()
+
+        if options['session']:
+            queryset = queryset.filter(session_id=options['session'])
+        if options['survey']:
+            queryset = queryset.filter(survey_id=options['survey'])
+        if options['completed']:
+            queryset = queryset.filter(is_completed=True)
+
+        output = options['output']
+        file_format = options['format']
+        if file_format is None:
+            extension = output.rsplit('.', 1)[-1].lower() if output and '.' in output else ''
+            file_format = extension if extension in EXPORT_FORMATS else 'csv'
+        if output is None and file_format == 'xlsx' and sys.stdout.isatty():
+            raise CommandError('Refusing to write XLSX to a terminal; use --output or redirect')
+
+        size = 0
+        chunks = export_results(queryset, file_format, chunk_size=options['chunk_size'])
+        if output:
+            with open(output, 'wb') as destination:
+                for chunk in chunks:
+                    destination.write(chunk)
+                    size += len(chunk)
+            self.stdout.write(self.style.SUCCESS(f'Exported {queryset.count()} attempts to {output} ({size // 1024} KB)'))
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
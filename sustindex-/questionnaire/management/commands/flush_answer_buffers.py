@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from questionnaire.answer_buffer import buffer_settings, flush_buffers
+
+
+class Command(BaseCommand):
+    help = 'Write buffered autosaves of in-progress attempts to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            help='Only flush buffers older than this many seconds (default: all)',
+        )
+
+    def handle(self, *args, **options):
+        if not buffer_settings()['ENABLED']:
+            self.stdout.write(self.style.WARNING('Answer buffering is disabled (ANSWER_BUFFER["ENABLED"])'))
+            return
+
+        flushed = flush_buffers(max_age=options['max_age'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed answer buffers of {flushed} attempts'))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from questionnaire.models import QuestionnaireAttempt
+from questionnaire.bulk_scoring import reconcile_category_scores
+
+
+class Command(BaseCommand):
+    help = 'Verify stored per-category attempt totals against a full recompute and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--survey',
+            type=int,
+            help='Only attempts of this survey ID',
+        )
+        parser.add_argument(
+            '--attempt',
+            type=int,
+            help='Only this attempt ID',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Attempts checked per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drift without repairing it',
+        )
+
+    def handle(self, *args, **options):
+        queryset = QuestionnaireAttempt.objects.all()
+
+        if options['survey']:
+            queryset = queryset.filter(survey_id=options['survey'])
+        if options['attempt']:
+            queryset = queryset.filter(pk=options['attempt'])
+
+        def progress(done, total, drifted):
+            self.stdout.write(f"  {done}/{total} attempts checked, {drifted} drifted")
+
+        drifted = reconcile_category_scores(
+            queryset,
+            repair=not options['dry_run'],
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All stored category totals are in sync'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} attempts have drifted: {drifted[:20]}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired stored category totals of {len(drifted)} attempts'))
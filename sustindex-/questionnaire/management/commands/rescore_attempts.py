@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from datetime import datetime, time
+from questionnaire.models import QuestionnaireAttempt
+from questionnaire.bulk_scoring import rescore_attempts, NUMPY_AVAILABLE
+
+
+class Command(BaseCommand):
+    help = 'Recalculate stored scores for many attempts in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--survey',
+            type=int,
+            help='Only attempts of this survey ID',
+        )
+        parser.add_argument(
+            '--session',
+            type=int,
+            help='Only attempts of this session ID',
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Only attempts started on or after this date/datetime (ISO format)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Attempts loaded and written per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--no-numpy',
+            action='store_true',
+            help='Use the pure Python scorer even if NumPy is installed',
+        )
+
+    def handle(self, *args, **options):
+        queryset = QuestionnaireAttempt.objects.all()
+
+        if options['survey']:
+            queryset = queryset.filter(survey_id=options['survey'])
+        if options['session']:
+            queryset = queryset.filter(session_id=options['session'])
+        if options['since']:
+            queryset = queryset.filter(started_at__gte=self.parse_since(options['since']))
+
+        use_numpy = NUMPY_AVAILABLE and not options['no_numpy']
+        self.stdout.write(f"Scoring with {'NumPy' if use_numpy else 'pure Python'}")
+
+        def progress(done, total):
+            self.stdout.write(f"  {done}/{total} attempts rescored")
+
+        count = rescore_attempts(
+            queryset,
+            batch_size=options['batch_size'],
+            use_numpy=use_numpy,
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Successfully rescored {count} attempts'))
+
+    def parse_since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f"Invalid --since value '{value}'")
+            since = datetime.combine(day, time.min)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
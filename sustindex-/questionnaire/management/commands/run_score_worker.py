@@ -0,0 +1,118 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from questionnaire.jobs import (
+    DEFAULT_MAX_RETRIES, JOB_KINDS, LEASE_SECONDS, process_batch, release_expired, queue_stats, worker_name,
+)
+
+
+class Command(BaseCommand):
+    help = 'Drain the background job queue: finalize jobs of completed attempts and rescores after scoring-input changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Number of worker threads (default: 1)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Jobs claimed per batch (default: 100)',
+        )
+        parser.add_argument(
+            '--max-retries',
+            type=int,
+            default=DEFAULT_MAX_RETRIES,
+            help=f'Retries before a job is marked failed (default: {DEFAULT_MAX_RETRIES})',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait when the queue is empty (default: 5)',
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=LEASE_SECONDS,
+            help=f'Seconds after which a running job of a dead worker is requeued (default: {LEASE_SECONDS})',
+        )
+        parser.add_argument(
+            '--kind',
+            action='append',
+            choices=JOB_KINDS,
+            help='Only run jobs of this kind; may be repeated (default: all kinds)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit as soon as the queue is drained',
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *args: self.stopping.set())
+
+        concurrency = max(1, options['concurrency'])
+        if concurrency > 1 and connection.vendor == 'sqlite':
+            # SQLite allows a single writer; extra threads would only fight over the lock
+            self.stdout.write(self.style.WARNING('SQLite does not support concurrent writers, using 1 worker'))
+            concurrency = 1
+        stats = queue_stats()
+        self.stdout.write(
+            f"Starting {concurrency} worker(s): {stats['pending']} pending, "
+            f"{stats['failed']} failed, lag {stats['lag_seconds']}s"
+        )
+
+        self.processed = 0
+        self.lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            workers = [pool.submit(self.work, options) for _ in range(concurrency)]
+            try:
+                for worker in workers:
+                    worker.result()
+            except KeyboardInterrupt:
+                # Let the threads finish their current batch
+                self.stopping.set()
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {self.processed} jobs'))
+
+    def work(self, options):
+        name = worker_name()
+        kinds = options['kind'] or JOB_KINDS
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    release_expired(options['lease'])
+                    claimed = sum(
+                        process_batch(
+                            kind,
+                            batch_size=options['batch_size'],
+                            max_retries=options['max_retries'],
+                            worker=name,
+                        )
+                        for kind in kinds
+                    )
+                except DatabaseError as e:
+                    self.stderr.write(f"  {name}: database error, retrying: {e}")
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+                if claimed:
+                    with self.lock:
+                        self.processed += claimed
+                        self.stdout.write(f"  {name}: {claimed} jobs, {self.processed} total")
+                elif options['once']:
+                    break
+                else:
+                    self.stopping.wait(options['poll_interval'])
+        finally:
+            connection.close()
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from questionnaire.models import Question, Category
+from questionnaire.services import structure_changed
+from questionnaire.jobs import enqueue_for_questions
 
 
 class Command(BaseCommand):
@@ -66,7 +68,11 @@ class Command(BaseCommand):
             self.stdout.write(f"Filtering by IDs: {ids}")
 
         # Apply changes
+        survey_ids = set(queryset.values_list('survey_id', flat=True))
+        question_ids = list(queryset.values_list('pk', flat=True))
         count = queryset.update(allow_multiple=value)
+        structure_changed(survey_ids)
+        enqueue_for_questions(question_ids, 'allow_multiple changed by set_multiple_choice')
         
         action = "enabled" if value else "disabled"
         self.stdout.write(
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 08:49
+
+import questionnaire.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0010_answer_notes_userdocument_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='structure_version',
+            field=models.CharField(default=questionnaire.models.new_structure_version, editable=False, max_length=32, verbose_name='Structure Version'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 08:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0011_survey_structure_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttemptCategoryScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('earned_points', models.IntegerField(default=0, verbose_name='Earned Points')),
+                ('possible_points', models.IntegerField(default=0, verbose_name='Possible Points')),
+                ('answered_count', models.IntegerField(default=0, verbose_name='Answered Questions')),
+                ('structure_version', models.CharField(blank=True, max_length=32, verbose_name='Structure Version')),
+                ('attempt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_scores', to='questionnaire.questionnaireattempt', verbose_name='Attempt')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempt_scores', to='questionnaire.category', verbose_name='Category')),
+            ],
+            options={
+                'verbose_name': 'Attempt Category Score',
+                'verbose_name_plural': 'Attempt Category Scores',
+                'unique_together': {('attempt', 'category')},
+            },
+        ),
+    ]
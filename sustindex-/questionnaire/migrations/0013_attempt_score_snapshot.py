@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0012_attemptcategoryscore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionnaireattempt',
+            name='score_snapshot',
+            field=models.JSONField(blank=True, default=dict, help_text='Frozen scores including the per-category breakdown', verbose_name='Score Snapshot'),
+        ),
+        migrations.AddField(
+            model_name='questionnaireattempt',
+            name='scored_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Scored At'),
+        ),
+        migrations.AddField(
+            model_name='questionnaireattempt',
+            name='scores_stale',
+            field=models.BooleanField(default=False, help_text='Scoring inputs changed after the snapshot was taken', verbose_name='Scores Stale'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0014_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionnaireattempt',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented on every answer write, used to reject stale autosaves', verbose_name='Revision'),
+        ),
+    ]
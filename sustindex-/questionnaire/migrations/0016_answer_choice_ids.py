@@ -0,0 +1,60 @@
+from django.db import migrations
+
+import questionnaire.fields
+
+
+BATCH_SIZE = 2000
+
+
+def copy_selections(apps, schema_editor):
+    """Fill Answer.choice_ids from the Answer.choices through table"""
+    Answer = apps.get_model('questionnaire', 'Answer')
+    AnswerChoice = Answer.choices.through
+    db_alias = schema_editor.connection.alias
+
+    selections = {}
+    for answer_id, choice_id in AnswerChoice.objects.using(db_alias).values_list('answer_id', 'choice_id').iterator():
+        selections.setdefault(answer_id, []).append(choice_id)
+
+    answer_ids = sorted(selections)
+    for start in range(0, len(answer_ids), BATCH_SIZE):
+        batch = [
+            Answer(pk=answer_id, choice_ids=sorted(selections[answer_id]))
+            for answer_id in answer_ids[start:start + BATCH_SIZE]
+        ]
+        Answer.objects.using(db_alias).bulk_update(batch, ['choice_ids'])
+
+
+def restore_selections(apps, schema_editor):
+    """Rebuild the through table from Answer.choice_ids"""
+    Answer = apps.get_model('questionnaire', 'Answer')
+    AnswerChoice = Answer.choices.through
+    db_alias = schema_editor.connection.alias
+
+    links = []
+    for answer_id, choice_ids in Answer.objects.using(db_alias).values_list('pk', 'choice_ids').iterator():
+        links.extend(AnswerChoice(answer_id=answer_id, choice_id=choice_id) for choice_id in choice_ids)
+        if len(links) >= BATCH_SIZE:
+            AnswerChoice.objects.using(db_alias).bulk_create(links, ignore_conflicts=True)
+            links = []
+    AnswerChoice.objects.using(db_alias).bulk_create(links, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0015_attempt_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='choice_ids',
+            field=questionnaire.fields.ChoiceIdsField(verbose_name='Selected Choices (Multiple)'),
+        ),
+        migrations.RunPython(copy_selections, restore_selections),
+        migrations.RemoveField(
+            model_name='answer',
+            name='choices',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0016_answer_choice_ids'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('rescore', 'Rescore attempt'), ('finalize', 'Finalize completed attempt')], max_length=20, verbose_name='Kind'),
+        ),
+    ]
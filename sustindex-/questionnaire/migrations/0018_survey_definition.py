@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0017_backgroundjob_finalize_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyDefinition',
+            fields=[
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='definition', serialize=False, to='questionnaire.survey', verbose_name='Survey')),
+                ('version', models.CharField(help_text='Structure version and format the content was built from', max_length=64, verbose_name='Version')),
+                ('content', models.TextField(help_text='JSON document of the active questions with their choices', verbose_name='Content')),
+                ('built_at', models.DateTimeField(auto_now=True, verbose_name='Built At')),
+            ],
+            options={
+                'verbose_name': 'Survey Definition',
+                'verbose_name_plural': 'Survey Definitions',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0018_survey_definition'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['answered_at', 'id'], name='questionnai_answere_0d2ffb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionnaireattempt',
+            index=models.Index(fields=['started_at', 'id'], name='questionnai_started_d8b89f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionnaireattempt',
+            index=models.Index(fields=['user', 'started_at', 'id'], name='questionnai_user_id_8b3893_idx'),
+        ),
+    ]
@@ -3,6 +3,14 @@ from django.conf import settings
 from ckeditor.fields import RichTextField
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+import uuid
+
+from .fields import ChoiceIdsField
+
+
+def new_structure_version():
+    """Fresh version stamp for a survey's question/choice/category structure"""
+    return uuid.uuid4().hex
 
 
 class Survey(models.Model):
@@ -19,6 +27,8 @@ class Survey(models.Model):
     allow_multiple_attempts = models.BooleanField(default=False, verbose_name=_('Allow Multiple Attempts'))
     show_results_immediately = models.BooleanField(default=True, verbose_name=_('Show Results Immediately'))
     
+    structure_version = models.CharField(max_length=32, default=new_structure_version, editable=False, verbose_name=_('Structure Version'))
+    
     class Meta:
         verbose_name = _('Survey')
         verbose_name_plural = _('Surveys')
@@ -34,6 +44,17 @@ class Survey(models.Model):
     def get_active_sessions(self):
         """Get active sessions for this survey"""
         return self.sessions.filter(is_active=True)
+    
+    @classmethod
+    def bump_structure_version(cls, survey_ids=None):
+        """
+        Invalidate cached scoring plans after a structural change.
+        Without survey_ids every survey is bumped (categories are shared).
+        """
+        queryset = cls.objects.all()
+        if survey_ids is not None:
+            queryset = queryset.filter(pk__in=[pk for pk in survey_ids if pk is not None])
+        return queryset.update(structure_version=new_structure_version())
 
 
 class SurveySession(models.Model):
@@ -104,25 +125,8 @@ class Category(models.Model):
     
     def get_category_score(self, attempt):
         """Calculate category score for an attempt"""
-        questions = self.questions.filter(is_active=True)
-        if not questions.exists():
-            return 0
-        
-        total_score = 0
-        total_possible = 0
-        
-        for question in questions:
-            answer = attempt.answers.filter(question=question).first()
-            if answer:
-                total_score += answer.get_total_score()
-                max_choice_score = question.choices.aggregate(models.Max('score'))['score__max'] or 0
-                total_possible += max_choice_score
-        
-        if total_possible == 0:
-            return 0
-        
-        percentage = (total_score / total_possible) * 100
-        return min(percentage, self.max_score)
+        from .services import get_category_score
+        return get_category_score(self, attempt)
 
 
 class Question(models.Model):
@@ -162,6 +166,24 @@ class Choice(models.Model):
         return f"{self.text} (Score: {self.score})"
 
 
+class SurveyDefinition(models.Model):
+    """
+    Pre-serialized questions of a survey, built once per structure_version
+    and served as-is by the survey questions endpoint
+    """
+    survey = models.OneToOneField(Survey, on_delete=models.CASCADE, primary_key=True, related_name='definition', verbose_name=_('Survey'))
+    version = models.CharField(max_length=64, verbose_name=_('Version'), help_text=_('Structure version and format the content was built from'))
+    content = models.TextField(verbose_name=_('Content'), help_text=_('JSON document of the active questions with their choices'))
+    built_at = models.DateTimeField(auto_now=True, verbose_name=_('Built At'))
+    
+    class Meta:
+        verbose_name = _('Survey Definition')
+        verbose_name_plural = _('Survey Definitions')
+    
+    def __str__(self):
+        return f"{self.survey_id} @ {self.version}"
+
+
 class QuestionnaireAttempt(models.Model):
     """User attempts to complete questionnaire"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='attempts', verbose_name=_('User'))
@@ -177,10 +199,20 @@ class QuestionnaireAttempt(models.Model):
     governance_score = models.FloatField(default=0.0, verbose_name=_('Governance Score'))
     overall_grade = models.CharField(max_length=2, blank=True, verbose_name=_('Overall Grade'))
     
+    score_snapshot = models.JSONField(default=dict, blank=True, verbose_name=_('Score Snapshot'), help_text=_('Frozen scores including the per-category breakdown'))
+    scored_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Scored At'))
+    scores_stale = models.BooleanField(default=False, verbose_name=_('Scores Stale'), help_text=_('Scoring inputs changed after the snapshot was taken'))
+    revision = models.PositiveIntegerField(default=0, verbose_name=_('Revision'), help_text=_('Incremented on every answer write, used to reject stale autosaves'))
+    
     class Meta:
         verbose_name = _('Questionnaire Attempt')
         verbose_name_plural = _('Questionnaire Attempts')
         ordering = ['-started_at']
+        indexes = [
+            # Cursor pagination: all attempts and a user's attempts, newest first
+            models.Index(fields=['started_at', 'id']),
+            models.Index(fields=['user', 'started_at', 'id']),
+        ]
     
     def __str__(self):
         survey_name = self.survey.name if self.survey else 'No Survey'
@@ -195,27 +227,18 @@ class QuestionnaireAttempt(models.Model):
     
     def calculate_scores(self):
         """Calculate separate scores"""
-        categories = Category.objects.all()
+        from .services import score_attempt, snapshot_from_result
+        result = score_attempt(self)
         
-        env_score = 0
-        social_score = 0
-        gov_score = 0
+        self.environmental_score = result['environmental']
+        self.social_score = result['social']
+        self.governance_score = result['governance']
+        self.total_score = result['total']
+        self.overall_grade = result['grade']
         
-        for category in categories:
-            category_score = category.get_category_score(self)
-            
-            env_score += category_score * category.environmental_weight
-            social_score += category_score * category.social_weight  
-            gov_score += category_score * category.governance_weight
-        
-        self.environmental_score = round(env_score, 2)
-        self.social_score = round(social_score, 2)
-        self.governance_score = round(gov_score, 2)
-        
-        total = (self.environmental_score + self.social_score + self.governance_score) / 3
-        self.total_score = round(total, 2)
-        
-        self.overall_grade = self.get_overall_grade()
+        self.score_snapshot = snapshot_from_result(result)
+        self.scored_at = timezone.now()
+        self.scores_stale = False
         
         self.save()
         return {
@@ -228,47 +251,119 @@ class QuestionnaireAttempt(models.Model):
     
     def get_overall_grade(self):
         """Determine grade based on total score"""
-        if self.total_score >= 80:
-            return 'A+'
-        elif self.total_score >= 70:
-            return 'A'
-        elif self.total_score >= 60:
-            return 'B+'
-        elif self.total_score >= 50:
-            return 'B'
-        elif self.total_score >= 40:
-            return 'C+'
-        elif self.total_score >= 30:
-            return 'C'
-        else:
-            return 'D'
+        from .services import grade_for_score
+        return grade_for_score(self.total_score)
     
     def get_recommendations(self):
         """Provide recommendations based on scores"""
-        recommendations = []
-        
-        if self.environmental_score < 50:
-            recommendations.append({
-                'category': 'Environmental',
-                'priority': 'High',
-                'suggestion': 'Focus on waste management and renewable energy adoption'
-            })
-        
-        if self.social_score < 50:
-            recommendations.append({
-                'category': 'Social',
-                'priority': 'High', 
-                'suggestion': 'Improve employee training and diversity programs'
-            })
-        
-        if self.governance_score < 50:
-            recommendations.append({
-                'category': 'Governance',
-                'priority': 'High',
-                'suggestion': 'Strengthen board independence and transparency reporting'
-            })
-        
-        return recommendations
+        return score_recommendations(self.environmental_score, self.social_score, self.governance_score)
+
+
+def score_recommendations(environmental_score, social_score, governance_score):
+    """Recommendations for an attempt's pillar scores"""
+    recommendations = []
+    
+    if environmental_score < 50:
+        recommendations.append({
+            'category': 'Environmental',
+            'priority': 'High',
+            'suggestion': 'Focus on waste management and renewable energy adoption'
+        })
+    
+    if social_score < 50:
+        recommendations.append({
+            'category': 'Social',
+            'priority': 'High', 
+            'suggestion': 'Improve employee training and diversity programs'
+        })
+    
+    if governance_score < 50:
+        recommendations.append({
+            'category': 'Governance',
+            'priority': 'High',
+            'suggestion': 'Strengthen board independence and transparency reporting'
+        })
+    
+    return recommendations
+
+
+class AttemptCategoryScore(models.Model):
+    """Running per-category score totals of an attempt, maintained on every answer write"""
+    attempt = models.ForeignKey(QuestionnaireAttempt, on_delete=models.CASCADE, related_name='category_scores', verbose_name=_('Attempt'))
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='attempt_scores', verbose_name=_('Category'))
+    earned_points = models.IntegerField(default=0, verbose_name=_('Earned Points'))
+    possible_points = models.IntegerField(default=0, verbose_name=_('Possible Points'))
+    answered_count = models.IntegerField(default=0, verbose_name=_('Answered Questions'))
+    structure_version = models.CharField(max_length=32, blank=True, verbose_name=_('Structure Version'))
+    
+    class Meta:
+        verbose_name = _('Attempt Category Score')
+        verbose_name_plural = _('Attempt Category Scores')
+        unique_together = ['attempt', 'category']
+    
+    def __str__(self):
+        return f"{self.attempt_id} - {self.category_id}: {self.earned_points}/{self.possible_points}"
+
+
+class BackgroundJob(models.Model):
+    """Unit of deferred work drained by the run_score_worker command"""
+    KIND_RESCORE = 'rescore'
+    KIND_FINALIZE = 'finalize'
+    KIND_CHOICES = [
+        (KIND_RESCORE, _('Rescore attempt')),
+        (KIND_FINALIZE, _('Finalize completed attempt')),
+    ]
+    
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_DONE, _('Done')),
+        (STATUS_FAILED, _('Failed')),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name=_('Kind'))
+    attempt = models.ForeignKey(QuestionnaireAttempt, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs', verbose_name=_('Attempt'))
+    reason = models.CharField(max_length=200, blank=True, verbose_name=_('Reason'))
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name=_('Status'))
+    retries = models.IntegerField(default=0, verbose_name=_('Retries'))
+    last_error = models.TextField(blank=True, verbose_name=_('Last Error'))
+    claimed_by = models.CharField(max_length=100, blank=True, verbose_name=_('Claimed By'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
+    run_after = models.DateTimeField(default=timezone.now, verbose_name=_('Run After'))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Started At'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Finished At'))
+    
+    class Meta:
+        verbose_name = _('Background Job')
+        verbose_name_plural = _('Background Jobs')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.attempt_id} ({self.get_status_display()})"
+
+
+class TableVersion(models.Model):
+    """
+    Version of a table read by the conditional API views, replaced whenever
+    one of its rows changes (sustindex.conditional)
+    """
+    table = models.CharField(max_length=100, unique=True, verbose_name=_('Table'))
+    version = models.CharField(max_length=32, verbose_name=_('Version'))
+    changed_at = models.DateTimeField(verbose_name=_('Changed At'))
+    
+    class Meta:
+        verbose_name = _('Table Version')
+        verbose_name_plural = _('Table Versions')
+    
+    def __str__(self):
+        return f"{self.table}: {self.version}"
 
 
 class Answer(models.Model):
@@ -276,7 +371,7 @@ class Answer(models.Model):
     attempt = models.ForeignKey(QuestionnaireAttempt, on_delete=models.CASCADE, related_name='answers', verbose_name=_('Attempt'))
     question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name=_('Question'))
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE, null=True, blank=True, verbose_name=_('Selected Choice (Single)'))
-    choices = models.ManyToManyField(Choice, related_name='answers_multiple', blank=True, verbose_name=_('Selected Choices (Multiple)'))
+    choice_ids = ChoiceIdsField(verbose_name=_('Selected Choices (Multiple)'))
     notes = models.TextField(blank=True, null=True, verbose_name=_('Notes/Comments'), help_text=_('Additional notes or comments for this answer'))
     answered_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Answered At'))
     
@@ -284,23 +379,33 @@ class Answer(models.Model):
         verbose_name = _('Answer')
         verbose_name_plural = _('Answers')
         unique_together = ['attempt', 'question']
+        indexes = [
+            models.Index(fields=['answered_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.attempt.user.username} - {self.question}"
     
+    def get_selected_choices(self):
+        """Selected choices of a multiple-choice answer, from the question's prefetched choices when available"""
+        if not self.choice_ids:
+            return []
+        selected = set(self.choice_ids)
+        return [choice for choice in self.question.choices.all() if choice.pk in selected]
+    
     def get_total_score(self):
         """Calculate total score for this answer"""
-        if not self.choice and not self.choices.exists():
+        if self.is_cannot_answer():
             return 0
         
         if self.question.allow_multiple:
-            return sum(choice.score for choice in self.choices.all())
+            return sum(choice.score for choice in self.get_selected_choices())
         else:
             return self.choice.score if self.choice else 0
     
     def is_cannot_answer(self):
         """Check if user selected 'cannot answer'"""
-        return not self.choice and not self.choices.exists()
+        return not self.choice_id and not self.choice_ids
     
     def get_selected_choices_display(self):
         """Display selected choices"""
@@ -308,7 +413,7 @@ class Answer(models.Model):
             return "Cannot answer"
         
         if self.question.allow_multiple:
-            return ", ".join([choice.text for choice in self.choices.all()])
+            return ", ".join([choice.text for choice in self.get_selected_choices()])
         else:
             return self.choice.text if self.choice else "-"
 
@@ -333,11 +438,16 @@ class UserDocument(models.Model):
 
     def get_file_size_display(self):
         """Return human readable file size"""
-        if self.file_size < 1024:
-            return f"{self.file_size} B"
-        elif self.file_size < 1024 * 1024:
-            return f"{self.file_size // 1024} KB"
-        else:
-            return f"{self.file_size // (1024 * 1024)} MB"
+        return format_file_size(self.file_size)
+
+
+def format_file_size(size):
+    """Human readable file size"""
+    if size < 1024:
+        return f"{size} B"
+    elif size < 1024 * 1024:
+        return f"{size // 1024} KB"
+    else:
+        return f"{size // (1024 * 1024)} MB"
 
 
@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class AttemptCursorPagination(CursorPagination):
+    """
+    Keyset pagination over attempts, newest first. Pages stay stable while
+    new attempts are started and cost no COUNT query; the id breaks ties
+    between attempts started at the same time.
+    """
+    ordering = ('-started_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class AttemptSummaryPagination(AttemptCursorPagination):
+    """Cursor pagination of the flat attempt summaries"""
+
+
+class AnswerCursorPagination(CursorPagination):
+    """Keyset pagination over answers, most recently answered first"""
+    ordering = ('-answered_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -1,17 +1,21 @@
 from rest_framework import serializers
+from sustindex.sparse_fields import SparseFieldsMixin
 from .models import (
     Survey, SurveySession, Category, Question, Choice, 
-    QuestionnaireAttempt, Answer, UserDocument
+    QuestionnaireAttempt, Answer, UserDocument, score_recommendations, format_file_size
 )
+from .services import attempt_stats, attempt_stats_bulk, build_stats
+from .answer_buffer import merge_answer_data, current_revision
+from .answers import upsert_answer
 
 
-class ChoiceSerializer(serializers.ModelSerializer):
+class ChoiceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Choice
         fields = ['id', 'text', 'score', 'order']
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+class QuestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     choices = ChoiceSerializer(many=True, read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
     
@@ -21,7 +25,7 @@ class QuestionSerializer(serializers.ModelSerializer):
                   'order', 'is_active', 'allow_multiple', 'attachment', 'choices']
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     questions = QuestionSerializer(many=True, read_only=True)
     
     class Meta:
@@ -31,50 +35,142 @@ class CategorySerializer(serializers.ModelSerializer):
                   'max_score', 'questions']
 
 
-class SurveySessionSerializer(serializers.ModelSerializer):
+class SurveySessionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     status = serializers.CharField(source='get_status_display', read_only=True)
     is_open = serializers.BooleanField(read_only=True)
     
+    sparse_sources = {
+        'status': ['is_active', 'start_date', 'end_date'],
+        'is_open': ['is_active', 'start_date', 'end_date'],
+    }
+    
     class Meta:
         model = SurveySession
         fields = ['id', 'survey', 'name', 'description', 'start_date', 
                   'end_date', 'is_active', 'status', 'is_open', 'created_at']
 
 
-class SurveySerializer(serializers.ModelSerializer):
-    questions = QuestionSerializer(many=True, read_only=True)
-    sessions = SurveySessionSerializer(many=True, read_only=True)
-    total_questions = serializers.IntegerField(source='get_total_questions', read_only=True)
+class SurveySummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Flat survey representation for list views. The counts come from the
+    active_question_count / session_count annotations when present.
+    """
+    total_questions = serializers.SerializerMethodField()
+    total_sessions = serializers.SerializerMethodField()
+    
+    # Annotated by SurveyViewSet
+    sparse_sources = {'total_questions': [], 'total_sessions': []}
     
     class Meta:
         model = Survey
         fields = ['id', 'name', 'description', 'is_active', 'created_at', 
                   'updated_at', 'allow_multiple_attempts', 'show_results_immediately',
-                  'total_questions', 'questions', 'sessions']
+                  'total_questions', 'total_sessions']
+    
+    def get_total_questions(self, obj):
+        count = getattr(obj, 'active_question_count', None)
+        return obj.get_total_questions() if count is None else count
+    
+    def get_total_sessions(self, obj):
+        count = getattr(obj, 'session_count', None)
+        return obj.sessions.count() if count is None else count
 
 
-class UserDocumentSerializer(serializers.ModelSerializer):
+class SurveySerializer(SurveySummarySerializer):
+    """
+    Survey with its questions and sessions nested. Pass expand=[...] in the
+    serializer context to keep only some of the nested fields.
+    """
+    EXPANDABLE_FIELDS = ('questions', 'sessions')
+    
+    questions = QuestionSerializer(many=True, read_only=True)
+    sessions = SurveySessionSerializer(many=True, read_only=True)
+    
+    class Meta(SurveySummarySerializer.Meta):
+        fields = SurveySummarySerializer.Meta.fields + ['questions', 'sessions']
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = self.context.get('expand')
+        if expand is not None:
+            for name in self.EXPANDABLE_FIELDS:
+                if name not in expand:
+                    self.fields.pop(name, None)
+
+
+class UserDocumentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     file_size_display = serializers.CharField(source='get_file_size_display', read_only=True)
     
+    sparse_sources = {'file_size_display': ['file_size']}
+    
     class Meta:
         model = UserDocument
         fields = ['id', 'title', 'description', 'file', 'uploaded_at', 'file_size', 'file_size_display']
+    
+    def compiled_file_size_display(self, row):
+        return format_file_size(row['file_size'])
 
 
-class AnswerSerializer(serializers.ModelSerializer):
+class AnswerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     question_text = serializers.CharField(source='question.text', read_only=True)
     choice_text = serializers.CharField(source='choice.text', read_only=True)
+    choices = serializers.ListField(child=serializers.IntegerField(), source='choice_ids', required=False)
     choices_display = serializers.CharField(source='get_selected_choices_display', read_only=True)
     documents = UserDocumentSerializer(many=True, read_only=True)
     total_score = serializers.IntegerField(source='get_total_score', read_only=True)
     
+    sparse_sources = {
+        'choices_display': ['choice_ids', 'choice__text', 'question__allow_multiple'],
+        'total_score': ['choice_ids', 'choice__score', 'question__allow_multiple'],
+    }
+    sparse_prefetch_related = {
+        'choices_display': ['question__choices'],
+        'total_score': ['question__choices'],
+    }
+    
     class Meta:
         model = Answer
         fields = ['id', 'question', 'question_text', 'choice', 'choice_text', 
                   'choices', 'choices_display', 'notes', 'answered_at', 'total_score', 'documents']
+    
+    def compiled_prepare(self, rows):
+        """Load the choices of the multiple-choice questions answered in rows"""
+        self.compiled_choices = {}
+        if 'choices_display' not in self.fields and 'total_score' not in self.fields:
+            return
+        questions = {row['question'] for row in rows if row['question__allow_multiple'] and row['choice_ids']}
+        choices = Choice.objects.filter(question_id__in=questions).values_list('question_id', 'pk', 'text', 'score')
+        for question_id, pk, text, score in choices:
+            self.compiled_choices.setdefault(question_id, []).append((pk, text, score))
+    
+    def _compiled_selected(self, row):
+        """(text, score) of the selected choices, as Answer.get_selected_choices()"""
+        selected = set(row['choice_ids'])
+        return [(text, score) for pk, text, score in self.compiled_choices.get(row['question'], ()) if pk in selected]
+    
+    def compiled_choices_display(self, row):
+        if not row['choice'] and not row['choice_ids']:
+            return 'Cannot answer'
+        if row['question__allow_multiple']:
+            return ', '.join(text for text, _ in self._compiled_selected(row))
+        return row['choice__text'] if row['choice'] else '-'
+    
+    def compiled_total_score(self, row):
+        if not row['choice'] and not row['choice_ids']:
+            return 0
+        if row['question__allow_multiple']:
+            return sum(score for _, score in self._compiled_selected(row))
+        return row['choice__score'] if row['choice'] else 0
+    
+    def validate_choices(self, value):
+        value = sorted(set(value))
+        missing = set(value) - set(Choice.objects.filter(id__in=value).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f'Invalid choices {sorted(missing)}')
+        return value
 
 
-class AnswerCreateSerializer(serializers.ModelSerializer):
+class AnswerCreateSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     choices_ids = serializers.ListField(
         child=serializers.IntegerField(), 
         write_only=True, 
@@ -86,21 +182,49 @@ class AnswerCreateSerializer(serializers.ModelSerializer):
         fields = ['question', 'choice', 'choices_ids', 'notes']
     
     def create(self, validated_data):
-        choices_ids = validated_data.pop('choices_ids', [])
-        answer = Answer.objects.create(**validated_data)
-        
-        if choices_ids:
-            answer.choices.set(Choice.objects.filter(id__in=choices_ids))
-        
-        return answer
+        # Upsert on (attempt, question): answering a question again replaces the answer
+        choices_ids = validated_data.get('choices_ids', [])
+        choice = validated_data.get('choice')
+        return upsert_answer(
+            validated_data['attempt'],
+            validated_data['question'].pk,
+            choice.pk if choice else None,
+            Choice.objects.filter(id__in=choices_ids).values_list('pk', flat=True) if choices_ids else (),
+            validated_data.get('notes'),
+        )
+
+
+class AnswerBatchItemSerializer(serializers.Serializer):
+    question = serializers.IntegerField()
+    choice = serializers.IntegerField(required=False, allow_null=True)
+    choices_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
 
+class AnswerBatchSerializer(serializers.Serializer):
+    answers = AnswerBatchItemSerializer(many=True, allow_empty=False)
 
-class QuestionnaireAttemptSerializer(serializers.ModelSerializer):
+
+class AnswerAutosaveSerializer(serializers.Serializer):
+    base_revision = serializers.IntegerField(min_value=0)
+    answers = AnswerBatchItemSerializer(many=True, required=False, default=list)
+    cleared = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+
+class QuestionnaireAttemptSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     answers = AnswerSerializer(many=True, read_only=True)
     user_name = serializers.CharField(source='user.username', read_only=True)
     survey_name = serializers.CharField(source='survey.name', read_only=True)
     session_name = serializers.CharField(source='session.name', read_only=True)
     recommendations = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+    
+    sparse_sources = {
+        'recommendations': ['is_completed', 'environmental_score', 'social_score', 'governance_score'],
+        # From annotate_attempt_stats()
+        'progress': [],
+    }
+    sparse_always = ('is_completed',)
     
     class Meta:
         model = QuestionnaireAttempt
@@ -108,7 +232,48 @@ class QuestionnaireAttemptSerializer(serializers.ModelSerializer):
                   'session', 'session_name', 'started_at', 'completed_at', 
                   'is_completed', 'total_score', 'environmental_score', 
                   'social_score', 'governance_score', 'overall_grade', 
-                  'answers', 'recommendations']
+                  'answers', 'recommendations', 'progress', 'revision']
+    
+    def get_progress(self, obj):
+        return attempt_stats(obj)
+    
+    def to_representation(self, obj):
+        data = super().to_representation(obj)
+        if not obj.is_completed:
+            data = self.merge_buffered(obj, data)
+        return data
+    
+    def merge_buffered(self, attempt, data):
+        """Apply the autosaves not yet flushed from the answer buffer"""
+        if 'answers' in data:
+            data['answers'] = merge_answer_data(attempt, data['answers'])
+        if 'revision' in data:
+            data['revision'] = current_revision(attempt)
+        return data
+    
+    def compiled_prepare(self, rows):
+        # Progress of attempts read without annotate_attempt_stats()
+        self.compiled_stats = {}
+        if 'progress' in self.fields and rows and 'stats_total_questions' not in rows[0]:
+            self.compiled_stats = attempt_stats_bulk(
+                QuestionnaireAttempt.objects.filter(pk__in=[row['id'] for row in rows])
+            )
+    
+    def compiled_progress(self, row):
+        if 'stats_total_questions' in row:
+            return build_stats(row['stats_total_questions'], row['stats_cannot_answer'])
+        return self.compiled_stats.get(row['id'], build_stats(0, 0))
+    
+    def compiled_recommendations(self, row):
+        if row['is_completed']:
+            return score_recommendations(row['environmental_score'], row['social_score'], row['governance_score'])
+        return []
+    
+    def compiled_finalize(self, row, data):
+        if row['is_completed']:
+            return data
+        # The buffer lookups only read the id and revision
+        return self.merge_buffered(QuestionnaireAttempt(pk=row['id'], revision=row.get('revision', 0)), data)
     
     def get_recommendations(self, obj):
         if obj.is_completed:
@@ -116,7 +281,24 @@ class QuestionnaireAttemptSerializer(serializers.ModelSerializer):
         return []
 
 
-class QuestionnaireAttemptCreateSerializer(serializers.ModelSerializer):
+class AttemptSummarySerializer(SparseFieldsMixin, serializers.Serializer):
+    """Flat attempt row from summaries.attempt_summaries() (a .values() dict)"""
+    id = serializers.IntegerField()
+    survey = serializers.IntegerField(source='survey_id', allow_null=True)
+    survey_name = serializers.CharField(source='survey__name', allow_null=True)
+    session_name = serializers.CharField(source='session__name', allow_null=True)
+    started_at = serializers.DateTimeField()
+    completed_at = serializers.DateTimeField(allow_null=True)
+    is_completed = serializers.BooleanField()
+    total_score = serializers.IntegerField()
+    environmental_score = serializers.FloatField()
+    social_score = serializers.FloatField()
+    governance_score = serializers.FloatField()
+    overall_grade = serializers.CharField()
+
+
+class QuestionnaireAttemptCreateSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = QuestionnaireAttempt
-        fields = ['survey', 'session']
+        fields = ['id', 'survey', 'session', 'revision']
+        read_only_fields = ['id', 'revision']
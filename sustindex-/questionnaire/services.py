@@ -1,7 +1,640 @@
 """
 Service functions for questionnaire calculations and statistics
 """
+import threading
+from types import MappingProxyType
+
+from django.db import transaction
 from django.db.models import Count, Q
+from django.utils import timezone
+
+from sustindex.conditional import bump_table_versions
+
+
+GRADE_THRESHOLDS = (
+    (80, 'A+'),
+    (70, 'A'),
+    (60, 'B+'),
+    (50, 'B'),
+    (40, 'C+'),
+    (30, 'C'),
+)
+
+
+def grade_for_score(score, thresholds=GRADE_THRESHOLDS):
+    """Map a total score to a letter grade"""
+    for minimum, grade in thresholds:
+        if score >= minimum:
+            return grade
+    return 'D'
+
+
+def category_percentage(earned, possible, max_score):
+    """
+    Percentage earned in a category, capped at the category's max_score
+    """
+    if possible == 0:
+        return 0
+    percentage = (earned / possible) * 100
+    return min(percentage, max_score)
+
+
+class PlanCategory:
+    """Read-only snapshot of a category as seen by a scoring plan"""
+    __slots__ = ('id', 'name', 'description', 'max_score',
+                 'environmental_weight', 'social_weight', 'governance_weight')
+    
+    def __init__(self, id, name, description, max_score,
+                 environmental_weight, social_weight, governance_weight):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.max_score = max_score
+        self.environmental_weight = environmental_weight
+        self.social_weight = social_weight
+        self.governance_weight = governance_weight
+
+
+class ScoringPlan:
+    """
+    Compiled scoring structure of one survey.
+
+    Holds everything scoring needs from the structural tables:
+    question -> category index, question -> max choice score, the set of
+    multiple-choice questions, choice -> score, and the category weight
+    matrix (one (E, S, G) row per category, in category display order).
+    Plans are immutable and shared between requests.
+    """
+    __slots__ = ('survey_id', 'version', 'categories', 'category_index', 'weights',
+                 'question_category', 'question_max', 'multiple_questions',
+                 'inactive_questions', 'choice_scores')
+    
+    def __init__(self, survey_id, version, categories, questions, choices):
+        object.__setattr__(self, 'survey_id', survey_id)
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'categories', tuple(categories))
+        object.__setattr__(self, 'category_index', MappingProxyType(
+            {category.id: index for index, category in enumerate(self.categories)}
+        ))
+        object.__setattr__(self, 'weights', tuple(
+            (c.environmental_weight, c.social_weight, c.governance_weight) for c in self.categories
+        ))
+        
+        question_category = {}
+        question_max = {}
+        multiple = set()
+        inactive = set()
+        for question_id, category_id, allow_multiple, is_active in questions:
+            if not is_active:
+                inactive.add(question_id)
+                continue
+            question_category[question_id] = self.category_index[category_id]
+            question_max[question_id] = None
+            if allow_multiple:
+                multiple.add(question_id)
+        
+        choice_scores = {}
+        for choice_id, question_id, score in choices:
+            choice_scores[choice_id] = score
+            if question_id in question_max:
+                current = question_max[question_id]
+                if current is None or score > current:
+                    question_max[question_id] = score
+        question_max = {question_id: score or 0 for question_id, score in question_max.items()}
+        
+        object.__setattr__(self, 'question_category', MappingProxyType(question_category))
+        object.__setattr__(self, 'question_max', MappingProxyType(question_max))
+        object.__setattr__(self, 'multiple_questions', frozenset(multiple))
+        object.__setattr__(self, 'inactive_questions', frozenset(inactive))
+        object.__setattr__(self, 'choice_scores', MappingProxyType(choice_scores))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('ScoringPlan is immutable')
+    
+    def covers_question(self, question_id):
+        return question_id in self.question_category or question_id in self.inactive_questions
+    
+    def extend(self, question_ids=(), choice_ids=()):
+        """
+        Transient plan that also knows about questions/choices outside this
+        survey (legacy answers). The cached plan itself is never modified.
+        """
+        from .models import Question, Choice
+        
+        questions = _plan_questions(Question.objects.filter(
+            Q(survey_id=self.survey_id) | Q(id__in=question_ids)
+        ))
+        choices = _plan_choices(Choice.objects.filter(
+            Q(question__survey_id=self.survey_id) | Q(question_id__in=question_ids) | Q(id__in=choice_ids)
+        ))
+        return ScoringPlan(self.survey_id, None, self.categories, questions, choices)
+
+
+def _plan_questions(queryset):
+    return list(queryset.values_list('id', 'category_id', 'allow_multiple', 'is_active'))
+
+
+def _plan_choices(queryset):
+    return list(queryset.values_list('id', 'question_id', 'score'))
+
+
+def build_scoring_plan(survey_id, version=None):
+    """Compile the scoring plan of a survey from the structural tables"""
+    from .models import Category, Question, Choice
+    
+    categories = [
+        PlanCategory(*row) for row in Category.objects.values_list(
+            'id', 'name', 'description', 'max_score',
+            'environmental_weight', 'social_weight', 'governance_weight',
+        )
+    ]
+    if survey_id is None:
+        questions = Question.objects.filter(survey__isnull=True)
+        choices = Choice.objects.filter(question__survey__isnull=True)
+    else:
+        questions = Question.objects.filter(survey_id=survey_id)
+        choices = Choice.objects.filter(question__survey_id=survey_id)
+    return ScoringPlan(survey_id, version, categories, _plan_questions(questions), _plan_choices(choices))
+
+
+_plan_cache = {}
+_plan_cache_lock = threading.Lock()
+
+
+def get_scoring_plan(survey_id):
+    """
+    Cached scoring plan for a survey.
+
+    The cache is per process and keyed by Survey.structure_version, which is
+    replaced whenever a Question, Choice or Category is saved or deleted, so
+    a lookup costs one single-row read. Attempts without a survey get an
+    uncached plan.
+    """
+    from .models import Survey
+    
+    if survey_id is None:
+        return build_scoring_plan(None)
+    
+    version = Survey.objects.filter(pk=survey_id).values_list('structure_version', flat=True).first()
+    plan = _plan_cache.get(survey_id)
+    if plan is not None and plan.version == version:
+        return plan
+    
+    plan = build_scoring_plan(survey_id, version)
+    if version is not None:
+        with _plan_cache_lock:
+            _plan_cache[survey_id] = plan
+    return plan
+
+
+def clear_scoring_plan_cache():
+    with _plan_cache_lock:
+        _plan_cache.clear()
+
+
+def score_attempt(attempt, plan=None):
+    """
+    Scoring engine for a single attempt.
+
+    Runs against the survey's cached ScoringPlan. When the attempt's stored
+    per-category totals (AttemptCategoryScore) are current for the plan
+    version, scoring is a single O(categories) read; otherwise the totals are
+    recomputed from the attempt's answers. Category percentages, E/S/G,
+    total and grade are computed in memory.
+
+    Only answers to active questions are counted. Every such answer adds its
+    question's maximum choice score to the possible points of its category,
+    including "cannot answer" answers.
+
+    Returns:
+        dict: {
+            'categories': [{'category', 'earned', 'possible', 'score'}, ...],
+            'environmental', 'social', 'governance', 'total', 'grade'
+        }
+    """
+    if plan is None:
+        plan = get_scoring_plan(attempt.survey_id)
+    
+    stored = stored_category_totals(attempt, plan)
+    if stored is not None:
+        earned, possible, _ = stored
+        return build_score_result(plan.categories, earned, possible)
+    
+    return score_attempt_from_answers(attempt, plan)
+
+
+def score_attempt_from_answers(attempt, plan=None):
+    """Score an attempt by reading its answers, ignoring stored totals"""
+    if plan is None:
+        plan = get_scoring_plan(attempt.survey_id)
+    plan, rows = load_attempt_answers(attempt, plan)
+    return score_answers(plan, rows)
+
+
+def load_attempt_answers(attempt, plan):
+    """
+    Read an attempt's answers as (question_id, multiple_choice_ids, choice_id)
+    rows, extending the plan if answers point outside the survey structure.
+
+    Returns:
+        tuple: (plan, rows)
+    """
+    from .models import Answer
+    
+    answers = list(
+        Answer.objects.filter(attempt=attempt).values_list('question_id', 'choice_ids', 'choice_id')
+    )
+    
+    missing_questions = {q for q, _, _ in answers if not plan.covers_question(q)}
+    missing_choices = {c for _, _, c in answers if c is not None and c not in plan.choice_scores}
+    missing_choices.update(
+        c for _, ids, _ in answers for c in ids if c not in plan.choice_scores
+    )
+    if missing_questions or missing_choices:
+        plan = plan.extend(question_ids=missing_questions, choice_ids=missing_choices)
+    
+    return plan, answers
+
+
+def answer_contribution(plan, question_id, multiple_choice_ids, choice_id):
+    """
+    What a single answer adds to its category.
+
+    Returns:
+        tuple: (category_id, earned points, possible points), or None when
+        the answer does not count (inactive question)
+    
+    Raises:
+        KeyError: the question or a selected choice is not part of the plan
+    """
+    index = plan.question_category.get(question_id)
+    if index is None:
+        if not plan.covers_question(question_id):
+            raise KeyError(question_id)
+        return None
+    if question_id in plan.multiple_questions:
+        points = sum(plan.choice_scores[c] for c in multiple_choice_ids)
+    else:
+        points = plan.choice_scores[choice_id] if choice_id is not None else 0
+    return plan.categories[index].id, points, plan.question_max[question_id]
+
+
+def category_totals(plan, answers):
+    """
+    Sum (question_id, multiple_choice_ids, choice_id) rows per category.
+
+    Returns:
+        tuple: ({category_id: earned}, {category_id: possible}, {category_id: answered count})
+    """
+    earned = {}
+    possible = {}
+    answered = {}
+    
+    for question_id, multiple_choice_ids, choice_id in answers:
+        contribution = answer_contribution(plan, question_id, multiple_choice_ids, choice_id)
+        if contribution is None:
+            continue
+        category_id, points, max_points = contribution
+        earned[category_id] = earned.get(category_id, 0) + points
+        possible[category_id] = possible.get(category_id, 0) + max_points
+        answered[category_id] = answered.get(category_id, 0) + 1
+    
+    return earned, possible, answered
+
+
+def score_answers(plan, answers):
+    """
+    Score (question_id, multiple_choice_ids, choice_id) rows against a plan
+    """
+    earned, possible, _ = category_totals(plan, answers)
+    return build_score_result(plan.categories, earned, possible)
+
+
+# ========== Stored per-category totals ==========
+
+def stored_category_totals(attempt, plan):
+    """
+    Stored per-category totals of an attempt, or None when they cannot be
+    trusted: no rows yet, rows written under another structure version, or
+    an attempt without a cached plan.
+    """
+    from .models import AttemptCategoryScore
+    
+    if plan.version is None:
+        return None
+    
+    rows = list(
+        AttemptCategoryScore.objects.filter(attempt=attempt).values_list(
+            'category_id', 'earned_points', 'possible_points', 'answered_count', 'structure_version'
+        )
+    )
+    if not rows or any(version != plan.version for *_, version in rows):
+        return None
+    
+    earned = {}
+    possible = {}
+    answered = {}
+    for category_id, category_earned, category_possible, category_answered, _ in rows:
+        earned[category_id] = category_earned
+        possible[category_id] = category_possible
+        answered[category_id] = category_answered
+    return earned, possible, answered
+
+
+def refresh_category_scores(attempt, plan=None):
+    """Rebuild an attempt's stored per-category totals from its answers"""
+    from .models import AttemptCategoryScore
+    
+    if plan is None:
+        plan = get_scoring_plan(attempt.survey_id)
+    plan, rows = load_attempt_answers(attempt, plan)
+    earned, possible, answered = category_totals(plan, rows)
+    
+    AttemptCategoryScore.objects.filter(attempt=attempt).delete()
+    AttemptCategoryScore.objects.bulk_create([
+        AttemptCategoryScore(
+            attempt=attempt,
+            category_id=category_id,
+            earned_points=earned[category_id],
+            possible_points=possible[category_id],
+            answered_count=answered[category_id],
+            structure_version=plan.version or '',
+        )
+        for category_id in answered
+    ])
+    return earned, possible, answered
+
+
+class CategoryScoreTracker:
+    """
+    Collects the per-category effect of answer writes and applies it to the
+    attempt's stored totals as deltas.
+
+    Usage (inside the same transaction as the answer writes):
+        tracker = CategoryScoreTracker(attempt)
+        tracker.remove_answer(answer)     # before changing an existing answer
+        ... write the answer ...
+        tracker.add_answer(answer)        # after writing it
+        tracker.flush()
+
+    Falls back to a full refresh of the attempt when the stored totals are
+    missing or from another structure version, or when an answer points
+    outside the survey's scoring plan.
+    """
+    
+    def __init__(self, attempt, plan=None):
+        self.attempt = attempt
+        self.plan = plan if plan is not None else get_scoring_plan(attempt.survey_id)
+        self.deltas = {}
+        self.needs_refresh = False
+    
+    def _rescore(self):
+        from .jobs import enqueue_rescore
+        enqueue_rescore([self.attempt.pk], 'Answers of a completed attempt changed')
+    
+    def _selected_ids(self, answer):
+        if answer.question_id in self.plan.multiple_questions:
+            return answer.choice_ids
+        return ()
+    
+    def _apply(self, question_id, multiple_choice_ids, choice_id, sign):
+        try:
+            contribution = answer_contribution(self.plan, question_id, multiple_choice_ids, choice_id)
+        except KeyError:
+            self.needs_refresh = True
+            return
+        if contribution is None:
+            return
+        category_id, points, max_points = contribution
+        delta = self.deltas.setdefault(category_id, [0, 0, 0])
+        delta[0] += sign * points
+        delta[1] += sign * max_points
+        delta[2] += sign
+    
+    def add(self, question_id, multiple_choice_ids=(), choice_id=None):
+        self._apply(question_id, multiple_choice_ids, choice_id, 1)
+    
+    def remove(self, question_id, multiple_choice_ids=(), choice_id=None):
+        self._apply(question_id, multiple_choice_ids, choice_id, -1)
+    
+    def add_answer(self, answer):
+        self.add(answer.question_id, self._selected_ids(answer), answer.choice_id)
+    
+    def remove_answer(self, answer):
+        self.remove(answer.question_id, self._selected_ids(answer), answer.choice_id)
+    
+    def flush(self):
+        from .models import AttemptCategoryScore
+        from django.db.models import F
+        
+        versions = set(
+            AttemptCategoryScore.objects.filter(attempt=self.attempt)
+            .values_list('structure_version', flat=True).distinct()
+        )
+        if self.needs_refresh or self.plan.version is None or versions != {self.plan.version}:
+            refresh_category_scores(self.attempt, self.plan)
+        else:
+            changed = {category_id: delta for category_id, delta in self.deltas.items() if any(delta)}
+            if changed:
+                AttemptCategoryScore.objects.bulk_create([
+                    AttemptCategoryScore(
+                        attempt=self.attempt,
+                        category_id=category_id,
+                        structure_version=self.plan.version,
+                    )
+                    for category_id in changed
+                ], ignore_conflicts=True)
+            for category_id, (earned, possible, answered) in changed.items():
+                AttemptCategoryScore.objects.filter(attempt=self.attempt, category_id=category_id).update(
+                    earned_points=F('earned_points') + earned,
+                    possible_points=F('possible_points') + possible,
+                    answered_count=F('answered_count') + answered,
+                )
+            emptied = [category_id for category_id, delta in changed.items() if delta[2] < 0]
+            if emptied:
+                # A full refresh keeps no rows for categories without answers
+                AttemptCategoryScore.objects.filter(
+                    attempt=self.attempt, category_id__in=emptied, answered_count=0,
+                ).delete()
+
+        if self.attempt.is_completed:
+            self._rescore()
+        
+        self.deltas = {}
+        self.needs_refresh = False
+
+
+def build_score_result(categories, earned, possible):
+    """
+    Combine per-category earned/possible points into the final score dict.
+
+    Categories are accumulated in their default ordering so the floating point
+    results match the historical per-category loop exactly.
+    """
+    env_score = 0
+    social_score = 0
+    gov_score = 0
+    breakdown = []
+
+    for category in categories:
+        category_earned = earned.get(category.id, 0)
+        category_possible = possible.get(category.id, 0)
+        category_score = category_percentage(category_earned, category_possible, category.max_score)
+
+        env_score += category_score * category.environmental_weight
+        social_score += category_score * category.social_weight
+        gov_score += category_score * category.governance_weight
+
+        breakdown.append({
+            'category': category,
+            'earned': category_earned,
+            'possible': category_possible,
+            'score': category_score,
+        })
+
+    environmental = round(env_score, 2)
+    social = round(social_score, 2)
+    governance = round(gov_score, 2)
+    total = round((environmental + social + governance) / 3, 2)
+
+    return {
+        'categories': breakdown,
+        'environmental': environmental,
+        'social': social,
+        'governance': governance,
+        'total': total,
+        'grade': grade_for_score(total),
+    }
+
+
+# ========== Score snapshots ==========
+
+def snapshot_from_result(result):
+    """JSON-serializable score snapshot of a score_attempt() result"""
+    return {
+        'environmental': result['environmental'],
+        'social': result['social'],
+        'governance': result['governance'],
+        'total': result['total'],
+        'grade': result['grade'],
+        'categories': [
+            {
+                'category_id': row['category'].id,
+                'name': row['category'].name,
+                'earned': row['earned'],
+                'possible': row['possible'],
+                'score': row['score'],
+                'max_score': row['category'].max_score,
+            }
+            for row in result['categories']
+        ],
+    }
+
+
+def has_fresh_snapshot(attempt):
+    return bool(attempt.score_snapshot) and not attempt.scores_stale
+
+
+def get_score_snapshot(attempt):
+    """
+    Scores of an attempt for read paths.
+
+    Serves the frozen snapshot when it is fresh. Otherwise the scores are
+    computed in memory; nothing is written, stale snapshots are refreshed
+    by rescoring.
+    """
+    if has_fresh_snapshot(attempt):
+        return attempt.score_snapshot
+    return snapshot_from_result(score_attempt(attempt))
+
+
+def mark_scores_stale(queryset):
+    """Flag the score snapshots of completed attempts as outdated"""
+    return queryset.filter(is_completed=True, scores_stale=False).update(scores_stale=True)
+
+
+def structure_changed(survey_ids=None):
+    """
+    Record a change to questions, choices or categories: invalidate the
+    cached scoring plans and the table versions of the conditional views.
+    Without survey_ids every survey is affected.
+    
+    Score snapshots are left alone; changes to scoring inputs flag exactly
+    the attempts they affect through jobs.enqueue_rescore().
+    """
+    from .models import Survey, Category, Question, Choice
+    
+    Survey.bump_structure_version(survey_ids)
+    bump_table_versions([Category, Question, Choice])
+
+
+def mark_attempt_completed(attempt):
+    """
+    Close an attempt for answering. Buffered autosaves are written first so
+    the answers are final; scoring and the report are left to
+    finalize_attempt().
+    """
+    from .answer_buffer import flush_buffer
+    from .summaries import invalidate_attempt_summaries
+    
+    # Buffered autosaves must reach the Answer table before scoring
+    flush_buffer(attempt)
+    attempt.is_completed = True
+    attempt.completed_at = timezone.now()
+    type(attempt).objects.filter(pk=attempt.pk).update(
+        is_completed=True, completed_at=attempt.completed_at,
+    )
+    invalidate_attempt_summaries([attempt.user_id])
+
+
+def finalize_attempt(attempt):
+    """
+    Expensive part of completing an attempt: freeze the score snapshot,
+    build the report sections and pre-render the PDF
+    """
+    from reports.services import build_report, store_report_pdf
+    
+    scores = attempt.calculate_scores()
+    report = build_report(attempt, scores)
+    store_report_pdf(report)
+    return scores
+
+
+def complete_attempt(attempt):
+    """
+    Mark an attempt completed, freeze its score snapshot and create its report
+    """
+    mark_attempt_completed(attempt)
+    return finalize_attempt(attempt)
+
+
+def request_completion(attempt):
+    """
+    Complete an attempt from a request. With settings.ASYNC_COMPLETION the
+    attempt is only marked and a finalize job is queued, so the response
+    time does not depend on the survey length.
+    
+    Returns:
+        tuple: (scores or None, queued finalize job or None)
+    """
+    from django.conf import settings
+    from .jobs import enqueue_finalize
+    
+    if not getattr(settings, 'ASYNC_COMPLETION', False):
+        return complete_attempt(attempt), None
+    
+    with transaction.atomic():
+        mark_attempt_completed(attempt)
+        job = enqueue_finalize(attempt)
+    return None, job
+
+
+def get_category_score(category, attempt):
+    """Score of a single category for an attempt"""
+    for row in score_attempt(attempt)['categories']:
+        if row['category'].id == category.id:
+            return row['score']
+    return 0
 
 
 def recalc_attempt_score(attempt):
@@ -36,16 +669,30 @@ def attempt_stats(attempt):
             'progress_percent': درصد پیشرفت
         }
     """
-    total_questions = attempt.answers.count()
-    
-    answered_questions = 0
-    cannot_answer_count = 0
-    
-    for answer in attempt.answers.all():
-        if answer.is_cannot_answer():
-            cannot_answer_count += 1
-        elif answer.choice or answer.choices.exists():
-            answered_questions += 1
+    if hasattr(attempt, 'stats_total_questions'):
+        return stats_from_annotations(attempt)
+    return attempt_stats_bulk(type(attempt).objects.filter(pk=attempt.pk)).get(attempt.pk, build_stats(0, 0))
+
+
+def annotate_attempt_stats(queryset):
+    """
+    Annotate an attempt queryset with its answer and "cannot answer" counts
+    using conditional aggregation, so a whole page of attempts costs one query.
+    An answer is "cannot answer" when it has neither a single nor any
+    multiple choice selected.
+    """
+    return queryset.annotate(
+        stats_total_questions=Count('answers', distinct=True),
+        stats_cannot_answer=Count(
+            'answers',
+            filter=Q(answers__choice__isnull=True, answers__choice_ids=[]),
+            distinct=True,
+        ),
+    )
+
+
+def build_stats(total_questions, cannot_answer_count):
+    answered_questions = total_questions - cannot_answer_count
     
     progress_percent = 0
     if total_questions > 0:
@@ -59,22 +706,38 @@ def attempt_stats(attempt):
     }
 
 
+def stats_from_annotations(attempt):
+    """Progress stats of an attempt fetched through annotate_attempt_stats()"""
+    return build_stats(attempt.stats_total_questions, attempt.stats_cannot_answer)
+
+
+def attempt_stats_bulk(queryset):
+    """
+    Progress stats for every attempt in a queryset in a single query
+    
+    Returns:
+        dict: {attempt_id: attempt_stats() dict}
+    """
+    rows = annotate_attempt_stats(queryset.order_by()).values_list(
+        'pk', 'stats_total_questions', 'stats_cannot_answer'
+    )
+    return {pk: build_stats(total, cannot) for pk, total, cannot in rows}
+
+
 def get_category_performance(attempt):
     """
     محاسبه عملکرد در هر دسته‌بندی
     """
-    from .models import Category
-    
-    categories = Category.objects.all()
     performance = []
     
-    for category in categories:
-        category_score = category.get_category_score(attempt)
+    for row in get_score_snapshot(attempt)['categories']:
+        category_score = row['score']
+        max_score = row['max_score']
         performance.append({
-            'category': category.name,
+            'category': row['name'],
             'score': category_score,
-            'max_score': category.max_score,
-            'percentage': round((category_score / category.max_score * 100) if category.max_score > 0 else 0, 1)
+            'max_score': max_score,
+            'percentage': round((category_score / max_score * 100) if max_score > 0 else 0, 1)
         })
     
     return performance
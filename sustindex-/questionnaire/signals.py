@@ -0,0 +1,131 @@
+"""
+Signal handlers keeping derived questionnaire data in sync with the
+survey structure
+"""
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from sustindex.conditional import bump_table_versions
+from .models import Survey, SurveySession, Category, Question, Choice, QuestionnaireAttempt
+from .services import structure_changed
+from .answers import discard_choice
+from .summaries import invalidate_attempt_summaries
+from .jobs import attempts_for_questions, attempts_for_categories, enqueue_rescore, enqueue_for_questions, enqueue_for_categories
+
+
+CATEGORY_SCORING_FIELDS = ('environmental_weight', 'social_weight', 'governance_weight', 'max_score')
+QUESTION_SCORING_FIELDS = ('is_active', 'allow_multiple', 'category_id', 'survey_id')
+
+
+def _previous_values(model, instance, fields):
+    if not instance.pk:
+        return None
+    return model.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+def _changed(instance, previous, fields):
+    return previous is None or any(getattr(instance, field) != previous[field] for field in fields)
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_values(sender, instance, **kwargs):
+    instance._previous_values = _previous_values(Category, instance, CATEGORY_SCORING_FIELDS)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    # Categories are shared by every survey
+    structure_changed()
+    if not created and _changed(instance, instance._previous_values, CATEGORY_SCORING_FIELDS):
+        enqueue_for_categories([instance.pk], f'Category {instance.pk} weights changed')
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_attempts(sender, instance, **kwargs):
+    # Answers are removed by the cascade before post_delete runs
+    instance._affected_attempts = attempts_for_categories([instance.pk])
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    structure_changed()
+    enqueue_rescore(getattr(instance, '_affected_attempts', ()), f'Category {instance.pk} deleted')
+
+
+@receiver(pre_save, sender=Question)
+def remember_question_values(sender, instance, **kwargs):
+    instance._previous_values = _previous_values(Question, instance, QUESTION_SCORING_FIELDS)
+    instance._previous_survey_id = instance._previous_values['survey_id'] if instance._previous_values else None
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, created, **kwargs):
+    structure_changed([instance.survey_id, getattr(instance, '_previous_survey_id', None)])
+    if not created and _changed(instance, instance._previous_values, QUESTION_SCORING_FIELDS):
+        enqueue_for_questions([instance.pk], f'Question {instance.pk} scoring flags changed')
+
+
+@receiver(pre_delete, sender=Question)
+def remember_question_attempts(sender, instance, **kwargs):
+    instance._affected_attempts = attempts_for_questions([instance.pk])
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    structure_changed([instance.survey_id])
+    enqueue_rescore(getattr(instance, '_affected_attempts', ()), f'Question {instance.pk} deleted')
+
+
+@receiver(pre_save, sender=Choice)
+def remember_choice_values(sender, instance, **kwargs):
+    instance._previous_values = _previous_values(Choice, instance, ('score', 'question_id'))
+
+
+def _choice_survey_ids(question_ids):
+    return list(Question.objects.filter(pk__in=question_ids).values_list('survey_id', flat=True))
+
+
+@receiver(post_save, sender=Choice)
+def choice_saved(sender, instance, created, **kwargs):
+    previous = instance._previous_values
+    question_ids = {instance.question_id}
+    if previous:
+        question_ids.add(previous['question_id'])
+    structure_changed(_choice_survey_ids(question_ids))
+    # A new choice can raise the question's maximum and so every answer's possible points
+    if _changed(instance, previous, ('score', 'question_id')):
+        enqueue_for_questions(question_ids, f'Choice {instance.pk} score changed')
+
+
+@receiver(pre_delete, sender=Choice)
+def remember_choice_attempts(sender, instance, **kwargs):
+    instance._affected_attempts = attempts_for_questions([instance.question_id])
+
+
+@receiver(post_delete, sender=Choice)
+def choice_deleted(sender, instance, **kwargs):
+    discard_choice(instance.question_id, instance.pk)
+    structure_changed(_choice_survey_ids([instance.question_id]))
+    enqueue_rescore(getattr(instance, '_affected_attempts', ()), f'Choice {instance.pk} deleted')
+
+
+@receiver(post_save, sender=QuestionnaireAttempt)
+@receiver(post_delete, sender=QuestionnaireAttempt)
+def attempt_changed(sender, instance, **kwargs):
+    # Creation, calculate_scores() and deletion; .update() callers invalidate explicitly
+    invalidate_attempt_summaries([instance.user_id])
+
+
+@receiver(post_save, sender=Survey)
+@receiver(post_delete, sender=Survey)
+@receiver(post_save, sender=SurveySession)
+@receiver(post_delete, sender=SurveySession)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def table_changed(sender, **kwargs):
+    # Validators of the conditional API views; .update() callers bump explicitly
+    bump_table_versions([sender])
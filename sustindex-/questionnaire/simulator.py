@@ -0,0 +1,253 @@
+"""
+Weight "what-if" simulator.
+
+Evaluates candidate category weights (and optionally grade thresholds)
+against every completed attempt of a survey without touching the stored
+scores. Each attempt's per-category percentages are loaded once into an
+(attempts x categories) matrix and cached in process; a candidate is then
+scored for all attempts with a handful of vectorized operations.
+"""
+import threading
+
+from django.db.models import Count, Max, Q
+
+from .models import QuestionnaireAttempt, AttemptCategoryScore
+from .services import get_scoring_plan, GRADE_THRESHOLDS
+from .bulk_scoring import (
+    NUMPY_AVAILABLE, np, load_answers, _complete_plan, category_points_matrix, category_percentages,
+)
+
+
+COMPONENTS = ('environmental', 'social', 'governance')
+
+
+class SimulationError(ValueError):
+    """Invalid candidate weights or thresholds"""
+
+
+class AttemptMatrix:
+    """Per-category percentages of the completed attempts of one survey"""
+    __slots__ = ('key', 'plan', 'attempt_ids', 'labels', 'percentages')
+    
+    def __init__(self, key, plan, attempt_ids, labels, percentages):
+        self.key = key
+        self.plan = plan
+        self.attempt_ids = attempt_ids
+        self.labels = labels
+        self.percentages = percentages
+
+
+_matrix_cache = {}
+_matrix_cache_lock = threading.Lock()
+
+
+def _freshness_key(survey_id, plan):
+    stats = QuestionnaireAttempt.objects.filter(survey_id=survey_id, is_completed=True).aggregate(
+        count=Count('pk'),
+        last_completed=Max('completed_at'),
+        last_scored=Max('scored_at'),
+        stale=Count('pk', filter=Q(scores_stale=True)),
+    )
+    return (plan.version, stats['count'], stats['last_completed'], stats['last_scored'], stats['stale'])
+
+
+def load_attempt_matrix(survey_id, batch_size=2000):
+    """
+    Cached percentage matrix of a survey's completed attempts.
+
+    Uses the stored AttemptCategoryScore rows where they are current and
+    recomputes from the answers only for attempts whose rows are missing or
+    were written under another structure version.
+    """
+    plan = get_scoring_plan(survey_id)
+    key = _freshness_key(survey_id, plan)
+    cached = _matrix_cache.get(survey_id)
+    if cached is not None and cached.key == key:
+        return cached
+    
+    attempts = list(
+        QuestionnaireAttempt.objects.filter(survey_id=survey_id, is_completed=True)
+        .order_by('pk')
+        .values_list('pk', 'user__username', 'user__company_name')
+    )
+    attempt_ids = [pk for pk, _, _ in attempts]
+    row_of = {pk: row for row, pk in enumerate(attempt_ids)}
+    column_of = plan.category_index
+    
+    earned = np.zeros((len(attempt_ids), len(plan.categories)))
+    possible = np.zeros((len(attempt_ids), len(plan.categories)))
+    current = set()
+    outdated = set()
+    for attempt_id, category_id, category_earned, category_possible, version in AttemptCategoryScore.objects.filter(
+        attempt__survey_id=survey_id, attempt__is_completed=True
+    ).values_list('attempt_id', 'category_id', 'earned_points', 'possible_points', 'structure_version'):
+        if version != plan.version:
+            outdated.add(attempt_id)
+            continue
+        current.add(attempt_id)
+        earned[row_of[attempt_id], column_of[category_id]] = category_earned
+        possible[row_of[attempt_id], column_of[category_id]] = category_possible
+    
+    recompute = [pk for pk in attempt_ids if pk in outdated or pk not in current]
+    for start in range(0, len(recompute), batch_size):
+        batch = recompute[start:start + batch_size]
+        answers, selections = load_answers(batch)
+        batch_plan = _complete_plan(plan, answers, selections)
+        batch_earned, batch_possible = category_points_matrix(batch_plan, batch, answers, selections)
+        rows = [row_of[pk] for pk in batch]
+        earned[rows] = batch_earned
+        possible[rows] = batch_possible
+    
+    matrix = AttemptMatrix(
+        key, plan, attempt_ids,
+        [(username, company_name) for _, username, company_name in attempts],
+        category_percentages(plan, earned, possible),
+    )
+    with _matrix_cache_lock:
+        _matrix_cache[survey_id] = matrix
+    return matrix
+
+
+def parse_weights(plan, weights):
+    """
+    Build a (categories x 3) weight matrix. weights maps category id to
+    {'environmental': .., 'social': .., 'governance': ..}; missing
+    categories or components keep their current weight.
+    """
+    matrix = np.array(plan.weights, dtype=float).reshape(len(plan.categories), 3)
+    if weights is None:
+        return matrix
+    if not isinstance(weights, dict):
+        raise SimulationError('Weights must map category ids to component weights')
+    for category_id, components in weights.items():
+        try:
+            row = plan.category_index[int(category_id)]
+        except (KeyError, ValueError, TypeError):
+            raise SimulationError(f'Unknown category: {category_id}')
+        if not isinstance(components, dict):
+            raise SimulationError(f'Invalid weights for category {category_id}')
+        for column, component in enumerate(COMPONENTS):
+            if component in components:
+                try:
+                    matrix[row, column] = float(components[component])
+                except (ValueError, TypeError):
+                    raise SimulationError(f'Invalid {component} weight for category {category_id}')
+    return matrix
+
+
+def parse_thresholds(thresholds):
+    """[[minimum, grade], ...] -> tuple sorted from the highest minimum"""
+    if not thresholds:
+        return GRADE_THRESHOLDS
+    try:
+        parsed = [(float(minimum), str(grade)) for minimum, grade in thresholds]
+    except (ValueError, TypeError):
+        raise SimulationError('Thresholds must be a list of [minimum score, grade] pairs')
+    return tuple(sorted(parsed, key=lambda item: item[0], reverse=True))
+
+
+def evaluate(matrix, weights, thresholds):
+    """
+    Score every attempt of the matrix with one weight matrix.
+
+    Returns:
+        tuple: ((attempts x 3) E/S/G array, totals array, grades array)
+    """
+    percentages = matrix.percentages
+    components = np.zeros((percentages.shape[0], 3))
+    for index in range(weights.shape[0]):
+        components = components + percentages[:, index:index + 1] * weights[index]
+    components = np.round(components, 2)
+    totals = np.round(components.sum(axis=1) / 3, 2)
+    
+    grades = np.full(totals.shape, 'D', dtype=object)
+    for minimum, grade in reversed(thresholds):
+        grades[totals >= minimum] = grade
+    return components, totals, grades
+
+
+def _summary(components, totals, grades, thresholds):
+    count = len(totals)
+    distribution = {grade: 0 for _, grade in thresholds}
+    distribution['D'] = 0
+    if count:
+        values, counts = np.unique(grades.astype(str), return_counts=True)
+        distribution.update({str(value): int(n) for value, n in zip(values, counts)})
+    mean = {
+        component: round(float(components[:, column].mean()), 2) if count else 0.0
+        for column, component in enumerate(COMPONENTS)
+    }
+    mean['total'] = round(float(totals.mean()), 2) if count else 0.0
+    return {'mean': mean, 'grades': distribution}
+
+
+def simulate(survey_id, candidates, top=10):
+    """
+    Evaluate candidate weight vectors against a survey's completed attempts.
+
+    candidates: [{'name': .., 'weights': {category_id: {...}}, 'thresholds': [[min, grade], ...]}, ...]
+
+    Returns:
+        dict: {'attempts', 'current': summary, 'candidates': [{
+            'name', 'summary', 'mean_delta', 'grade_changes', 'most_affected'
+        }, ...]}
+    """
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError('NumPy is required for the weight simulator')
+    
+    matrix = load_attempt_matrix(survey_id)
+    plan = matrix.plan
+    current_weights = parse_weights(plan, None)
+    current = evaluate(matrix, current_weights, GRADE_THRESHOLDS)
+    current_summary = _summary(*current, GRADE_THRESHOLDS)
+    
+    results = []
+    for number, candidate in enumerate(candidates, 1):
+        thresholds = parse_thresholds(candidate.get('thresholds'))
+        components, totals, grades = evaluate(
+            matrix, parse_weights(plan, candidate.get('weights')), thresholds
+        )
+        summary = _summary(components, totals, grades, thresholds)
+        delta = totals - current[1]
+        changed = grades != current[2]
+        
+        transitions = {}
+        for before, after in zip(current[2][changed], grades[changed]):
+            transitions.setdefault(before, {}).setdefault(after, 0)
+            transitions[before][after] += 1
+        
+        affected = []
+        if len(delta):
+            for row in np.argsort(-np.abs(delta), kind='stable')[:top]:
+                username, company_name = matrix.labels[row]
+                affected.append({
+                    'attempt_id': matrix.attempt_ids[row],
+                    'username': username,
+                    'company_name': company_name,
+                    'current_total': float(current[1][row]),
+                    'current_grade': current[2][row],
+                    'candidate_total': float(totals[row]),
+                    'candidate_grade': grades[row],
+                    'delta': round(float(delta[row]), 2),
+                })
+        
+        results.append({
+            'name': candidate.get('name') or f'Candidate {number}',
+            'summary': summary,
+            'mean_delta': {
+                key: round(summary['mean'][key] - current_summary['mean'][key], 2)
+                for key in summary['mean']
+            },
+            'grade_changes': {
+                'changed': int(changed.sum()),
+                'transitions': transitions,
+            },
+            'most_affected': affected,
+        })
+    
+    return {
+        'attempts': len(matrix.attempt_ids),
+        'categories': [{'id': c.id, 'name': c.name} for c in plan.categories],
+        'current': current_summary,
+        'candidates': results,
+    }
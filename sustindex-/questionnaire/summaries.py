@@ -0,0 +1,145 @@
+"""
+Flat per-user attempt summaries for the dashboard and history pages.
+
+Summaries are read with .values() (no model instances, answers or
+documents) and each response is cached per user. The cache entries of a
+user hang off a version key; deleting it through
+invalidate_attempt_summaries() retires all of them at once. That happens
+when an attempt is created, completed, rescored or deleted.
+
+Deleting the version key only reaches the cache of the process doing it,
+which is not the serving process when the cache is per process (locmem)
+and the change is made by the score worker. Every key therefore also
+carries a fingerprint of the user's attempts read from the database (one
+aggregate over an indexed column), so any creation, deletion, completion
+or rescoring seen by the database gives a new key in every process.
+"""
+import hashlib
+import logging
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Q
+from django.utils.http import urlencode
+
+from .models import QuestionnaireAttempt
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_TIMEOUT = 60 * 60
+STATUS_FILTERS = {
+    'completed': Q(is_completed=True),
+    'in_progress': Q(is_completed=False),
+}
+SUMMARY_FIELDS = (
+    'id', 'survey_id', 'survey__name', 'session__name', 'started_at', 'completed_at', 'is_completed',
+    'total_score', 'environmental_score', 'social_score', 'governance_score', 'overall_grade',
+)
+
+
+def attempt_summaries(user, status=None, fields=SUMMARY_FIELDS):
+    """
+    Flat rows of a user's attempts, optionally only completed/in_progress
+    ones, with the given SUMMARY_FIELDS
+    """
+    queryset = QuestionnaireAttempt.objects.filter(user=user)
+    if status:
+        queryset = queryset.filter(STATUS_FILTERS[status])
+    return queryset.values(*fields)
+
+
+def summary_aggregates(user):
+    """
+    Counts and scores over all attempts of a user
+    
+    Returns:
+        dict: total/completed/in-progress counts, average and best score,
+        best grade and the latest completed attempt (a summary row or None)
+    """
+    attempts = QuestionnaireAttempt.objects.filter(user=user)
+    completed = attempts.filter(is_completed=True)
+    stats = attempts.aggregate(
+        total_count=Count('id'),
+        completed_count=Count('id', filter=Q(is_completed=True)),
+        average_score=Avg('total_score', filter=Q(is_completed=True)),
+        best_score=Max('total_score', filter=Q(is_completed=True)),
+    )
+    best_grade = completed.order_by('-total_score', '-completed_at').values_list('overall_grade', flat=True).first()
+    latest = completed.order_by('-completed_at', '-id').values(*SUMMARY_FIELDS).first()
+    
+    return {
+        'total_count': stats['total_count'],
+        'completed_count': stats['completed_count'],
+        'in_progress_count': stats['total_count'] - stats['completed_count'],
+        'average_score': round(stats['average_score'], 1) if stats['average_score'] is not None else None,
+        'best_score': stats['best_score'],
+        'best_grade': best_grade or None,
+        'latest': latest,
+    }
+
+
+def _version_key(user_id):
+    return f'attempt-summary:{user_id}:version'
+
+
+def attempts_fingerprint(user_id):
+    """State of a user's attempts as stored, changing whenever a summary would"""
+    stats = QuestionnaireAttempt.objects.filter(user_id=user_id).aggregate(
+        count=Count('id'),
+        last_id=Max('id'),
+        completed_count=Count('id', filter=Q(is_completed=True)),
+        last_completed=Max('completed_at'),
+        last_scored=Max('scored_at'),
+    )
+    return ':'.join(str(value) for value in stats.values())
+
+
+def summary_cache_key(user_id, params):
+    """Cache key of one summary response; params are the query parameters that shape it"""
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), uuid.uuid4().hex, None)
+        version = cache.get(_version_key(user_id))
+    state = [*sorted(params.items()), ('attempts', attempts_fingerprint(user_id))]
+    digest = hashlib.md5(urlencode(state).encode()).hexdigest()
+    return f'attempt-summary:{user_id}:{version}:{digest}'
+
+
+def get_cached_summary(user_id, params):
+    """
+    Returns:
+        tuple: (cache key, cached response data or None); the key is None
+        when the cache is unavailable
+    """
+    try:
+        key = summary_cache_key(user_id, params)
+        return key, cache.get(key)
+    except Exception:
+        logger.exception('Attempt summary cache unavailable')
+        return None, None
+
+
+def cache_summary(key, data):
+    if key is None:
+        return
+    try:
+        cache.set(key, data, CACHE_TIMEOUT)
+    except Exception:
+        logger.exception('Attempt summary cache unavailable')
+
+
+def invalidate_attempt_summaries(user_ids):
+    """Drop the cached summaries of these users once the current transaction commits"""
+    keys = [_version_key(user_id) for user_id in set(user_ids) if user_id is not None]
+    if not keys:
+        return
+    
+    def delete():
+        try:
+            cache.delete_many(keys)
+        except Exception:
+            logger.exception('Could not invalidate attempt summaries')
+    
+    transaction.on_commit(delete)
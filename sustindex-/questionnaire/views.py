@@ -4,8 +4,15 @@ from django.utils import timezone
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.core.files.storage import default_storage
+from django.db import transaction
 import json
-from .models import Survey, SurveySession, Category, Question, QuestionnaireAttempt, Answer, UserDocument
+from .models import Survey, SurveySession, Category, Question, Choice, QuestionnaireAttempt, Answer, UserDocument
+from .services import CategoryScoreTracker, request_completion, get_score_snapshot
+from .answers import write_answers, bump_revision, RevisionConflict
+from .jobs import finalize_status
+from .answer_buffer import (
+    buffering_enabled, buffer_delta, flush_quietly, merged_answer_state, get_buffer, BufferUnavailable,
+)
 
 @login_required
 def start_questionnaire(request):
@@ -55,81 +62,128 @@ def questionnaire_page(request, attempt_id):
         # Check if this is an AJAX request (Save Progress)
         is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
         
+        # One lookup of the posted questions and their choices
+        posted = [
+            (int(key.split('_')[1]), key, value)
+            for key, value in request.POST.items() if key.startswith('question_')
+        ]
+        uploads = [
+            (int(key.split('_')[1]), files)
+            for key, files in request.FILES.lists() if key.startswith('files_')
+        ]
+        allow_multiple = dict(
+            Question.objects.filter(
+                id__in={q_id for q_id, _, _ in posted} | {q_id for q_id, _ in uploads}
+            ).values_list('id', 'allow_multiple')
+        )
+        choice_question = {}
+        first_choice = {}
+        for choice_id, question_id in Choice.objects.filter(
+            question_id__in=allow_multiple
+        ).order_by('order', 'id').values_list('id', 'question_id'):
+            choice_question[choice_id] = question_id
+            first_choice.setdefault(question_id, choice_id)
+        
+        def question_choice(q_id, value):
+            choice_id = int(value)
+            if choice_question.get(choice_id) != q_id:
+                raise Choice.DoesNotExist(f'Choice {choice_id} does not belong to question {q_id}')
+            return choice_id
+        
+        for q_id in [q_id for q_id, _, _ in posted] + [q_id for q_id, _ in uploads]:
+            if q_id not in allow_multiple:
+                raise Question.DoesNotExist(f'Question {q_id} does not exist')
+        
         # Process form data
-        for key, value in request.POST.items():
-            if key.startswith('question_'):
-                q_id = int(key.split('_')[1])
-                question = Question.objects.get(id=q_id)
-                
-                # Get or create answer
-                answer, created = Answer.objects.get_or_create(
-                    attempt=attempt,
-                    question=question
-                )
-                
-                if value == 'cannot_answer':
-                    answer.choice = None
-                    answer.choices.clear()
-                    answer.save()
-                    continue
-                
-                if question.allow_multiple:
-                    choice_ids = request.POST.getlist(key)
-                    choice_ids = [cid for cid in choice_ids if cid != 'cannot_answer']
-                    
-                    answer.choices.clear()
-                    for choice_id in choice_ids:
-                        choice = question.choices.get(id=int(choice_id))
-                        answer.choices.add(choice)
-                    answer.choice = None
-                else:
-                    choice = question.choices.get(id=int(value))
-                    answer.choice = choice
-                    answer.choices.clear()
-                
-                answer.save()
+        rows = []
+        for q_id, key, value in posted:
+            if value == 'cannot_answer':
+                rows.append((q_id, None, [], None))
+            elif allow_multiple[q_id]:
+                choice_ids = [
+                    question_choice(q_id, cid)
+                    for cid in request.POST.getlist(key) if cid != 'cannot_answer'
+                ]
+                rows.append((q_id, None, list(dict.fromkeys(choice_ids)), None))
+            else:
+                rows.append((q_id, question_choice(q_id, value), [], None))
         
-        # Process uploaded files (if any)
-        for key, files in request.FILES.lists():
-            if key.startswith('files_'):
-                question_id = int(key.split('_')[1])
-                question = Question.objects.get(id=question_id)
+        # Autosave clients send the revision their form is based on
+        base_revision = request.POST.get('base_revision')
+        base_revision = int(base_revision) if base_revision else None
+        
+        # Save Progress without files can stay in the answer buffer
+        if is_ajax and not uploads and buffering_enabled():
+            try:
+                revision = buffer_delta(attempt, base_revision, rows)
+            except RevisionConflict as e:
+                return JsonResponse({
+                    'success': False,
+                    'message': str(e),
+                    'revision': e.revision,
+                    'answers': merged_answer_state(attempt),
+                }, status=409)
+            except BufferUnavailable:
+                pass
+            else:
+                return JsonResponse({
+                    'success': True,
+                    'message': 'Progress saved successfully',
+                    'answered_count': len(merged_answer_state(attempt)),
+                    'revision': revision,
+                })
+        
+        flush_quietly(attempt)
+        try:
+            with transaction.atomic():
+                bump_revision(attempt, base_revision)
+                tracker = CategoryScoreTracker(attempt)
+                answers = write_answers(attempt, rows, tracker)
                 
-                # Get or create answer for this question
-                try:
-                    answer = Answer.objects.get(attempt=attempt, question=question)
-                except Answer.DoesNotExist:
-                    # Create placeholder answer with first choice if no answer exists
-                    first_choice = question.choices.first()
-                    answer = Answer.objects.create(
-                        attempt=attempt,
-                        question=question,
-                        choice=first_choice
+                # Process uploaded files (if any)
+                missing = [q_id for q_id, _ in uploads if q_id not in answers]
+                if missing:
+                    answers.update(
+                        (answer.question_id, answer)
+                        for answer in Answer.objects.filter(attempt=attempt, question_id__in=missing)
                     )
+                    # Create placeholder answer with first choice if no answer exists
+                    answers.update(write_answers(attempt, [
+                        (q_id, first_choice.get(q_id), [], None)
+                        for q_id in dict.fromkeys(missing) if q_id not in answers
+                    ], tracker))
+                
+                for q_id, files in uploads:
+                    # Save uploaded files
+                    for file in files:
+                        if file.size <= 10 * 1024 * 1024:  # 10MB limit
+                            UserDocument.objects.create(
+                                answer=answers[q_id],
+                                title=file.name,
+                                file=file,
+                                file_size=file.size
+                            )
                 
-                # Save uploaded files
-                for file in files:
-                    if file.size <= 10 * 1024 * 1024:  # 10MB limit
-                        UserDocument.objects.create(
-                            answer=answer,
-                            title=file.name,
-                            file=file,
-                            file_size=file.size
-                        )
+                tracker.flush()
+        except RevisionConflict as e:
+            return JsonResponse({
+                'success': False,
+                'message': str(e),
+                'revision': e.revision,
+                'answers': merged_answer_state(attempt),
+            }, status=409)
         
         # If AJAX request (Save Progress), return JSON response
         if is_ajax:
             return JsonResponse({
                 'success': True,
                 'message': 'Progress saved successfully',
-                'answered_count': attempt.answers.count()
+                'answered_count': attempt.answers.count(),
+                'revision': attempt.revision,
             })
         
         # Otherwise, complete the assessment
-        attempt.is_completed = True
-        attempt.completed_at = timezone.now()
-        attempt.calculate_score()
-        attempt.save()
+        request_completion(attempt)
         
         return redirect('questionnaire_result', attempt_id=attempt.id)
     
@@ -140,7 +194,7 @@ def questionnaire_page(request, attempt_id):
     
     for answer in attempt.answers.all():
         if answer.question.allow_multiple:
-            existing_answers_multiple[answer.question.id] = list(answer.choices.values_list('id', flat=True))
+            existing_answers_multiple[answer.question.id] = list(answer.choice_ids)
         else:
             if answer.choice:
                 existing_answers[answer.question.id] = answer.choice.id
@@ -149,6 +203,22 @@ def questionnaire_page(request, attempt_id):
         if documents:
             existing_documents[answer.question.id] = documents
     
+    # Autosaves still waiting in the answer buffer win over the database
+    buffer = get_buffer(attempt.id)
+    if buffer:
+        for q_id in buffer['cleared']:
+            existing_answers.pop(q_id, None)
+            existing_answers_multiple.pop(q_id, None)
+        pending = {int(q_id): values for q_id, values in buffer['answers'].items()}
+        for q_id, allow_multiple in Question.objects.filter(id__in=pending).values_list('id', 'allow_multiple'):
+            choice_id, choice_ids, _ = pending[q_id]
+            existing_answers.pop(q_id, None)
+            existing_answers_multiple.pop(q_id, None)
+            if allow_multiple:
+                existing_answers_multiple[q_id] = list(choice_ids)
+            elif choice_id:
+                existing_answers[q_id] = choice_id
+    
     return render(request, 'questionnaire/questionnaire.html', {
         'attempt': attempt,
         'categories': categories,
@@ -161,17 +231,25 @@ def questionnaire_page(request, attempt_id):
 def questionnaire_result(request, attempt_id):
     attempt = get_object_or_404(QuestionnaireAttempt, id=attempt_id, user=request.user)
     
-    scores = attempt.calculate_scores()
+    scores = get_score_snapshot(attempt)
+    
+    state, _ = finalize_status(attempt)
+    if state != 'finalized':
+        # The finalize job has not stored the scores yet; show the live ones
+        attempt.environmental_score = scores['environmental']
+        attempt.social_score = scores['social']
+        attempt.governance_score = scores['governance']
+        attempt.total_score = scores['total']
+        attempt.overall_grade = scores['grade']
     
     from reports.models import Report
-    report, created = Report.objects.get_or_create(
-        attempt=attempt,
-        defaults={'generated_at': timezone.now()}
-    )
+    from reports.services import get_or_build_report
+    if state == 'finalized':
+        report = get_or_build_report(attempt, scores)
+    else:
+        report = Report.objects.filter(attempt=attempt).first()
     
-    documents_count = 0
-    for answer in attempt.answers.all():
-        documents_count += answer.documents.count()
+    documents_count = UserDocument.objects.filter(answer__attempt=attempt).count()
     
     attempt.documents_count = documents_count
     
@@ -181,6 +259,7 @@ def questionnaire_result(request, attempt_id):
         'report': report,
         'recommendations': attempt.get_recommendations(),
         'documents_count': documents_count,
+        'finalizing': state == 'finalizing',
     }
     
     return render(request, 'questionnaire/result.html', context)
@@ -223,16 +302,21 @@ def upload_document(request):
             question = get_object_or_404(Question, id=question_id)
             
             # Find existing answer or create placeholder
+            flush_quietly(attempt)
             try:
                 answer = Answer.objects.get(attempt=attempt, question=question)
             except Answer.DoesNotExist:
                 # Create placeholder answer with first choice
                 first_choice = question.choices.first()
-                answer = Answer.objects.create(
-                    attempt=attempt,
-                    question=question,
-                    choice=first_choice
-                )
+                with transaction.atomic():
+                    answer = Answer.objects.create(
+                        attempt=attempt,
+                        question=question,
+                        choice=first_choice
+                    )
+                    tracker = CategoryScoreTracker(attempt)
+                    tracker.add_answer(answer)
+                    tracker.flush()
             
             # Create document
             document = UserDocument.objects.create(
@@ -0,0 +1,260 @@
+"""
+Report building shared by the report views and the finalize job
+"""
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from .models import Report, ReportSection
+
+logger = logging.getLogger(__name__)
+
+
+def build_report(attempt, esg_scores):
+    """Create or refresh the report of a completed attempt and its sections"""
+    report, created = Report.objects.get_or_create(
+        attempt=attempt,
+        defaults={'generated_at': timezone.now()}
+    )
+    
+    report.sections.all().delete()
+    
+    create_report_sections(report, attempt, esg_scores)
+    
+    return report
+
+
+def get_or_build_report(attempt, esg_scores):
+    """
+    Report of a finalized attempt, built on first access when it has none.
+    
+    Attempts completed before the finalize job existed, or marked completed
+    in the admin, never went through that job and have no report yet.
+    """
+    report = Report.objects.filter(attempt=attempt).first()
+    if report is None and attempt.is_completed:
+        report = build_report(attempt, esg_scores)
+    return report
+
+
+def create_report_sections(report, attempt, esg_scores):
+    """Create report sections"""
+    
+    executive_summary = f"""
+    This sustainability assessment evaluates your organization's Environmental, Social, and Governance (ESG) performance.
+    
+    Overall ESG Score: {esg_scores['total']:.1f}/100 (Grade: {esg_scores['grade']})
+    
+    • Environmental Score: {esg_scores['environmental']:.1f}/100
+    • Social Score: {esg_scores['social']:.1f}/100  
+    • Governance Score: {esg_scores['governance']:.1f}/100
+    
+    This assessment is based on internationally recognized ESG frameworks and best practices.
+    
+    Supporting Documents: {get_total_documents_count(attempt)} files uploaded as evidence.
+    """
+    
+    sections = [ReportSection(
+        report=report,
+        title="Executive Summary",
+        content=executive_summary,
+        order=1
+    )]
+    
+    from questionnaire.services import score_attempt
+    breakdown = score_attempt(attempt)['categories']
+    documents_by_category = get_documents_count_by_category(attempt)
+    
+    for i, row in enumerate(breakdown, 2):
+        category = row['category']
+        category_score = row['score']
+        documents_count = documents_by_category.get(category.id, 0)
+        
+        content = f"""
+        Category: {category.name}
+        Score: {category_score:.1f}/100
+        Supporting Documents: {documents_count} files
+        
+        {category.description}
+        
+        Performance Analysis:
+        """
+        
+        if category_score >= 70:
+            content += "Excellent performance in this category. Continue current practices and look for opportunities to share best practices."
+        elif category_score >= 50:
+            content += "Good performance with room for improvement. Focus on addressing gaps identified in the assessment."
+        else:
+            content += "Significant improvement needed. This should be a priority area for your sustainability initiatives."
+        
+        # Add document details if available
+        if documents_count > 0:
+            content += f"\n\nEvidence provided: {documents_count} supporting documents were submitted for questions in this category, demonstrating commitment to transparency and documentation."
+        
+        sections.append(ReportSection(
+            report=report,
+            title=f"{category.name} Analysis",
+            content=content,
+            order=i
+        ))
+    
+    ReportSection.objects.bulk_create(sections)
+
+
+def get_total_documents_count(attempt):
+    """Get total number of uploaded documents for an attempt"""
+    from questionnaire.models import UserDocument
+    return UserDocument.objects.filter(answer__attempt=attempt).count()
+
+
+def get_category_documents_count(attempt, category):
+    """Get number of uploaded documents for a specific category"""
+    from questionnaire.models import UserDocument
+    return UserDocument.objects.filter(
+        answer__attempt=attempt,
+        answer__question__category=category
+    ).count()
+
+
+def get_documents_count_by_category(attempt):
+    """Uploaded documents of an attempt per category id, in one query"""
+    from django.db.models import Count
+    from questionnaire.models import UserDocument
+    return dict(
+        UserDocument.objects.filter(answer__attempt=attempt)
+        .values_list('answer__question__category')
+        .annotate(count=Count('id'))
+        .values_list('answer__question__category', 'count')
+    )
+
+
+def get_component_grade(score):
+    """Determine grade for each component"""
+    if score >= 80:
+        return 'A+'
+    elif score >= 70:
+        return 'A'
+    elif score >= 60:
+        return 'B+'
+    elif score >= 50:
+        return 'B'
+    elif score >= 40:
+        return 'C+'
+    elif score >= 30:
+        return 'C'
+    else:
+        return 'D'
+
+
+def render_report_pdf(report):
+    """
+    Render a report as PDF.
+    
+    Returns:
+        bytes: the PDF document
+    
+    Raises:
+        ImportError: when reportlab is not installed
+    """
+    from reportlab.lib.pagesizes import letter, A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+    
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = []
+    
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=colors.HexColor('#1b4332')
+    )
+    story.append(Paragraph("Sustainability Assessment Report", title_style))
+    story.append(Spacer(1, 20))
+    
+    company_info = [
+        ['Company:', report.attempt.user.company_name or 'N/A'],
+        ['Assessment Date:', report.attempt.completed_at.strftime('%Y-%m-%d') if report.attempt.completed_at else 'N/A'],
+        ['ESG Grade:', report.attempt.overall_grade],
+        ['Total Score:', f"{report.attempt.total_score:.1f}/100"]
+    ]
+    
+    company_table = Table(company_info, colWidths=[2*inch, 3*inch])
+    company_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f0f0')),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(company_table)
+    story.append(Spacer(1, 30))
+    
+    esg_data = [
+        ['ESG Component', 'Score', 'Grade'],
+        ['Environmental', f"{report.attempt.environmental_score:.1f}", get_component_grade(report.attempt.environmental_score)],
+        ['Social', f"{report.attempt.social_score:.1f}", get_component_grade(report.attempt.social_score)],
+        ['Governance', f"{report.attempt.governance_score:.1f}", get_component_grade(report.attempt.governance_score)],
+        ['Overall ESG', f"{report.attempt.total_score:.1f}", report.attempt.overall_grade]
+    ]
+    
+    esg_table = Table(esg_data, colWidths=[2*inch, 1.5*inch, 1.5*inch])
+    esg_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1b4332')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#e8f5e8'))
+    ]))
+    story.append(Paragraph("ESG Scores Breakdown", styles['Heading2']))
+    story.append(Spacer(1, 12))
+    story.append(esg_table)
+    story.append(Spacer(1, 30))
+    
+    recommendations = report.attempt.get_recommendations()
+    if recommendations:
+        story.append(Paragraph("Recommendations for Improvement", styles['Heading2']))
+        story.append(Spacer(1, 12))
+        
+        for i, rec in enumerate(recommendations, 1):
+            story.append(Paragraph(f"{i}. {rec['category']} ({rec['priority']} Priority)", styles['Heading3']))
+            story.append(Paragraph(rec['suggestion'], styles['Normal']))
+            story.append(Spacer(1, 12))
+    
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def report_pdf_filename(report):
+    return f'ESG_Report_{report.attempt.user.company_name}_{report.generated_at.strftime("%Y%m%d")}.pdf'
+
+
+def store_report_pdf(report):
+    """
+    Pre-render the PDF into report.pdf_file so downloads only stream a file.
+    Returns False when reportlab is not installed.
+    """
+    try:
+        content = render_report_pdf(report)
+    except ImportError:
+        logger.info('reportlab is not installed, report %s is rendered on download', report.pk)
+        return False
+    
+    if report.pdf_file:
+        report.pdf_file.delete(save=False)
+    report.pdf_file.save(f'report_{report.attempt_id}.pdf', ContentFile(content), save=False)
+    Report.objects.filter(pk=report.pk).update(pdf_file=report.pdf_file.name)
+    return True
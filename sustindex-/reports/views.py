@@ -1,10 +1,15 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, FileResponse
 from django.utils import timezone
 from django.template.loader import render_to_string
 from questionnaire.models import QuestionnaireAttempt
+from questionnaire.services import get_score_snapshot
 from .models import Report, ReportSection
+from .services import (
+    build_report, create_report_sections, render_report_pdf, report_pdf_filename,
+    get_total_documents_count, get_category_documents_count, get_component_grade,
+)
 import json
 
 @login_required
@@ -15,16 +20,9 @@ def generate_report(request, attempt_id):
     if not attempt.is_completed:
         return JsonResponse({'error': 'Questionnaire not completed'}, status=400)
     
-    esg_scores = attempt.calculate_esg_scores()
+    esg_scores = get_score_snapshot(attempt)
     
-    report, created = Report.objects.get_or_create(
-        attempt=attempt,
-        defaults={'generated_at': timezone.now()}
-    )
-    
-    report.sections.all().delete()
-    
-    create_report_sections(report, attempt, esg_scores)
+    report = build_report(attempt, esg_scores)
     
     return redirect('view_report', report_id=report.id)
 
@@ -41,7 +39,7 @@ def view_report(request, report_id):
             'social': report.attempt.social_score,
             'governance': report.attempt.governance_score,
             'total': report.attempt.total_score,
-            'grade': report.attempt.esg_grade
+            'grade': report.attempt.overall_grade
         },
         'recommendations': report.attempt.get_recommendations(),
         'sections': report.sections.all()
@@ -54,89 +52,18 @@ def download_report_pdf(request, report_id):
     """Download report as PDF"""
     report = get_object_or_404(Report, id=report_id, attempt__user=request.user)
     
+    # Pre-rendered by the finalize job
+    if report.pdf_file:
+        try:
+            return FileResponse(report.pdf_file.open('rb'), as_attachment=True, filename=report_pdf_filename(report), content_type='application/pdf')
+        except FileNotFoundError:
+            pass
+    
     try:
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-        from reportlab.lib import colors
-        from io import BytesIO
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            textColor=colors.HexColor('#1b4332')
-        )
-        story.append(Paragraph("Sustainability Assessment Report", title_style))
-        story.append(Spacer(1, 20))
-        
-        company_info = [
-            ['Company:', report.attempt.user.company_name or 'N/A'],
-            ['Assessment Date:', report.attempt.completed_at.strftime('%Y-%m-%d') if report.attempt.completed_at else 'N/A'],
-            ['ESG Grade:', report.attempt.esg_grade],
-            ['Total Score:', f"{report.attempt.total_score:.1f}/100"]
-        ]
-        
-        company_table = Table(company_info, colWidths=[2*inch, 3*inch])
-        company_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f0f0')),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(company_table)
-        story.append(Spacer(1, 30))
-        
-        esg_data = [
-            ['ESG Component', 'Score', 'Grade'],
-            ['Environmental', f"{report.attempt.environmental_score:.1f}", get_component_grade(report.attempt.environmental_score)],
-            ['Social', f"{report.attempt.social_score:.1f}", get_component_grade(report.attempt.social_score)],
-            ['Governance', f"{report.attempt.governance_score:.1f}", get_component_grade(report.attempt.governance_score)],
-            ['Overall ESG', f"{report.attempt.total_score:.1f}", report.attempt.esg_grade]
-        ]
+        content = render_report_pdf(report)
         
-        esg_table = Table(esg_data, colWidths=[2*inch, 1.5*inch, 1.5*inch])
-        esg_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1b4332')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#e8f5e8'))
-        ]))
-        story.append(Paragraph("ESG Scores Breakdown", styles['Heading2']))
-        story.append(Spacer(1, 12))
-        story.append(esg_table)
-        story.append(Spacer(1, 30))
-        
-        recommendations = report.attempt.get_recommendations()
-        if recommendations:
-            story.append(Paragraph("Recommendations for Improvement", styles['Heading2']))
-            story.append(Spacer(1, 12))
-            
-            for i, rec in enumerate(recommendations, 1):
-                story.append(Paragraph(f"{i}. {rec['category']} ({rec['priority']} Priority)", styles['Heading3']))
-                story.append(Paragraph(rec['suggestion'], styles['Normal']))
-                story.append(Spacer(1, 12))
-        
-        doc.build(story)
-        buffer.seek(0)
-        
-        response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="ESG_Report_{report.attempt.user.company_name}_{report.generated_at.strftime("%Y%m%d")}.pdf"'
+        response = HttpResponse(content, content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{report_pdf_filename(report)}"'
         
         return response
         
@@ -145,95 +72,6 @@ def download_report_pdf(request, report_id):
     except Exception as e:
         return JsonResponse({'error': f'Error generating PDF: {str(e)}'}, status=500)
 
-def create_report_sections(report, attempt, esg_scores):
-    """Create report sections"""
-    
-    executive_summary = f"""
-    This sustainability assessment evaluates your organization's Environmental, Social, and Governance (ESG) performance.
-    
-    Overall ESG Score: {esg_scores['total']:.1f}/100 (Grade: {esg_scores['grade']})
-    
-    • Environmental Score: {esg_scores['environmental']:.1f}/100
-    • Social Score: {esg_scores['social']:.1f}/100  
-    • Governance Score: {esg_scores['governance']:.1f}/100
-    
-    This assessment is based on internationally recognized ESG frameworks and best practices.
-    
-    Supporting Documents: {get_total_documents_count(attempt)} files uploaded as evidence.
-    """
-    
-    ReportSection.objects.create(
-        report=report,
-        title="Executive Summary",
-        content=executive_summary,
-        order=1
-    )
-    
-    from questionnaire.models import Category
-    categories = Category.objects.all()
-    
-    for i, category in enumerate(categories, 2):
-        category_score = category.get_category_score(attempt)
-        documents_count = get_category_documents_count(attempt, category)
-        
-        content = f"""
-        Category: {category.name}
-        Score: {category_score:.1f}/100
-        Supporting Documents: {documents_count} files
-        
-        {category.description}
-        
-        Performance Analysis:
-        """
-        
-        if category_score >= 70:
-            content += "Excellent performance in this category. Continue current practices and look for opportunities to share best practices."
-        elif category_score >= 50:
-            content += "Good performance with room for improvement. Focus on addressing gaps identified in the assessment."
-        else:
-            content += "Significant improvement needed. This should be a priority area for your sustainability initiatives."
-        
-        # Add document details if available
-        if documents_count > 0:
-            content += f"\n\nEvidence provided: {documents_count} supporting documents were submitted for questions in this category, demonstrating commitment to transparency and documentation."
-        
-        ReportSection.objects.create(
-            report=report,
-            title=f"{category.name} Analysis",
-            content=content,
-            order=i
-        )
-
-def get_total_documents_count(attempt):
-    """Get total number of uploaded documents for an attempt"""
-    from questionnaire.models import UserDocument
-    return UserDocument.objects.filter(answer__attempt=attempt).count()
-
-def get_category_documents_count(attempt, category):
-    """Get number of uploaded documents for a specific category"""
-    from questionnaire.models import UserDocument
-    return UserDocument.objects.filter(
-        answer__attempt=attempt,
-        answer__question__category=category
-    ).count()
-
-def get_component_grade(score):
-    """Determine grade for each component"""
-    if score >= 80:
-        return 'A+'
-    elif score >= 70:
-        return 'A'
-    elif score >= 60:
-        return 'B+'
-    elif score >= 50:
-        return 'B'
-    elif score >= 40:
-        return 'C+'
-    elif score >= 30:
-        return 'C'
-    else:
-        return 'D'
-
 @login_required
 def reports_dashboard(request):
     """User reports dashboard"""
@@ -0,0 +1,212 @@
+"""
+Compiled read serializers.
+
+CompiledSerializer turns a ModelSerializer instance into a plan that builds
+the same representation from .values() rows: one query per level (the
+rows, then each nested serializer of a reverse foreign key) and no model
+instances. Conversions that return database values unchanged are skipped.
+The plan uses the serializer's fields after ?fields= / ?omit= trimming.
+
+Fields that are not model columns (method fields, model methods) are built
+by a compiled_<field>(row) method of the serializer from the lookup paths
+declared for the field in sparse_sources. A serializer can also define
+compiled_prepare(rows), called once with all rows before they are
+represented, and compiled_finalize(row, data) for what its
+to_representation() adds. Queryset annotations are always part of the
+rows.
+
+CompiledReadViewMixin serves the list and retrieve actions of a viewset
+with it, falling back to the serializer when it cannot be compiled.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import BasePermission
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+from rest_framework.response import Response
+
+from .sparse_fields import _add_path
+
+
+class NotCompilable(Exception):
+    """The serializer has a field the compiler cannot build"""
+
+
+# Exact field classes whose to_representation() returns database values as they are
+IDENTITY_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField, serializers.FloatField)
+
+
+class CompiledSerializer:
+    """Builds a ModelSerializer's representation from .values() rows (see the module docstring)"""
+    
+    def __init__(self, serializer):
+        if not isinstance(serializer, serializers.ModelSerializer):
+            raise NotCompilable(f'{type(serializer).__name__} is not a ModelSerializer')
+        self.serializer = serializer
+        self.model = serializer.Meta.model
+        self.columns = {self.model._meta.pk.name}
+        # (field name, row key, relation keys that skip the field when null, converter);
+        # hooks have no row key, nested serializers neither key nor converter
+        self.writers = []
+        # {field name: (CompiledSerializer, foreign key name on the nested model)}
+        self.nested = {}
+        self.prepare = getattr(serializer, 'compiled_prepare', None)
+        self.finalize = getattr(serializer, 'compiled_finalize', None)
+        
+        sparse_sources = getattr(serializer, 'sparse_sources', {})
+        for path in getattr(serializer, 'sparse_always', ()):
+            self._add(path)
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            hook = getattr(serializer, f'compiled_{name}', None)
+            if hook is not None:
+                for path in sparse_sources.get(name, ()):
+                    self._add(path)
+                self.writers.append((name, None, (), hook))
+            elif isinstance(field, serializers.ListSerializer):
+                self.nested[name] = self._compile_nested(name, field)
+                self.writers.append((name, None, (), None))
+            else:
+                self.writers.append(self._compile_field(name, field))
+    
+    def _add(self, path):
+        if not _add_path(self.model, path, self.columns, set()):
+            raise NotCompilable(f'{path} is not a column of {self.model.__name__}')
+    
+    def _compile_field(self, name, field):
+        if field.source == '*' or isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField)):
+            raise NotCompilable(f'{name} needs a compiled_{name}() method')
+        if isinstance(field, (ManyRelatedField, RelatedField)) and not isinstance(field, PrimaryKeyRelatedField):
+            raise NotCompilable(f'{name} is not a primary key relation')
+        key = '__'.join(field.source_attrs)
+        self._add(key)
+        if key not in self.columns:
+            raise NotCompilable(f'{name} is not a column of {self.model.__name__}')
+        # DRF leaves a field out when a relation on its source is null
+        relations = tuple('__'.join(field.source_attrs[:i]) for i in range(1, len(field.source_attrs)))
+        
+        if isinstance(field, PrimaryKeyRelatedField):
+            convert = None
+        elif isinstance(field, serializers.FileField):
+            convert = self._file_converter(field, key)
+        elif type(field) in IDENTITY_FIELDS:
+            convert = None
+        else:
+            convert = field.to_representation
+        return name, key, relations, convert
+    
+    def _file_converter(self, field, key):
+        storage = self.model._meta.get_field(key).storage
+        request = field.context.get('request')
+        use_url = getattr(field, 'use_url', True)
+        
+        def convert(name):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return convert
+    
+    def _compile_nested(self, name, field):
+        path = '__'.join(field.source_attrs)
+        try:
+            relation = self.model._meta.get_field(path)
+        except FieldDoesNotExist:
+            raise NotCompilable(f'{name} is not a relation of {self.model.__name__}')
+        if not relation.one_to_many:
+            raise NotCompilable(f'{name} is not a reverse foreign key')
+        child = CompiledSerializer(field.child)
+        child.columns.add(relation.field.name)
+        return child, relation.field.name
+    
+    def values(self, queryset, required=()):
+        """The values() queryset of the rows; required lists extra columns"""
+        annotations = [name for name in queryset.query.annotations if name not in self.columns]
+        return queryset.prefetch_related(None).values(*self.columns, *required, *annotations)
+    
+    def represent(self, rows):
+        """Representations of the given rows of values()"""
+        rows = list(rows)
+        if self.prepare is not None:
+            self.prepare(rows)
+        
+        pk_name = self.model._meta.pk.name
+        nested = {}
+        if rows and self.nested:
+            pks = [row[pk_name] for row in rows]
+            for name, (child, foreign_key) in self.nested.items():
+                child_rows = list(child.values(child.model._default_manager.filter(**{f'{foreign_key}__in': pks})))
+                grouped = nested[name] = {}
+                for child_row, data in zip(child_rows, child.represent(child_rows)):
+                    grouped.setdefault(child_row[foreign_key], []).append(data)
+        
+        results = []
+        for row in rows:
+            data = {}
+            for name, key, relations, convert in self.writers:
+                if relations and any(row[relation] is None for relation in relations):
+                    continue
+                if key is not None:
+                    value = row[key]
+                    data[name] = value if value is None or convert is None else convert(value)
+                elif convert is not None:
+                    data[name] = convert(row)
+                else:
+                    data[name] = nested[name].get(row[pk_name], [])
+            if self.finalize is not None:
+                data = self.finalize(row, data)
+            results.append(data)
+        return results
+    
+    def data(self, queryset):
+        """Representations of every object of a queryset"""
+        return self.represent(self.values(queryset))
+
+
+class CompiledReadViewMixin:
+    """
+    ViewSet mixin serving the compiled_actions with CompiledSerializer.
+    Falls back to the regular serializer when it cannot be compiled or the
+    view has object-level permissions (there is no object to check).
+    """
+    compiled_actions = ('list', 'retrieve')
+    
+    def get_compiled_serializer(self):
+        if self.action not in self.compiled_actions:
+            return None
+        for permission in self.get_permissions():
+            if type(permission).has_object_permission is not BasePermission.has_object_permission:
+                return None
+        try:
+            return CompiledSerializer(self.get_serializer())
+        except NotCompilable:
+            return None
+    
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        
+        # Cursor pagination reads its ordering fields from every row
+        ordering = getattr(self.paginator, 'ordering', None)
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        required = [field.lstrip('-') for field in ordering or ()]
+        rows = compiled.values(self.filter_queryset(self.get_queryset()), required)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.represent(page))
+        return Response(compiled.represent(rows))
+    
+    def retrieve(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().retrieve(request, *args, **kwargs)
+        
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        rows = compiled.values(self.filter_queryset(self.get_queryset()))
+        row = get_object_or_404(rows, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(compiled.represent([row])[0])
@@ -0,0 +1,160 @@
+"""
+HTTP conditional requests for read-only API views.
+
+Each tracked table has a version: a random token and the time it was set,
+stored in a TableVersion row and replaced by bump_table_versions() in the
+transaction that changes a row of the table. ConditionalViewMixin derives
+an ETag from the versions of the tables a view reads (one indexed query)
+and Last-Modified from their times. A request whose If-None-Match /
+If-Modified-Since still matches gets 304 Not Modified right after
+authentication and permission checks, before any queryset is evaluated or
+serialized.
+
+The versions live in the database rather than the cache so that every
+process, web or worker, sees a change as soon as it is committed, whatever
+the cache backend.
+"""
+import hashlib
+import logging
+import math
+import uuid
+
+from django.utils import timezone, translation
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+logger = logging.getLogger(__name__)
+
+
+# Lifetime of cached data derived from a table version (the token is in its key)
+VERSION_TIMEOUT = 60 * 5
+
+
+def _table(model):
+    return model._meta.label_lower
+
+
+def _new_versions(models):
+    from questionnaire.models import TableVersion
+    
+    now = timezone.now()
+    return [
+        TableVersion(table=_table(model), version=uuid.uuid4().hex, changed_at=now)
+        for model in sorted(set(models), key=_table)
+    ]
+
+
+def _read_versions(tables):
+    from questionnaire.models import TableVersion
+    
+    return {
+        table: (version, changed_at.timestamp())
+        for table, version, changed_at in TableVersion.objects.filter(table__in=tables)
+        .values_list('table', 'version', 'changed_at')
+    }
+
+
+def table_versions(models):
+    """
+    Returns:
+        dict: {model: (token, timestamp)}; missing versions are started
+    """
+    from questionnaire.models import TableVersion
+    
+    tables = {_table(model): model for model in models}
+    found = _read_versions(tables)
+    missing = [table for table in tables if table not in found]
+    if missing:
+        # A version started concurrently by another process wins
+        TableVersion.objects.bulk_create(_new_versions(tables[table] for table in missing), ignore_conflicts=True)
+        found.update(_read_versions(missing))
+    return {model: found[table] for table, model in tables.items()}
+
+
+def bump_table_versions(models):
+    """Replace the versions of these tables, as part of the current transaction"""
+    from questionnaire.models import TableVersion
+    
+    TableVersion.objects.bulk_create(
+        _new_versions(models),
+        update_conflicts=True, unique_fields=['table'], update_fields=['version', 'changed_at'],
+    )
+
+
+class NotModified(Exception):
+    """Raised from initial() to answer with the conditional response"""
+    
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalViewMixin:
+    """
+    ViewSet mixin answering GET/HEAD of the conditional_actions with ETag and
+    Last-Modified validators computed from the versions of
+    conditional_models, and 304 when the client's copy is current.
+    
+    The validators cover the URL (so ?fields=, ?expand= and filters), the
+    negotiated media type and the active language; views whose output also
+    depends on the time add to them in conditional_state(). The browsable
+    API is left out as its pages show the user.
+    """
+    conditional_models = ()
+    conditional_actions = ('list', 'retrieve')
+    cache_control = {'public': True, 'max_age': 0, 'must_revalidate': True}
+    
+    def conditional_state(self):
+        """
+        Returns:
+            tuple: (hashable state the output depends on besides the
+            tables, timestamp it last changed or None)
+        """
+        return None, None
+    
+    def get_validators(self, request):
+        """(ETag, Last-Modified timestamp) of this request, or None"""
+        if (
+            request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions
+            or request.accepted_renderer.format == 'api'
+        ):
+            return None
+        try:
+            versions = table_versions(self.conditional_models)
+        except Exception:
+            logger.exception('Table versions unavailable')
+            return None
+        
+        state, changed_at = self.conditional_state()
+        parts = (
+            sorted((model._meta.label_lower, token) for model, (token, _) in versions.items()),
+            request.get_full_path(), request.accepted_media_type, translation.get_language(), state,
+        )
+        etag = '"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+        last_modified = max([timestamp for _, timestamp in versions.values()] + [changed_at or 0])
+        # HTTP dates have whole seconds; rounding down would predate the change
+        return etag, math.ceil(last_modified)
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.conditional_validators = self.get_validators(request)
+        if self.conditional_validators is not None:
+            etag, last_modified = self.conditional_validators
+            response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                raise NotModified(response)
+    
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, 'conditional_validators', None)
+        if validators is not None and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, **self.cache_control)
+            patch_vary_headers(response, ('Accept', 'Accept-Language'))
+        return response
@@ -231,6 +231,32 @@ LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
 
+# Cache (Redis when REDIS_URL is set, otherwise per-process memory)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+
+# Write-behind buffer for autosaved answers (questionnaire/answer_buffer.py).
+# Needs a cache shared by all processes; WRITE_THROUGH turns buffering off
+# without losing the setting, e.g. while the cache is being replaced.
+ANSWER_BUFFER = {
+    'ENABLED': os.environ.get('ANSWER_BUFFER', 'False').lower() == 'true',
+    'WRITE_THROUGH': os.environ.get('ANSWER_BUFFER_WRITE_THROUGH', 'False').lower() == 'true',
+    'CACHE': 'default',
+    'MAX_AGE': 60,  # seconds before a buffered attempt is flushed
+    'MAX_ITEMS': 50,  # buffered questions before a flush
+}
+
+# With ASYNC_COMPLETION=True, completing an attempt only marks it and queues
+# a finalize job (scores, report sections, PDF) for the run_score_worker
+# process (the Procfile's worker). Off by default: the Render blueprints run
+# no worker, so attempts are finalized inside the request.
+ASYNC_COMPLETION = os.environ.get('ASYNC_COMPLETION', 'False').lower() == 'true'
+
 # REST Framework Configuration (only if installed)
 if REST_FRAMEWORK_INSTALLED:
     REST_FRAMEWORK = {
@@ -241,6 +267,11 @@ if REST_FRAMEWORK_INSTALLED:
         'DEFAULT_PERMISSION_CLASSES': [
             'rest_framework.permissions.IsAuthenticatedOrReadOnly',
         ],
+        # orjson-backed, falls back to the stdlib when orjson is not installed
+        'DEFAULT_RENDERER_CLASSES': [
+            'sustindex.renderers.FastJSONRenderer',
+            'rest_framework.renderers.BrowsableAPIRenderer',
+        ],
         'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
         'PAGE_SIZE': 20,
         'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -0,0 +1,210 @@
+"""
+Sparse fieldsets for the REST API.
+
+On GET requests ?fields=a,b keeps only these fields of the top-level
+serializer and ?omit=c,d drops fields. SparseFieldsMixin trims the output;
+SparseFieldsViewMixin trims the query as well: relations are only joined or
+prefetched for returned fields and the SELECT list is limited to the
+columns those fields read.
+
+A serializer field is mapped to columns through its source. Fields whose
+source is not a model field (method fields, model methods, properties)
+declare what they read in sparse_sources, and relations they need beyond
+that in sparse_prefetch_related. A field without either disables the
+column trimming (never the output trimming) for that serializer.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def _split(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+def requested_fields(request, available):
+    """
+    Names out of available to return for ?fields= / ?omit=, or None when
+    the request does not ask for a sparse fieldset
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    fields, omit = _split(params.get('fields')), _split(params.get('omit'))
+    if not fields and not omit:
+        return None
+    return [name for name in available if (not fields or name in fields) and name not in omit]
+
+
+def _resolve(model, path):
+    """
+    Split a lookup path into (column path, select_related path).
+    
+    The column path is None for reverse and many-to-many relations (nothing
+    to load from this table); None is returned when the path does not
+    consist of model fields.
+    """
+    parts = path.split('__')
+    relations = []
+    for i, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        last = i == len(parts) - 1
+        if field.is_relation and not field.concrete or field.many_to_many:
+            return None, '__'.join(relations) or None
+        if field.is_relation and not last:
+            relations.append(part)
+            model = field.related_model
+            continue
+        if not last:
+            return None
+        return '__'.join(parts), '__'.join(relations) or None
+    return None
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin for ?fields= / ?omit= (see the module docstring).
+    
+    sparse_sources: {field: [lookup paths the field reads]}
+    sparse_prefetch_related: {field: [prefetch lookups the field needs]}
+    sparse_always: lookup paths loaded whatever fields are returned
+    """
+    sparse_sources = {}
+    sparse_prefetch_related = {}
+    sparse_always = ()
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = requested_fields(self.context.get('request'), self.fields)
+        if keep is not None:
+            for name in set(self.fields) - set(keep):
+                self.fields.pop(name)
+    
+    @classmethod
+    def sparse_queryset(cls, queryset, names=None, required=()):
+        """
+        Load what the given fields (every readable field when names is None)
+        read: select_related for forward relations, nested serializers
+        prefetched with their own sparse_queryset, and only() when every
+        field maps to columns. required lists extra lookup paths to load.
+        """
+        fields = cls().fields
+        if names is None:
+            names = list(fields)
+        model = queryset.model
+        columns, selects, prefetches = set(), set(), []
+        exact = True
+        
+        for path in (*cls.sparse_always, *required):
+            exact = _add_path(model, path, columns, selects) and exact
+        
+        for name in names:
+            field = fields.get(name)
+            if field is None or field.write_only:
+                continue
+            prefetches.extend(cls.sparse_prefetch_related.get(name, ()))
+            if name in cls.sparse_sources:
+                for path in cls.sparse_sources[name]:
+                    exact = _add_path(model, path, columns, selects) and exact
+                continue
+            if field.source == '*':
+                exact = False
+                continue
+            
+            path = '__'.join(field.source_attrs)
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(nested, serializers.BaseSerializer):
+                prefetch = _nested_prefetch(model, path, nested)
+                if prefetch is None:
+                    exact = False
+                elif isinstance(prefetch, str):
+                    # Forward relation: joined with all its columns
+                    columns.add(path)
+                    selects.add(path)
+                else:
+                    prefetches.append(prefetch)
+                continue
+            exact = _add_path(model, path, columns, selects) and exact
+        
+        if selects:
+            queryset = queryset.select_related(*selects)
+        if prefetches:
+            queryset = queryset.prefetch_related(*dict.fromkeys(prefetches))
+        if exact:
+            queryset = queryset.only(*columns | {model._meta.pk.name})
+        return queryset
+
+
+def _add_path(model, path, columns, selects):
+    """Record a lookup path; False when it cannot be mapped to columns"""
+    resolved = _resolve(model, path)
+    if resolved is None:
+        return False
+    column, relation = resolved
+    if column:
+        columns.add(column)
+    if relation:
+        selects.add(relation)
+        # The foreign keys of a select_related chain must not be deferred
+        parts = relation.split('__')
+        columns.update('__'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    return True
+
+
+def _nested_prefetch(model, path, serializer):
+    """
+    How to load a nested serializer: the path itself for a forward relation
+    (select_related), a Prefetch for reverse and many-to-many relations or
+    None when the path is not a relation
+    """
+    if '__' in path:
+        return None
+    try:
+        field = model._meta.get_field(path)
+    except FieldDoesNotExist:
+        return None
+    if not field.is_relation:
+        return None
+    if field.concrete and not field.many_to_many:
+        return path
+    
+    related_model = field.related_model
+    queryset = related_model._default_manager.all()
+    if isinstance(serializer, SparseFieldsMixin) and isinstance(serializer, serializers.ModelSerializer):
+        # Reverse foreign keys need the column joining back to the parent
+        required = (field.field.name,) if field.one_to_many or field.one_to_one else ()
+        queryset = type(serializer).sparse_queryset(queryset, required=required)
+    return Prefetch(path, queryset=queryset)
+
+
+class SparseFieldsViewMixin:
+    """
+    ViewSet mixin loading only what the serializer of the sparse_actions
+    returns, after ?fields= / ?omit= and any trimming the serializer does
+    with the view's context. Views overriding get_queryset() call
+    sparse_queryset() on the queryset they build.
+    """
+    sparse_actions = ('list', 'retrieve')
+    
+    def get_queryset(self):
+        return self.sparse_queryset(super().get_queryset())
+    
+    def sparse_queryset(self, queryset):
+        serializer_class = self.get_serializer_class()
+        if self.action not in self.sparse_actions or not (
+            issubclass(serializer_class, SparseFieldsMixin)
+            and issubclass(serializer_class, serializers.ModelSerializer)
+        ):
+            return queryset
+        
+        names = list(self.get_serializer().fields)
+        # Cursor pagination reads its ordering fields from every row
+        ordering = getattr(self.paginator, 'ordering', None) if self.action == 'list' else None
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        required = tuple(field.lstrip('-') for field in ordering or ())
+        return serializer_class.sparse_queryset(queryset, names, required)